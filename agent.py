@@ -1,12 +1,34 @@
+import asyncio
 import json
 import sys
-from tools import AgentTools
+import time
+from typing import Any, Dict, Optional
+from pipeline import Stage, arun_dag, run_dag
+from tools import AgentTools, tool_error
+
+# seconds each stage of the parallel pipeline may take before it is reported as timed out
+DEFAULT_STAGE_TIMEOUTS = {"keywords": 60.0, "reviews": 30.0, "summary": 120.0, "statistics": 30.0}
+
+def _checked(result: Any) -> Any:
+    # the tools return their errors instead of raising them: a stage raises, so it is reported as failed and not as ok
+    error = tool_error(result)
+    if error:
+        raise RuntimeError(error)
+    return result
+
 class Agent:
 
-    def __init__(self, llm, retriever):
+    def __init__(self, llm, retriever, store=None, retrieval_mode: str = "dense", stage_timeouts: Optional[Dict[str, float]] = None,
+                 response_cache=None, keyword_mode: str = "llm", synonyms: Optional[Dict[str, list]] = None, semantic_cache=None,
+                 llm_limiter=None):
         self.llm = llm
         self.retriever = retriever
-        self.agent_tools = AgentTools(self.llm, self.retriever)
+        self.store = store
+        # SemanticCache of whole results, paraphrases of an answered query skip the pipeline (needs the store to embed the query)
+        self.semantic_cache = semantic_cache if store is not None else None
+        # pass the LLMLimiter of the other tools of the process, so the agent generations count against the same cap
+        self.agent_tools = AgentTools(self.llm, self.retriever, store, retrieval_mode, response_cache, keyword_mode, synonyms, llm_limiter=llm_limiter)
+        self.stage_timeouts = {**DEFAULT_STAGE_TIMEOUTS, **(stage_timeouts or {})}
 
     def run_sequenced(self, user_query: str) -> str:
         """Execute tools in a fixed sequence and return JSON result"""
@@ -57,7 +79,127 @@ class Agent:
             }
             return json.dumps(error_result, indent=2, ensure_ascii=False)
 
+    def run_parallel(self, user_query: str) -> str:
+        """Execute the same tools as run_sequenced as a dependency graph and return JSON result:
+            keywords -> reviews -> (summary | statistics), the last two running at the same time.
+            A stage that fails or times out leaves its field empty and the others are still returned (status "partial").
+        """
+        print(f"Starting parallel execution for: {user_query}", file=sys.stderr, flush=True)
+        start = time.perf_counter()
+        tools = self.agent_tools
+
+        def keywords_stage(_):
+            keywords = _checked(tools.extract_important_keywords(user_query))
+            return keywords.split(",") if isinstance(keywords, str) else keywords
+
+        outcomes = run_dag([
+            Stage("keywords", keywords_stage, timeout=self.stage_timeouts.get("keywords")),
+            Stage("reviews", lambda inputs: _checked(tools.retrieve_useful_reviews(inputs["keywords"])), ["keywords"], timeout=self.stage_timeouts.get("reviews")),
+            Stage("summary", lambda inputs: _checked(tools.summarize_reviews(inputs["reviews"])), ["reviews"], timeout=self.stage_timeouts.get("summary")),
+            Stage("statistics", lambda inputs: _checked(tools.get_reviews_statistics(inputs["reviews"])), ["reviews"], timeout=self.stage_timeouts.get("statistics"))
+        ])
+        return self._pipeline_result(user_query, outcomes, start)
+
+    async def arun_parallel(self, user_query: str, on_token=None, on_step=None) -> str:
+        """Async version of run_parallel, used by the MCP server: LLM calls are awaited, searches run in a worker thread.
+            on_token (async callable) receives the summary while it is generated, on_step (async callable, no arguments)
+            is awaited at the end of every stage and of every batch of a long summary.
+        """
+        print(f"Starting parallel execution for: {user_query}", file=sys.stderr, flush=True)
+        start = time.perf_counter()
+        tools = self.agent_tools
+
+        async def step(result):
+            if on_step is not None:
+                await on_step()
+            return _checked(result)
+
+        async def keywords_stage(_):
+            keywords = await step(await tools.aextract_important_keywords(user_query))
+            return keywords.split(",") if isinstance(keywords, str) else keywords
+
+        async def reviews_stage(inputs):
+            return await step(await tools.aretrieve_useful_reviews(inputs["keywords"]))
+
+        async def summary_stage(inputs):
+            return await step(await tools.asummarize_reviews(inputs["reviews"], on_token, on_step))
+
+        async def statistics_stage(inputs):
+            return await step(await tools.aget_reviews_statistics(inputs["reviews"]))
+
+        outcomes = await arun_dag([
+            Stage("keywords", keywords_stage, timeout=self.stage_timeouts.get("keywords")),
+            Stage("reviews", reviews_stage, ["keywords"], timeout=self.stage_timeouts.get("reviews")),
+            Stage("summary", summary_stage, ["reviews"], timeout=self.stage_timeouts.get("summary")),
+            Stage("statistics", statistics_stage, ["reviews"], timeout=self.stage_timeouts.get("statistics"))
+        ])
+        return self._pipeline_result(user_query, outcomes, start)
+
+    @staticmethod
+    def _pipeline_result(user_query: str, outcomes: Dict[str, Dict[str, Any]], start: float) -> str:
+        for name, outcome in outcomes.items():
+            print(f"Stage {name}: {outcome['status']} in {outcome['seconds']}s", file=sys.stderr, flush=True)
+
+        failed = [name for name, outcome in outcomes.items() if outcome["status"] != "ok"]
+        result = {
+            "query": user_query,
+            "keywords": outcomes["keywords"].get("result"),
+            "reviews_count": len(outcomes["reviews"].get("result") or []),
+            "summary": outcomes["summary"].get("result"),
+            "statistics": outcomes["statistics"].get("result"),
+            "status": "success" if not failed else ("error" if "reviews" in failed else "partial"),
+            "stages": {name: {k: v for k, v in outcome.items() if k != "result"} for name, outcome in outcomes.items()},
+            "seconds": round(time.perf_counter() - start, 3)
+        }
+        return json.dumps(result, indent=2, ensure_ascii=False)
+
+    def _cache_lookup(self, user_query: str):
+        # (query vector, collection generation, cached result JSON or None); never fails, the pipeline runs without the cache
+        if self.semantic_cache is None:
+            return None, None, None
+        try:
+            start = time.perf_counter()
+            generation = self.store.generation
+            vector = self.store.embed_query(user_query)
+            hit = self.semantic_cache.get(vector, generation)
+            if hit is None:
+                return vector, generation, None
+            print(f"Semantic cache hit for: {user_query} (answered for: {hit['query']}, similarity {hit['similarity']})", file=sys.stderr, flush=True)
+            result = json.loads(hit["value"])
+            result["query"] = user_query
+            result["cache"] = {"hit": True, "query": hit["query"], "similarity": hit["similarity"], "age_seconds": hit["age_seconds"]}
+            result["seconds"] = round(time.perf_counter() - start, 3)
+            return vector, generation, json.dumps(result, indent=2, ensure_ascii=False)
+        except Exception as e:
+            print(f"Semantic cache lookup failed: {e}", file=sys.stderr, flush=True)
+            return None, None, None
+
+    def _cache_store(self, user_query: str, vector, generation, result: str) -> None:
+        # only complete answers are reused, a partial one (e.g. the summary timed out or the LLM was down) is computed again next time
+        if vector is None:
+            return
+        parsed = json.loads(result)
+        complete = parsed.get("status") == "success" and all(stage.get("status") == "ok" for stage in parsed.get("stages", {}).values())
+        if complete and not any(tool_error(parsed.get(field)) for field in ("keywords", "summary", "statistics")):
+            self.semantic_cache.put(user_query, vector, result, generation)
+
     def process_query(self, user_query: str) -> str:
-        """Process query using sequenced execution"""
-        return self.run_sequenced(user_query)
+        """Process query using the parallel pipeline"""
+        vector, generation, cached = self._cache_lookup(user_query)
+        if cached is not None:
+            return cached
+        result = self.run_parallel(user_query)
+        self._cache_store(user_query, vector, generation, result)
+        return result
+
+    async def aprocess_query(self, user_query: str, on_token=None, on_step=None) -> str:
+        vector, generation, cached = await asyncio.to_thread(self._cache_lookup, user_query) # embedding the query may call the model
+        if cached is not None:
+            summary = json.loads(cached).get("summary")
+            if on_token is not None and summary:
+                await on_token(summary)
+            return cached
+        result = await self.arun_parallel(user_query, on_token, on_step)
+        self._cache_store(user_query, vector, generation, result)
+        return result
 
@@ -0,0 +1,132 @@
+"""
+Corpus-wide aggregate tables (ratings by month, year and title keyword), kept next to the vector store.
+"""
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from lexical import tokenize
+
+ALL = "*" # row of the whole corpus, the other rows are title keywords
+UNDATED = "unknown"
+GROUPINGS = ["month", "year", "keyword"]
+MONTH_PATTERN = re.compile(r"^(\d{4})-(\d{2})")
+
+# a cell is [reviews, rated reviews, sum of the ratings, 1 star, 2 stars, 3 stars, 4 stars, 5 stars]
+CELL_SIZE = 8
+
+def _month(metadata: Dict[str, Any]) -> str:
+    match = MONTH_PATTERN.match(str(metadata.get("date") or ""))
+    return f"{match.group(1)}-{match.group(2)}" if match else UNDATED
+
+def _rating(metadata: Dict[str, Any]) -> Optional[float]:
+    rating = metadata.get("rating")
+    return float(rating) if isinstance(rating, (int, float)) and rating == rating else None # rating == rating drops NaN
+
+def _title_terms(metadata: Dict[str, Any]) -> List[str]:
+    title = metadata.get("title")
+    if not title or title == "No Title":
+        return []
+    return list(dict.fromkeys(tokenize(title))) # a keyword counts once per review
+
+def _summary(cell: List[float]) -> Dict[str, Any]:
+    return {
+        "count": int(cell[0]),
+        "rated": int(cell[1]),
+        "average_rating": round(cell[2] / cell[1], 3) if cell[1] else None,
+        "histogram": {str(star): int(cell[2 + star]) for star in range(1, 6)}
+    }
+
+class ReviewAggregates:
+    """Counters {keyword or "*": {"YYYY-MM": cell}} updated as reviews are added and removed, so reading them never touches the reviews.
+        Years and keyword totals are summed from the monthly cells when queried.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.tables: Dict[str, Dict[str, List[float]]] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    @property
+    def documents(self) -> int:
+        return int(sum(cell[0] for cell in self.tables.get(ALL, {}).values()))
+
+    def add(self, metadatas: Iterable[Dict[str, Any]]) -> None:
+        self._update(metadatas, 1)
+
+    def remove(self, metadatas: Iterable[Dict[str, Any]]) -> None:
+        self._update(metadatas, -1)
+
+    def _update(self, metadatas: Iterable[Dict[str, Any]], sign: int) -> None:
+        with self._lock:
+            for metadata in metadatas:
+                month = _month(metadata)
+                rating = _rating(metadata)
+                for row in [ALL] + _title_terms(metadata):
+                    cell = self.tables.setdefault(row, {}).setdefault(month, [0] * CELL_SIZE)
+                    cell[0] += sign
+                    if rating is not None:
+                        cell[1] += sign
+                        cell[2] += sign * rating
+                        cell[2 + min(5, max(1, int(rating + 0.5)))] += sign # half stars round up
+                    if cell[0] <= 0:
+                        del self.tables[row][month]
+                        if not self.tables[row]:
+                            del self.tables[row]
+
+    def query(self, group_by: str = "year", keyword: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+        """Aggregates grouped by "month", "year" (optionally for one title keyword only) or "keyword" (most reviewed keywords first)"""
+        if group_by not in GROUPINGS:
+            raise ValueError(f"Unknown grouping: {group_by} (available: {GROUPINGS})")
+        row = ALL
+        if keyword:
+            terms = tokenize(keyword)
+            if len(terms) != 1:
+                raise ValueError(f"Expected a single keyword, got: {keyword}")
+            row = terms[0]
+
+        with self._lock:
+            if group_by == "keyword":
+                totals = {term: self._total(months.values()) for term, months in self.tables.items() if term != ALL}
+                top = sorted(totals.items(), key=lambda item: (-item[1][0], item[0]))[:limit]
+                groups = [{"keyword": term, **_summary(cell)} for term, cell in top]
+            else:
+                months = self.tables.get(row, {})
+                if group_by == "year":
+                    years: Dict[str, List[float]] = {}
+                    for month, cell in months.items():
+                        year = month[:4] if month != UNDATED else UNDATED
+                        years[year] = self._total([years.get(year, [0] * CELL_SIZE), cell])
+                    months = years
+                groups = [{group_by: period, **_summary(cell)} for period, cell in sorted(months.items())]
+            overall = _summary(self._total(self.tables.get(row, {}).values()))
+        return {"group_by": group_by, "keyword": row if row != ALL else None, "overall": overall, "groups": groups}
+
+    @staticmethod
+    def _total(cells: Iterable[List[float]]) -> List[float]:
+        total = [0] * CELL_SIZE
+        for cell in cells:
+            total = [a + b for a, b in zip(total, cell)]
+        return total
+
+    def clear(self) -> None:
+        with self._lock:
+            self.tables = {}
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.tables, f)
+            os.replace(self.path + ".tmp", self.path)
+
+    def load(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as f:
+            tables = json.load(f)
+        with self._lock:
+            self.tables = tables
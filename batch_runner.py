@@ -0,0 +1,167 @@
+"""
+Non-interactive batch mode: runs the tool calls of a JSONL file against the MCP server, several at a time,
+and appends one result per line to an output JSONL file as they complete. Requests already in the output are skipped,
+so an interrupted run is resumed by running the same command again.
+
+    python batch_runner.py questions.jsonl --output results.jsonl --concurrency 4
+
+Each input line is a tool call {"id": "q1", "tool": "retrieve_useful_reviews", "arguments": {"keywords": ["mouse"]}}
+or an agent query {"id": "q2", "query": "Is the mouse heavy?"}; the id is optional (line-<n> by default).
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+from tools import tool_error
+
+def load_requests(path: str) -> List[Dict[str, Any]]:
+    requests = []
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Line {number} skipped, invalid JSON: {e}", file=sys.stderr)
+                continue
+            if "query" in item and "tool" not in item:
+                item = {**item, "tool": "agent", "arguments": {"user_query": item["query"]}}
+            if "tool" not in item:
+                print(f"Line {number} skipped, no tool or query", file=sys.stderr)
+                continue
+            requests.append({"id": str(item.get("id", f"line-{number}")), "tool": item["tool"], "arguments": item.get("arguments", {})})
+    return requests
+
+def completed_ids(path: str, retry_errors: bool = False) -> Set[str]:
+    # ids already in the output file, i.e. done by a previous (possibly interrupted) run
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError: # last line cut by the interruption
+                continue
+            if record.get("status") == "ok" or not retry_errors:
+                done.add(record["id"])
+    return done
+
+def _parse_result(tool: str, result: Optional[Dict[str, Any]]) -> Any:
+    if result is None:
+        raise RuntimeError("No response (timed out or server down)")
+    text = result["content"][0]["text"] if result.get("content") else ""
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError:
+        value = text
+    error = tool_error(value)
+    if error is not None:
+        raise RuntimeError(error)
+    if tool == "agent" and isinstance(value, dict) and value.get("status") != "success": # a failed stage, see Agent._pipeline_result
+        failed = {name: stage.get("error", stage.get("status")) for name, stage in (value.get("stages") or {}).items() if stage.get("status") != "ok"}
+        raise RuntimeError(f"Agent pipeline {value.get('status')}: {json.dumps(failed, ensure_ascii=False)}")
+    return value
+
+async def run_batch(client, requests: List[Dict[str, Any]], output_path: str, concurrency: int = 4, timeout: float = 300.0,
+                    retries: int = 5) -> List[Dict[str, Any]]:
+    """Runs the requests with at most concurrency in flight, appending each record to output_path as soon as it completes.
+        Calls refused because the server queue is full are retried with exponential backoff. Returns the records of this run.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    records: List[Dict[str, Any]] = []
+
+    with open(output_path, "a", encoding="utf-8") as output:
+        async def run_one(request: Dict[str, Any]) -> None:
+            async with semaphore:
+                start = time.perf_counter()
+                record = {"id": request["id"], "tool": request["tool"], "arguments": request["arguments"]}
+                for attempt in range(retries + 1):
+                    try:
+                        record.update(status="ok", result=_parse_result(request["tool"], await client.call_tool(request["tool"], request["arguments"], timeout=timeout)))
+                        record.pop("error", None)
+                        break
+                    except Exception as e:
+                        record.update(status="error", error=str(e))
+                        record.pop("result", None)
+                        if "busy" not in str(e).lower() or attempt == retries:
+                            break
+                        await asyncio.sleep(0.5 * 2 ** attempt)
+                record["seconds"] = round(time.perf_counter() - start, 4)
+                records.append(record)
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush() # an interruption loses at most the calls in flight
+                print(f"[{len(records)}/{len(requests)}] {record['id']} {record['tool']}: {record['status']} in {record['seconds']}s", file=sys.stderr)
+
+        await asyncio.gather(*[run_one(request) for request in requests])
+    return records
+
+def latency_report(records: List[Dict[str, Any]], seconds: float) -> Dict[str, Any]:
+    """Throughput of the run and latency percentiles (seconds) per tool"""
+    tools: Dict[str, Dict[str, Any]] = {}
+    for tool in sorted({r["tool"] for r in records}):
+        latencies = [r["seconds"] for r in records if r["tool"] == tool]
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        tools[tool] = {
+            "requests": len(latencies),
+            "errors": sum(r["status"] != "ok" for r in records if r["tool"] == tool),
+            "p50": round(float(p50), 3),
+            "p95": round(float(p95), 3),
+            "p99": round(float(p99), 3)
+        }
+    return {
+        "requests": len(records),
+        "errors": sum(r["status"] != "ok" for r in records),
+        "seconds": round(seconds, 3),
+        "requests_per_second": round(len(records) / seconds, 3) if seconds > 0 else 0.0,
+        "tools": tools
+    }
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n{report['requests']} requests ({report['errors']} errors) in {report['seconds']}s, {report['requests_per_second']} requests/s\n")
+    print(f"{'tool':<32}{'requests':>10}{'errors':>8}{'p50 s':>10}{'p95 s':>10}{'p99 s':>10}")
+    for tool, stats in report["tools"].items():
+        print(f"{tool:<32}{stats['requests']:>10}{stats['errors']:>8}{stats['p50']:>10}{stats['p95']:>10}{stats['p99']:>10}")
+
+async def main() -> None:
+    from mcp_client import SimpleMCPClient
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of tool calls or agent queries")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL file the results are appended to")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at the same time")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Seconds without news from the server before a request fails")
+    parser.add_argument("--retry-errors", action="store_true", help="Run again the requests that failed in a previous run")
+    parser.add_argument("--report", help="Also write the report to this JSON file")
+    parser.add_argument("--url", help="Run against a shared server (python mcp_server.py --transport http) instead of starting one")
+    args = parser.parse_args()
+
+    done = completed_ids(args.output, args.retry_errors)
+    requests = [r for r in load_requests(args.input) if r["id"] not in done]
+    print(f"{len(requests)} requests to run, {len(done)} already done", file=sys.stderr)
+    if not requests:
+        return
+
+    client = SimpleMCPClient(args.url)
+    client.verbose = False
+    try:
+        if not await client.start_server():
+            return
+        start = time.perf_counter()
+        records = await run_batch(client, requests, args.output, args.concurrency, args.timeout)
+        report = latency_report(records, time.perf_counter() - start)
+    finally:
+        await client.stop_server()
+    print_report(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""
+Micro-benchmarks for the reviews agent. Synthetic data is used, so Ollama does not need to be running.
+
+    python benchmark.py backends --documents 100000 --dimension 1024 --queries 200
+"""
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List
+
+import numpy as np
+from langchain_core.documents import Document
+
+def _peak_rss_mb() -> float:
+    try:
+        import resource # not available on Windows
+    except ImportError:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024 # bytes on macOS, kilobytes on Linux
+
+def _percentile(values: List[float], p: float) -> float:
+    return float(np.percentile(values, p)) if values else 0.0
+
+def _run_backend(name: str, documents: int, dimension: int, queries: int, k: int, seed: int) -> Dict[str, Any]:
+    # runs in its own process, so the peak memory of one backend does not leak into the other
+    from vector import BACKENDS
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((documents, dimension), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) # unit vectors, so l2 (chroma default) and cosine rank alike
+    query_vectors = rng.standard_normal((queries, dimension), dtype=np.float32)
+    rss_before = _peak_rss_mb()
+
+    with tempfile.TemporaryDirectory() as db_location:
+        backend = BACKENDS[name](db_location, "benchmark", None)
+        start = time.perf_counter()
+        for offset in range(0, documents, 1000):
+            batch = vectors[offset:offset + 1000]
+            ids = [str(i) for i in range(offset, offset + len(batch))]
+            backend.upsert(ids, batch.tolist(), [Document(page_content=f"review {i}", metadata={"rating": 3.0}) for i in ids])
+        load_seconds = time.perf_counter() - start
+
+        backend.search_by_vector(query_vectors[0].tolist(), k) # warm-up
+        latencies = []
+        results = []
+        for query in query_vectors:
+            start = time.perf_counter()
+            hits = backend.search_by_vector(query.tolist(), k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            results.append([doc.page_content for doc, _ in hits])
+
+    return {
+        "backend": name,
+        "load_seconds": round(load_seconds, 2),
+        "p50_ms": round(_percentile(latencies, 50), 3),
+        "p95_ms": round(_percentile(latencies, 95), 3),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "rss_growth_mb": round(_peak_rss_mb() - rss_before, 1),
+        "results": results
+    }
+
+def benchmark_backends(args: argparse.Namespace) -> None:
+    reports = []
+    for name in args.backend:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            reports.append(executor.submit(_run_backend, name, args.documents, args.dimension, args.queries, args.k, args.seed).result())
+
+    exact = next((r["results"] for r in reports if r["backend"] == "numpy"), None) # numpy top-k is exact
+    print(f"\n{args.documents} documents, dimension {args.dimension}, {args.queries} queries, k={args.k}\n")
+    print(f"{'backend':<10}{'load s':>10}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}{'peak MB':>10}{'growth MB':>11}{'recall':>9}")
+    for report in reports:
+        recall = float("nan")
+        if exact is not None:
+            recall = statistics.fmean(len(set(a) & set(b)) / len(b) for a, b in zip(report["results"], exact) if b)
+        print(f"{report['backend']:<10}{report['load_seconds']:>10}{report['p50_ms']:>10}{report['p95_ms']:>10}{report['mean_ms']:>10}"
+              f"{report['peak_rss_mb']:>10}{report['rss_growth_mb']:>11}{recall:>9.3f}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backends = commands.add_parser("backends", help="Compare query latency and memory of the vector backends")
+    backends.add_argument("--backend", nargs="+", default=["numpy", "chroma"], choices=["numpy", "chroma"])
+    backends.add_argument("--documents", type=int, default=50000)
+    backends.add_argument("--dimension", type=int, default=1024) # mxbai-embed-large
+    backends.add_argument("--queries", type=int, default=200)
+    backends.add_argument("--k", type=int, default=5)
+    backends.add_argument("--seed", type=int, default=42)
+    backends.set_defaults(func=benchmark_backends)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Small in-memory caches for the query hot path, and the pieces shared by the on-disk LRU caches.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+import numpy as np
+
+class LRUClock:
+    """Wall-clock timestamps for last_used columns, strictly increasing so two accesses in the same clock tick still have an order.
+        Not thread-safe by itself: callers take it under the lock that already guards their writes.
+    """
+
+    def __init__(self):
+        self._last = 0.0
+
+    def __call__(self) -> float:
+        self._last = max(time.time(), self._last + 1e-6)
+        return self._last
+
+def open_lru_table(path: str, table: str, columns: str) -> sqlite3.Connection:
+    """SQLite connection to path (its directory is created) with the table and an index on its last_used column,
+        the layout of the on-disk LRU caches. The connection is shared by threads, callers serialize its use with a lock.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+    connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_used ON {table} (last_used)")
+    connection.commit()
+    return connection
+
+class LRUCache:
+    """Thread-safe mapping that keeps the max_size most recently used entries, max_size=0 disables it.
+        With a ttl (seconds) entries also expire that long after being stored.
+        None is never cached, so get() returning None always means a miss.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None):
+        self.max_size = max(0, int(max_size))
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict() # key -> (value, expiry time or None)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        # ttl overrides the cache ttl for this entry
+        if self.max_size == 0 or value is None:
+            return
+        ttl = ttl if ttl is not None else self.ttl
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl if ttl is not None else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False) # least recently used first
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+class SemanticCache:
+    """Answers keyed by the embedding of the query that produced them: a lookup hits the most similar stored query
+        if its cosine similarity is at least threshold, so paraphrases of an answered query are served without recomputing it.
+        Bounded to max_entries (least recently used evicted first), entries expire ttl seconds after being stored (None: never),
+        and the whole cache is emptied when the collection generation changes (re-ingestion, sync).
+    """
+
+    def __init__(self, threshold: float = 0.92, max_entries: int = 256, ttl: Optional[float] = 3600.0):
+        self.threshold = threshold
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = None
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict() # id -> {query, vector (unit length), value, created, expires}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _unit(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _check_generation(self, generation: Any) -> None:
+        if generation != self.generation:
+            self._entries.clear()
+            self.generation = generation
+
+    def get(self, vector: List[float], generation: Any = None) -> Optional[Dict[str, Any]]:
+        """Returns {"value", "query", "similarity", "age_seconds"} of the closest stored query, or None on a miss"""
+        with self._lock:
+            self._check_generation(generation)
+            now = time.monotonic()
+            for entry_id in [i for i, entry in self._entries.items() if entry["expires"] is not None and entry["expires"] <= now]:
+                del self._entries[entry_id]
+            if not self._entries:
+                self.misses += 1
+                return None
+            ids = list(self._entries)
+            similarities = np.stack([self._entries[i]["vector"] for i in ids]) @ self._unit(vector)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            entry = self._entries[ids[best]]
+            self._entries.move_to_end(ids[best])
+            self.hits += 1
+            return {
+                "value": entry["value"],
+                "query": entry["query"],
+                "similarity": round(float(similarities[best]), 4),
+                "age_seconds": round(time.time() - entry["created"], 3)
+            }
+
+    def put(self, query: str, vector: List[float], value: Any, generation: Any = None) -> None:
+        # generation is the one read before computing value: an answer computed while the collection changed is dropped
+        if self.max_entries == 0 or value is None:
+            return
+        with self._lock:
+            if not self._entries and self.hits + self.misses == 0:
+                self.generation = generation # first use
+            if generation != self.generation:
+                return
+            self._entries[self._next_id] = {
+                "query": query,
+                "vector": self._unit(vector),
+                "value": value,
+                "created": time.time(),
+                "expires": time.monotonic() + self.ttl if self.ttl is not None else None
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,79 @@
+"""
+Persistence of the cluster summaries built offline by clusters.py: the clusters as JSON and their centroids as a .npy file.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def unit_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+class ClusterSummaries:
+    """Precomputed clusters {"id", "size", "keywords", "summary", "statistics"} and their centroids, stored in path (JSON)
+        and path with a .npy extension (centroids). documents is the collection size when they were built, to tell when they are stale.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.clusters: List[Dict[str, Any]] = []
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.documents = 0
+        self.built = None
+        self._lock = threading.Lock()
+        if self.saved():
+            self.load()
+
+    def _centroids_path(self) -> str:
+        return os.path.splitext(self.path)[0] + ".npy"
+
+    def saved(self) -> bool:
+        return bool(self.path) and os.path.exists(self.path) and os.path.exists(self._centroids_path())
+
+    def __len__(self) -> int:
+        return len(self.clusters)
+
+    def set(self, clusters: List[Dict[str, Any]], centroids: np.ndarray, documents: int) -> None:
+        with self._lock:
+            self.clusters = clusters
+            self.centroids = unit_rows(np.asarray(centroids, dtype=np.float32))
+            self.documents = documents
+            self.built = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    def nearest(self, vector: List[float], n: int = 3) -> List[Dict[str, Any]]:
+        """The n clusters closest to the vector (cosine similarity to the centroid), the closest first"""
+        with self._lock:
+            if not self.clusters:
+                return []
+            query = np.asarray(vector, dtype=np.float32)
+            similarities = self.centroids @ (query / (np.linalg.norm(query) or 1))
+            top = np.argsort(-similarities)[:max(1, n)]
+            return [{**self.clusters[i], "similarity": round(float(similarities[i]), 4)} for i in top]
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"documents": self.documents, "built": self.built, "clusters": self.clusters}, f, ensure_ascii=False)
+            with open(self._centroids_path() + ".tmp", "wb") as f:
+                np.save(f, self.centroids)
+            os.replace(self._centroids_path() + ".tmp", self._centroids_path())
+            os.replace(self.path + ".tmp", self.path)
+
+    def load(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        centroids = np.load(self._centroids_path())
+        if len(centroids) != len(data["clusters"]): # interrupted save
+            logger.warning(f"Cluster summaries in {self.path} do not match their centroids, ignored")
+            return
+        with self._lock:
+            self.clusters, self.centroids, self.documents, self.built = data["clusters"], centroids, data["documents"], data.get("built")
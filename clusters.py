@@ -0,0 +1,147 @@
+"""
+Offline clustering of the stored reviews: k-means on the embedding matrix, then one summary and one set of statistics per cluster,
+persisted next to the vector store. Broad queries are answered from the nearest clusters, with no generation at query time.
+
+    python clusters.py --clusters 50 --backend chroma
+"""
+import argparse
+import logging
+import math
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+from cluster_summaries import ClusterSummaries, unit_rows
+from lexical import tokenize
+from tools import compute_review_statistics, tool_error
+
+logger = logging.getLogger(__name__)
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+    # nearest centroid by cosine similarity, in chunks so the similarity matrix stays small for large collections
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        labels[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+    return labels
+
+def kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 30, seed: int = 42, tolerance: float = 1e-4) -> Tuple[np.ndarray, np.ndarray]:
+    """Spherical k-means (cosine similarity) with k-means++ seeding, every step is a matrix product over all the vectors.
+        Returns (unit centroids, label of each vector); stops early when less than tolerance of the labels change.
+    """
+    vectors = unit_rows(np.asarray(vectors, dtype=np.float32))
+    n_clusters = max(1, min(n_clusters, len(vectors)))
+    rng = np.random.default_rng(seed)
+
+    # k-means++: each new seed is drawn with probability proportional to its distance from the closest seed so far
+    centroids = np.empty((n_clusters, vectors.shape[1]), dtype=np.float32)
+    centroids[0] = vectors[rng.integers(len(vectors))]
+    distances = np.clip(1 - vectors @ centroids[0], 0, None)
+    for c in range(1, n_clusters):
+        total = distances.sum()
+        centroids[c] = vectors[rng.choice(len(vectors), p=distances / total) if total > 0 else rng.integers(len(vectors))]
+        distances = np.minimum(distances, np.clip(1 - vectors @ centroids[c], 0, None))
+
+    labels = _assign(vectors, centroids)
+    for _ in range(iterations):
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        empty = np.flatnonzero(np.bincount(labels, minlength=n_clusters) == 0)
+        if len(empty):
+            # an empty cluster restarts from the vectors farthest from their centroid
+            farthest = np.argsort(np.einsum("ij,ij->i", vectors, centroids[labels]))[:len(empty)]
+            sums[empty] = vectors[farthest]
+        centroids = unit_rows(sums)
+        new_labels = _assign(vectors, centroids)
+        changed = np.mean(new_labels != labels)
+        labels = new_labels
+        if changed <= tolerance:
+            break
+    return centroids, labels
+
+def _cluster_keywords(titles: List[List[str]], document_frequency: Counter, documents: int, limit: int = 5) -> List[str]:
+    # title terms frequent in the cluster and rare in the corpus (tf-idf), e.g. "headset", "latency"
+    counts = Counter(term for terms in titles for term in terms)
+    weights = {term: count * math.log(documents / document_frequency[term]) for term, count in counts.items() if document_frequency[term] < documents}
+    return sorted(weights, key=lambda term: (-weights[term], term))[:limit]
+
+def build_clusters(store, summarize: Callable[[list], str], n_clusters: int = 50, representatives: int = 40,
+                   iterations: int = 30, seed: int = 42) -> ClusterSummaries:
+    """Clusters every review of the store, summarizes the representatives (closest to the centroid) of each cluster with
+        summarize(reviews) and computes the statistics on all its members; the result replaces store.clusters and is saved.
+        Raises (and leaves store.clusters unchanged) if a summary fails.
+    """
+    start = time.perf_counter()
+    metadatas: List[Dict[str, Any]] = []
+    contents: List[str] = []
+    blocks = []
+    for _, documents, embeddings in store.backend.iter_records(include_embeddings=True):
+        metadatas.extend(d.metadata for d in documents)
+        contents.extend(d.page_content for d in documents)
+        blocks.append(embeddings)
+    if not contents:
+        raise ValueError("The collection is empty, nothing to cluster")
+    vectors = unit_rows(np.concatenate(blocks).astype(np.float32, copy=False))
+    del blocks
+    logger.info(f"Clustering {len(vectors)} reviews into {n_clusters} clusters...")
+    centroids, labels = kmeans(vectors, n_clusters, iterations, seed)
+
+    titles = [list(dict.fromkeys(tokenize(m.get("title") or ""))) if m.get("title") != "No Title" else [] for m in metadatas]
+    document_frequency = Counter(term for terms in titles for term in terms)
+    clusters = []
+    kept = [] # centroids of the non-empty clusters
+    for cluster_id in range(len(centroids)):
+        members = np.flatnonzero(labels == cluster_id)
+        if not len(members):
+            continue
+        similarities = vectors[members] @ centroids[cluster_id]
+        members = members[np.argsort(-similarities)]
+        similarities = np.sort(similarities)[::-1]
+        reviews = [
+            {"content": contents[i], "rating": metadatas[i].get("rating"), "date": metadatas[i].get("date"),
+             "title": metadatas[i].get("title"), "similarity": float(s)}
+            for i, s in zip(members, similarities)
+        ]
+        logger.info(f"Summarizing cluster {len(clusters) + 1}/{len(centroids)} ({len(members)} reviews)...")
+        summary = summarize(reviews[:representatives])
+        error = tool_error(summary)
+        if error: # e.g. the LLM is down: an error text must not be served as the cluster summary, the saved clusters are kept
+            raise RuntimeError(f"Cluster {len(clusters) + 1} could not be summarized: {error}")
+        clusters.append({
+            "id": len(clusters),
+            "size": int(len(members)),
+            "keywords": _cluster_keywords([titles[i] for i in members], document_frequency, len(vectors)),
+            "summary": summary,
+            "statistics": compute_review_statistics(reviews) # similarity to the centroid weighs the ratings
+        })
+        kept.append(cluster_id)
+
+    store.clusters.set(clusters, centroids[kept], len(vectors))
+    store.clusters.save()
+    store._collection_changed() # a running server (another process) reloads the summaries, see ReviewsVectorStore.refresh
+    logger.info(f"{len(clusters)} cluster summaries built in {time.perf_counter() - start:.1f}s")
+    return store.clusters
+
+def main() -> None:
+    from langchain_ollama import OllamaLLM
+    from tools import AgentTools
+    from vector import BACKENDS, ReviewsVectorStore
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--representatives", type=int, default=40, help="Reviews closest to the centroid that are summarized")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--backend", default="chroma", choices=list(BACKENDS))
+    parser.add_argument("--model", default="llama3.2:latest")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    store = ReviewsVectorStore(backend=args.backend)
+    store.init_database(auto_recreate=False)
+    tools = AgentTools(OllamaLLM(model=args.model), None, store)
+    build_clusters(store, tools.summarize_reviews, args.clusters, args.representatives, args.iterations, args.seed)
+
+if __name__ == "__main__":
+    main()
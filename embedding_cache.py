@@ -0,0 +1,132 @@
+"""
+Persistent, content-addressed cache for embeddings, shared by ingestion and queries.
+"""
+import hashlib
+import os
+import threading
+from array import array
+from typing import Any, Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+from caches import LRUClock, open_lru_table
+
+def _cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\x1f{text}".encode("utf-8")).hexdigest()
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding function and stores every vector on disk, keyed by (model name, text hash).
+        Once the cache grows over max_size_mb the least recently used vectors are evicted.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, cache_path: str, max_size_mb: float = 512):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache_path = cache_path
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._now = LRUClock()
+
+        self._lock = threading.Lock() # ingestion embeds batches from several threads
+        self._connection = open_lru_table(
+            cache_path, "embeddings", "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL"
+        )
+        self._size_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [_cache_key(self.model_name, t) for t in texts]
+        cached = self._lookup(keys)
+
+        missing = {} # key -> text, duplicated texts are embedded once
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            cached.update(computed)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = _cache_key(self.model_name, text)
+        cached = self._lookup([key])
+        with self._lock:
+            if key in cached:
+                self.hits += 1
+                return cached[key]
+            self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "model": self.model_name,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": entries,
+                "size_bytes": self._size_bytes,
+                "max_bytes": self.max_bytes
+            }
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500): # sqlite limits the number of parameters per statement
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+            if found:
+                now = self._now()
+                self._connection.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+                self._connection.commit()
+        return found
+
+    def _store(self, vectors: Dict[str, List[float]]) -> None:
+        rows = []
+        for key, vector in vectors.items():
+            blob = array("f", vector).tobytes() # float32 halves the disk usage, the precision loss does not affect rankings
+            rows.append((key, blob, len(blob)))
+        with self._lock:
+            now = self._now()
+            for row in rows:
+                cursor = self._connection.execute("INSERT OR IGNORE INTO embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?)", row + (now,))
+                if cursor.rowcount: # another thread may have stored the same text in the meantime
+                    self._size_bytes += row[2]
+            self._connection.commit()
+            if self._size_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # drops the least recently used vectors until the cache is back to 90% of its size limit
+        target = int(self.max_bytes * 0.9)
+        cursor = self._connection.execute("SELECT key, size FROM embeddings ORDER BY last_used ASC")
+        evicted = []
+        size = self._size_bytes
+        for key, entry_size in cursor:
+            if size <= target:
+                break
+            evicted.append((key,))
+            size -= entry_size
+        self._connection.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+        self._connection.commit()
+        self._size_bytes = size
+
+    def close(self) -> None:
+        self._connection.close()
+
+def cached_embeddings(embeddings: Embeddings, model_name: str, db_location: str, max_size_mb: Optional[float]) -> Embeddings:
+    # the cache lives next to the chroma database, max_size_mb=None disables it
+    if max_size_mb is None:
+        return embeddings
+    return CachedEmbeddings(embeddings, model_name, os.path.join(db_location, "embedding_cache.sqlite3"), max_size_mb)
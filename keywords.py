@@ -0,0 +1,75 @@
+"""
+Keyword extraction without the LLM: query terms weighted by their IDF in the review corpus (taken from the BM25 index).
+"""
+import json
+import os
+from collections import Counter
+from typing import Dict, List, Optional
+
+from lexical import BM25Index, tokenize
+
+# words that phrase the request rather than name what it is about ("what do people think of...", "show me reviews about..."):
+# they can be rare in the reviews, so their IDF would rank them first
+REQUEST_TERMS = frozenset("""
+show tell find give list want need looking look know think thinks say says said feel opinion opinions people users customers
+buyers reviewers review reviews rating ratings comment comments something anything thing things stuff good bad best worst
+""".split())
+
+def load_synonyms(path: Optional[str]) -> Dict[str, List[str]]:
+    # {"mice": ["mouse"], "lag": ["latency", "stutter"]}, keys and values are tokenized like the reviews
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        table = json.load(f)
+    synonyms: Dict[str, List[str]] = {}
+    for term, alternatives in table.items():
+        for key in tokenize(term):
+            synonyms.setdefault(key, []).extend(t for alternative in alternatives for t in tokenize(alternative))
+    return synonyms
+
+class KeywordExtractor:
+    """Picks the query terms that are known to the corpus, the rarest (most specific) first, using TF-IDF:
+        term frequency in the query times the IDF of the term in the reviews.
+        Terms found in more than max_df of the reviews say nothing about a query and are dropped, and so are REQUEST_TERMS.
+    """
+
+    def __init__(self, index: BM25Index, synonyms: Optional[Dict[str, List[str]]] = None, max_keywords: int = 5,
+                 max_df: float = 0.5, max_query_terms: int = 12, min_coverage: float = 0.5):
+        self.index = index
+        self.synonyms = synonyms or {}
+        self.max_keywords = max_keywords
+        self.max_df = max_df
+        self.max_query_terms = max_query_terms # longer queries are left to the LLM
+        self.min_coverage = min_coverage # share of the query terms that must be known to the corpus, or the LLM is asked
+
+    def query_terms(self, user_query: str) -> List[str]:
+        # the terms that can be keywords: no stopwords, no request terms
+        return [t for t in tokenize(user_query) if t not in REQUEST_TERMS]
+
+    def extract(self, user_query: str) -> Optional[List[str]]:
+        """Returns up to max_keywords keywords, or None when the corpus statistics cannot be trusted with the query:
+            too long, nothing left once the request terms are removed, or less than min_coverage of its terms known to the corpus
+        """
+        terms = self.query_terms(user_query)
+        if not terms or len(set(terms)) > self.max_query_terms or self.index.size == 0:
+            return None
+        known = [term for term in set(terms) if self.index.document_frequency(term) > 0]
+        if len(known) < self.min_coverage * len(set(terms)): # mostly words the reviews never use: the LLM knows them better
+            return None
+        limit = self.max_df * self.index.size
+        weights = {
+            term: tf * self.index.idf(term)
+            for term, tf in Counter(terms).items()
+            if 0 < self.index.document_frequency(term) <= limit
+        }
+        if not weights:
+            return None
+        keywords = sorted(weights, key=lambda term: (-weights[term], terms.index(term)))[:self.max_keywords]
+        # synonyms known to the corpus fill the remaining slots, so a query for "mice" also matches reviews about a "mouse"
+        for term in list(keywords):
+            for synonym in self.synonyms.get(term, []):
+                if len(keywords) >= self.max_keywords:
+                    return keywords
+                if synonym not in keywords and self.index.document_frequency(synonym) > 0:
+                    keywords.append(synonym)
+        return keywords
@@ -0,0 +1,138 @@
+"""
+Lexical (BM25) inverted index over the review texts, kept next to the vector store.
+"""
+import heapq
+import math
+import os
+import pickle
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:['\-][a-z0-9]+)*")
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are aren't as at be because been before being below between both but by
+can can't cannot could couldn't did didn't do does doesn't doing don't down during each few for from further get got had hadn't
+has hasn't have haven't having he her here hers herself him himself his how i i'm i've if in into is isn't it it's its itself
+just let's me more most mustn't my myself no nor not of off on once only or other ought our ours ourselves out over own same
+she should shouldn't so some such than that that's the their theirs them themselves then there there's these they they're
+this those through to too under until up very was wasn't we we're were weren't what what's when where which while who whom
+why will with won't would wouldn't you you're you've your yours yourself yourselves also really much many one would like
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    # lowercase word tokens without stopwords, shared by indexing and querying so both sides match
+    return [t for t in TOKEN_PATTERN.findall(str(text).lower()) if t not in STOPWORDS]
+
+class BM25Index:
+    """Inverted index term -> {doc_id: term frequency}, scored with Okapi BM25.
+        Only the postings of the query terms are read, so a lookup costs the size of those posting lists.
+    """
+
+    def __init__(self, path: Optional[str] = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.doc_terms: Dict[str, List[str]] = {} # forward index, so a document can be removed without scanning every posting list
+        self.total_length = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    @property
+    def size(self) -> int:
+        return len(self.doc_lengths)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.doc_lengths
+
+    def document_frequency(self, term: str) -> int:
+        return len(self.postings.get(term, ()))
+
+    def idf(self, term: str) -> float:
+        df = self.document_frequency(term)
+        return math.log(1 + (self.size - df + 0.5) / (df + 0.5))
+
+    def add(self, ids: List[str], texts: List[str]) -> None:
+        with self._lock:
+            for doc_id, text in zip(ids, texts):
+                if doc_id in self.doc_lengths:
+                    self._remove(doc_id) # re-adding a document replaces it
+                tokens = tokenize(text)
+                counts = Counter(tokens)
+                for term, tf in counts.items():
+                    self.postings.setdefault(term, {})[doc_id] = tf
+                self.doc_terms[doc_id] = list(counts)
+                self.doc_lengths[doc_id] = len(tokens)
+                self.total_length += len(tokens)
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for doc_id in ids:
+                if doc_id in self.doc_lengths:
+                    self._remove(doc_id)
+
+    def _remove(self, doc_id: str) -> None:
+        for term in self.doc_terms.pop(doc_id):
+            del self.postings[term][doc_id]
+            if not self.postings[term]:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def search(self, query_terms: Iterable[str], k: int = 10) -> List[Tuple[str, float]]:
+        """Returns (doc_id, bm25 score) pairs, the best first. Query terms go through the same tokenizer as documents."""
+        terms = set()
+        for term in query_terms:
+            terms.update(tokenize(term))
+        scores: Dict[str, float] = {}
+        with self._lock:
+            if not terms or self.size == 0:
+                return []
+            avg_length = self.total_length / self.size
+            for term in terms:
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = self.idf(term)
+                for doc_id, tf in docs.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def clear(self) -> None:
+        with self._lock:
+            self.postings = {}
+            self.doc_lengths = {}
+            self.doc_terms = {}
+            self.total_length = 0
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            with open(self.path + ".tmp", "wb") as f:
+                pickle.dump({"postings": self.postings, "doc_lengths": self.doc_lengths, "doc_terms": self.doc_terms,
+                             "total_length": self.total_length}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(self.path + ".tmp", self.path)
+
+    def load(self) -> None:
+        with open(self.path, "rb") as f:
+            data = pickle.load(f)
+        with self._lock:
+            self.postings = data["postings"]
+            self.doc_lengths = data["doc_lengths"]
+            self.doc_terms = data["doc_terms"]
+            self.total_length = data["total_length"]
+
+def reciprocal_rank_fusion(rankings: List[List[str]], rrf_k: int = 60) -> List[Tuple[str, float]]:
+    # fuses several ranked id lists: each list contributes 1 / (rrf_k + rank) to the ids it contains
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,88 @@
+"""
+Cache of LLM responses for the prompts sent by AgentTools: an in-memory LRU in front of an optional SQLite store.
+"""
+import hashlib
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from caches import LRUCache, LRUClock, open_lru_table
+
+def template_version(template: str) -> str:
+    # the template text itself is the version: editing a prompt never serves answers written for the old one
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
+
+class LLMResponseCache:
+    """Responses keyed by (model, prompt template version, normalized input hash).
+        Entries expire ttl seconds after being generated (None: never); the memory front keeps the max_entries most recently used,
+        the SQLite store at path (optional) survives restarts and is trimmed to max_disk_entries, least recently used first.
+    """
+
+    def __init__(self, model_name: str, path: Optional[str] = None, max_entries: int = 1024, ttl: Optional[float] = 7 * 24 * 3600,
+                 max_disk_entries: int = 100000):
+        self.model_name = model_name
+        self.path = path
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.memory = LRUCache(max_entries, ttl)
+        self.disk_hits = 0
+        self._now = LRUClock()
+        self._lock = threading.Lock()
+        self._connection = None
+        if path:
+            self._connection = open_lru_table(
+                path, "responses", "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL"
+            )
+
+    def key(self, template: str, normalized_input: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x1f{template_version(template)}\x1f{normalized_input}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        response = self.memory.get(key)
+        if response is not None or self._connection is None:
+            return response
+        with self._lock:
+            row = self._connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and row[1] + self.ttl <= time.time():
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._connection.commit()
+                return None
+            self._connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (self._now(), key))
+            self._connection.commit()
+            self.disk_hits += 1
+        self.memory.put(key, row[0], row[1] + self.ttl - time.time() if self.ttl is not None else None) # expires with the disk entry
+        return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        if not isinstance(response, str):
+            return
+        self.memory.put(key, response)
+        if self._connection is None:
+            return
+        with self._lock:
+            now = self._now()
+            self._connection.execute("INSERT OR REPLACE INTO responses (key, response, created, last_used) VALUES (?, ?, ?, ?)", (key, response, now, now))
+            excess = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_disk_entries
+            if excess > 0:
+                self._connection.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used ASC LIMIT ?)", (excess,))
+            self._connection.commit()
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self._connection is not None:
+            with self._lock:
+                self._connection.execute("DELETE FROM responses")
+                self._connection.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {"model": self.model_name, "memory": self.memory.stats(), "disk_hits": self.disk_hits}
+        if self._connection is not None:
+            with self._lock:
+                stats["disk_entries"] = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return stats
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
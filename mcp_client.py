@@ -1,38 +1,50 @@
+import argparse
 import asyncio
 import json
 import sys
+import time
 import traceback
+from collections import deque
 from mcp_client_handler import SimpleClientHandler
 
 class SimpleMCPClient:
 
-    def __init__(self):
+    def __init__(self, url=None):
         self.process = None # this internal field is used to store the subprocess, this is needed to start/stop the server
+        # with a url (e.g. http://127.0.0.1:8000/mcp/) the client connects to a shared server started with --transport http instead
+        self.url = url
+        self.http = None
+        self.session_id = None
+        self.protocol_version = None
+        self._http_tasks = set()
         self.request_id = 0 # request id is needed to identify the response to a request
         self.last_keywords = []
+        self.verbose = True # print every request sent (the batch runner turns it off)
+        # several requests can be in flight: a single reader task routes each response to the future of its id
+        self._pending = {} # request id -> future resolved with the response
+        self._progress = {} # request id -> on_progress callback
+        self._last_activity = {} # request id -> time of the last message about it (idle timeout)
+        self._reader_task = None
+        self._stderr_task = None
+        self._write_lock = asyncio.Lock()
+        self.server_log = deque(maxlen=50) # last lines written by the server on stderr, printed if it fails to start
 
-    async def start_server(self):
-        print("Server is starting...")
-        self.process = await asyncio.create_subprocess_exec(
-            sys.executable, 'mcp_server.py',
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-
-        print("Waiting for server initialization...")
-            # this part is needed to waits for any initial output from the server, which may include error messages or status updates
-        try:
-            stderr_output = await asyncio.wait_for(
-                self.process.stderr.read(1024),
-                timeout=10.0
+    async def start_server(self, ready_timeout=600.0):
+        started = time.perf_counter()
+        if self.url:
+            import httpx
+            print(f"Connecting to {self.url}...")
+            self.http = httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=None)) # responses are streams, _send_request handles idle time
+        else:
+            print("Server is starting...")
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable, 'mcp_server.py',
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
             )
-            stderr_text = stderr_output.decode().strip()
-            if stderr_text:
-                print(f"Output from MCP server: {stderr_text}")
-        except asyncio.TimeoutError:
-            print("No messages from MCP server")
-        await asyncio.sleep(1)
+            self._reader_task = asyncio.create_task(self._read_messages())
+            self._stderr_task = asyncio.create_task(self._read_server_log()) # a full stderr pipe would block the server
 
         print("Trying to connect to MCP server...")
         """ 
@@ -55,13 +67,40 @@ class SimpleMCPClient:
             }
         })
 
-        if init_response:
-            print("Server running...")
-            await self._send_notification("notifications/initialized") # notifies the server that the client is ready to start communicating. It does not wait for a response.
-            return True
-        else:
+        if not init_response or "result" not in init_response:
             print("Server not responding - exiting...")
+            self._print_server_log()
             return False
+        self.protocol_version = init_response["result"].get("protocolVersion") # sent with every http request
+        print(f"Server running (handshake in {time.perf_counter() - started:.2f}s)...")
+        await self._send_notification("notifications/initialized") # notifies the server that the client is ready to start communicating. It does not wait for a response.
+
+        # readiness handshake: the server loads its components in the background and answers as soon as they are ready
+        print("Waiting for server initialization...")
+        status = await self.wait_until_ready(ready_timeout)
+        if not status or not status.get("ready"):
+            print(f"Server not ready: {(status or {}).get('error') or 'timed out'}")
+            self._print_server_log()
+            return False
+        print(f"Server ready in {time.perf_counter() - started:.2f}s (components initialized {status['initialized_seconds']}s after the server started)")
+        return True
+
+    async def wait_until_ready(self, timeout=600.0):
+        response = await self._send_request("tools/call", "get_server_status", {"name": "get_server_status", "arguments": {"wait": timeout}}, timeout + 5)
+        if response and "result" in response:
+            return json.loads(response["result"]["content"][0]["text"])
+        return None
+
+    async def _read_server_log(self):
+        while True:
+            line = await self.process.stderr.readline()
+            if not line:
+                break
+            self.server_log.append(line.decode(errors="replace").rstrip())
+
+    def _print_server_log(self):
+        if self.server_log:
+            print("Output from MCP server:\n" + "\n".join(self.server_log))
 
     async def _send_notification(self, method, params=None):
         notification = { "jsonrpc": "2.0", "method": method }
@@ -69,37 +108,148 @@ class SimpleMCPClient:
             notification["params"] = params
 
         notification_str = json.dumps(notification) + "\n"
-        self.process.stdin.write(notification_str.encode())
-        await self.process.stdin.drain()
+        await self._write(notification_str)
+
+    async def _write(self, line):
+        if self.url:
+            # over http every message is a POST, whose body carries the response and the notifications about it
+            task = asyncio.create_task(self._post(json.loads(line)))
+            self._http_tasks.add(task)
+            task.add_done_callback(self._http_tasks.discard)
+            return
+        async with self._write_lock: # lines of concurrent requests are never interleaved
+            self.process.stdin.write(line.encode())
+            await self.process.stdin.drain()
+
+    def _http_headers(self):
+        headers = {"Accept": "application/json, text/event-stream", "Content-Type": "application/json"}
+        if self.session_id:
+            headers["mcp-session-id"] = self.session_id
+        if self.protocol_version:
+            headers["mcp-protocol-version"] = self.protocol_version
+        return headers
 
-    async def _send_request(self, method, method_name, params=None, timeout=10.0):
+    async def _post(self, message):
+        try:
+            async with self.http.stream("POST", self.url, json=message, headers=self._http_headers()) as response:
+                self.session_id = response.headers.get("mcp-session-id", self.session_id)
+                if response.status_code == 202: # accepted notification or response, nothing comes back
+                    return
+                response.raise_for_status()
+                if response.headers.get("content-type", "").startswith("application/json"):
+                    await self._dispatch(json.loads(await response.aread()))
+                    return
+                data = []
+                async for line in response.aiter_lines(): # server-sent events, one JSON-RPC message per event
+                    if line.startswith("data:"):
+                        data.append(line[5:].strip())
+                    elif not line and data:
+                        await self._dispatch(json.loads("\n".join(data)))
+                        data = []
+        except Exception as e:
+            print(f"HTTP request to {self.url} failed: {e}")
+            future = self._pending.pop(message.get("id"), None) if "method" in message else None
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    async def _dispatch(self, message):
+        if "method" in message:
+            if "id" in message:
+                await self._answer_server_request(message)
+            else:
+                self._handle_notification(message)
+            return
+        future = self._pending.pop(message.get("id"), None)
+        if future is not None and not future.done():
+            future.set_result(message)
+
+    async def _read_messages(self):
+        """ 
+            Background task reading every line the server writes on stdout:
+            responses resolve the future of their id (late responses, whose request already timed out, are dropped),
+            notifications (progress, logs) are handled on their own and requests from the server (ping) are answered
+        """
+        try:
+            while True:
+                line = await self.process.stdout.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line.decode().strip())
+                except Exception as e:
+                    print(f"Error parsing JSON message: {e}")
+                    continue
+                await self._dispatch(message)
+        finally:
+            # the server is gone: nobody will answer the requests still in flight
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_result(None)
+            self._pending.clear()
+
+    def _handle_notification(self, message):
+        if message["method"] != "notifications/progress":
+            return
+        params = message.get("params", {})
+        request_id = params.get("progressToken")
+        if request_id in self._pending:
+            self._last_activity[request_id] = asyncio.get_running_loop().time()
+            on_progress = self._progress.get(request_id)
+            if on_progress and params.get("message"):
+                on_progress(params["message"])
+
+    async def _answer_server_request(self, message):
+        if message["method"] == "ping":
+            response = {"jsonrpc": "2.0", "id": message["id"], "result": {}}
+        else:
+            response = {"jsonrpc": "2.0", "id": message["id"], "error": {"code": -32601, "message": f"Method not found: {message['method']}"}}
+        await self._write(json.dumps(response) + "\n")
+
+    async def _send_request(self, method, method_name, params=None, timeout=10.0, on_progress=None, progress=False):
+        """ 
+            Requests can be sent concurrently (e.g. with asyncio.gather): each one waits for the response with its own id
+            timeout is an idle timeout: it restarts every time the server sends progress for this request, so a long answer that is streamed is not cut
+            with progress (or on_progress) the server is asked for progress notifications: it sends one every few seconds while the call runs (heartbeat)
+            and one per chunk of streamed text (in the message field); on_progress is called with each chunk while waiting for the response
+        """
         self.request_id += 1
-        request = { "jsonrpc": "2.0", "id": self.request_id, "method": method}
+        request_id = self.request_id
+        request = { "jsonrpc": "2.0", "id": request_id, "method": method}
         if params:
             request["params"] = params
+        if on_progress or progress:
+            request.setdefault("params", {})["_meta"] = {"progressToken": request_id}
 
         request_str = json.dumps(request) + "\n"
 
-        print(f"Sending: {method + " " + method_name}")
-        self.process.stdin.write(request_str.encode()) # here is the actual request sent to the server (it is done via stdin - standard input of the process running in self.process
-        await self.process.stdin.drain() # ensures that the request is sent to the server, it cleans the write buffer
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[request_id] = future
+        self._last_activity[request_id] = loop.time()
+        if on_progress:
+            self._progress[request_id] = on_progress
 
+        if self.verbose:
+            print(f"Sending: {method + " " + method_name}")
         try:
-            response_line = await asyncio.wait_for( self.process.stdout.readline(), timeout=timeout)
-            if response_line:
-                response_text = response_line.decode().strip()
-                try:
-                    response = json.loads(response_text)
-                    return response
-                except Exception as e:
-                    print(f"Error parsing JSON response: {e}")
-            else:
+            await self._write(request_str) # here is the actual request sent to the server (it is done via stdin - standard input of the process running in self.process
+            while not future.done():
+                remaining = self._last_activity[request_id] + timeout - loop.time()
+                if remaining <= 0:
+                    print("Waiting for response timed out")
+                    if self.process and self.process.returncode is not None:
+                        print(f"Server shut down - code: {self.process.returncode}")
+                    return None
+                await asyncio.wait([future], timeout=remaining)
+            response = future.result()
+            if response is None:
                 print("Empty response from MCP server")
-        except asyncio.TimeoutError:
-            print("Waiting for response timed out")
-            if self.process.returncode is not None:
-                print(f"Server shut down - code: {self.process.returncode}")
-        return None
+            return response
+        finally:
+            # from now on a response with this id is late and is dropped by the reader
+            self._pending.pop(request_id, None)
+            self._progress.pop(request_id, None)
+            self._last_activity.pop(request_id, None)
 
     async def list_tools(self):
         response = await self._send_request("tools/list", "list")
@@ -107,22 +257,36 @@ class SimpleMCPClient:
             return response["result"].get("tools", [])
         return []
 
-    async def call_tool(self, name, arguments):
-        timeout = 60.0 if name == "agent" else 10.0
-        response = await self._send_request("tools/call", name,{ "name": name, "arguments": arguments }, timeout)
+    async def call_tool(self, name, arguments, on_progress=None, timeout=None):
+        if timeout is None:
+            timeout = 60.0 if name == "agent" else 10.0
+        # progress is always requested: the server heartbeats keep a call that is queued or waiting for the model from timing out
+        response = await self._send_request("tools/call", name,{ "name": name, "arguments": arguments }, timeout, on_progress, progress=True)
         if response and "result" in response:
             return response["result"]
         return None
 
     async def stop_server(self):
+        if self.http:
+            # a shared server keeps running, only this session is closed
+            if self.session_id:
+                try:
+                    await self.http.delete(self.url, headers=self._http_headers())
+                except Exception:
+                    pass
+            await self.http.aclose()
         if self.process:
             self.process.terminate()
             await self.process.wait()
+        if self._reader_task:
+            await asyncio.gather(self._reader_task, return_exceptions=True) # ends at the end of stdout
+        if self._stderr_task:
+            await asyncio.gather(self._stderr_task, return_exceptions=True)
 
 
 
-async def interactive_client():
-    client = SimpleMCPClient()
+async def interactive_client(url=None):
+    client = SimpleMCPClient(url)
     handler = SimpleClientHandler(client)
     try:
         success = await client.start_server()
@@ -174,4 +338,6 @@ async def interactive_client():
 
 
 if __name__ == "__main__":
-    asyncio.run(interactive_client())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Interactive client of the reviews agent MCP server")
+    parser.add_argument("--url", help="Connect to a shared server (python mcp_server.py --transport http), e.g. http://127.0.0.1:8000/mcp/")
+    asyncio.run(interactive_client(parser.parse_args().url))
\ No newline at end of file
@@ -1,5 +1,10 @@
+import asyncio
 import json
 
+def print_stream(chunk):
+    # prints the summary while the server generates it
+    print(chunk, end="", flush=True)
+
 class SimpleClientHandler:
 
     def __init__(self, client):
@@ -19,7 +24,8 @@ class SimpleClientHandler:
             return
         user_query = parts[1]
         print(f"\nProcessing user_query: '{user_query}'")
-        result = await self.client.call_tool("agent", {"user_query": user_query})
+        result = await self.client.call_tool("agent", {"user_query": user_query}, on_progress=print_stream)
+        print()
         if result:
             if "content" in result and result["content"]:
                 json_data = json.loads(result["content"][0]["text"])
@@ -35,6 +41,9 @@ class SimpleClientHandler:
             print(f"Found {len(tools)} tools")
         else:
             print("Server not ready yet")
+        status = await self.client.wait_until_ready(0)
+        if status:
+            print(json.dumps(status, indent=2))
 
     async def handle_list(self, parts):
         print("\n Loading tools list:")
@@ -72,8 +81,12 @@ class SimpleClientHandler:
         result = await self.client.call_tool("retrieve_useful_reviews", {"keywords": keywords, "k": k})
         if result and "content" in result:
             reviews = json.loads(result["content"][0]["text"])
-            summary = await self.client.call_tool("summarize_reviews", {"reviews": reviews})
-            statistics = await self.client.call_tool("get_reviews_statistics", {"reviews": reviews})
+            # both requests are in flight at the same time, the client routes each response to its caller
+            summary, statistics = await asyncio.gather(
+                self.client.call_tool("summarize_reviews", {"reviews": reviews}, on_progress=print_stream),
+                self.client.call_tool("get_reviews_statistics", {"reviews": reviews})
+            )
+            print()
             print(f"\nFound {len(reviews)} reviews:")
             json_result = {"reviews": reviews, "summary": summary, "statistics": statistics}
             print(json.dumps(json_result, indent=2, ensure_ascii=False))
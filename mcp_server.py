@@ -1,56 +1,186 @@
+import time
+STARTED = time.perf_counter() # cold start times are measured from here
+import argparse
 import asyncio
+import contextlib
 import json
+import os
 import sys
 import traceback
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import mcp.types as types
 import mcp.server.stdio
-from langchain_ollama import OllamaLLM
 from mcp.server import Server, NotificationOptions
 from mcp.server.models import InitializationOptions
 
-from agent import Agent
-from tools import AgentTools
-from vector import ReviewsVectorStore
+from scheduler import LLMLimiter, SchedulerFull, ToolScheduler
 
 server = Server("reviews-agent")
+# the components are created by initialize_system, in the background once the server is already answering (see start_initialization)
 llm = None
-vector_store: ReviewsVectorStore = None
+vector_store = None # ReviewsVectorStore
 retriever = None
-tools: AgentTools = None
-agent: Agent = None
+tools = None # AgentTools
+agent = None # Agent
+# progress of the startup, returned by the get_server_status tool (times in seconds since the process started)
+startup: Dict[str, Any] = {
+    "ready": False, "error": None, "initialized_seconds": None, "warmup": "pending", "warmup_seconds": None, "first_answer_seconds": None
+}
+_initialization: Optional[asyncio.Task] = None
+STARTUP_TIMEOUT = 600.0 # seconds a tool call waits for the initialization (an empty collection is ingested at startup)
+# seconds between two heartbeats of a running call: well under the idle timeout of the clients (10s for most tools),
+# so a call that waits in the queue, for the model to load or for the prompt to be processed is not given up
+HEARTBEAT_SECONDS = 3.0
+# per-tool concurrency limits and a bounded queue in front of the handlers, so a flood of generations cannot swamp Ollama
+scheduler = ToolScheduler()
+# and one cap on the generations of all the tools and of the agent together, since every call can fan out into several of them
+llm_limiter = LLMLimiter()
 
+# every handler returns a coroutine: blocking work (LLM calls, vector searches) never runs on the event loop,
+# so concurrent tool calls overlap instead of queueing behind each other. progress is the (on_token, beat) pair of the request
+# (see _request_progress), shared with the heartbeat so that the progress values of all its notifications keep increasing
 tool_handlers = {
-    "extract_important_keywords": lambda args: tools.extract_important_keywords(args["user_query"]),
-    "retrieve_useful_reviews": lambda args: tools.retrieve_useful_reviews(args["keywords"], args.get("k", 5)),
-    "summarize_reviews": lambda args: tools.summarize_reviews(args["reviews"]),
-    "get_reviews_statistics": lambda args: tools.get_reviews_statistics(args["reviews"])
+    "extract_important_keywords": lambda args, progress: tools.aextract_important_keywords(args["user_query"], args.get("mode")),
+    "retrieve_useful_reviews": lambda args, progress: tools.aretrieve_useful_reviews(
+        args["keywords"], args.get("k", 5), mode=args.get("mode"),
+        min_rating=args.get("min_rating"), max_rating=args.get("max_rating"),
+        date_from=args.get("date_from"), date_to=args.get("date_to")
+    ),
+    "retrieve_useful_reviews_batch": lambda args, progress: tools.aretrieve_useful_reviews_batch(
+        args["keyword_sets"], args.get("k", 5), mode=args.get("mode"),
+        min_rating=args.get("min_rating"), max_rating=args.get("max_rating"),
+        date_from=args.get("date_from"), date_to=args.get("date_to")
+    ),
+    "get_reviews_aggregates": lambda args, progress: tools.aget_reviews_aggregates(args.get("group_by", "year"), args.get("keyword"), args.get("limit", 20)),
+    "get_cluster_summaries": lambda args, progress: tools.aget_cluster_summaries(args["user_query"], args.get("n", 3)),
+    "summarize_reviews": lambda args, progress: tools.asummarize_reviews(args["reviews"], *progress),
+    "get_reviews_statistics": lambda args, progress: tools.aget_reviews_statistics(args["reviews"], args.get("narrative", False))
 }
 
-def initialize_system(model_name: str = "llama3.2:latest", k: int = 5) -> bool:
+def server_metrics() -> Dict[str, Any]:
+    # answered without going through the scheduler, so it works even when the server is saturated
+    metrics = {"scheduler": scheduler.metrics(), "llm": llm_limiter.metrics()}
+    if tools is not None and tools.response_cache is not None:
+        metrics["llm_cache"] = tools.response_cache.stats()
+    if agent is not None and agent.semantic_cache is not None:
+        metrics["semantic_cache"] = agent.semantic_cache.stats()
+    if vector_store is not None:
+        metrics["query_cache"] = vector_store.get_query_cache_stats()
+    return metrics
+
+def _request_progress():
+    """(on_token, beat) for the current request, both sending progress notifications to the client:
+        on_token streams generated text (the chunk is in the message field), beat has no message and only tells the client
+        that the call is still alive, so its idle timeout restarts. Both are None when the current request has no progress token,
+        i.e. the client did not ask for progress.
+    """
+    try:
+        context = server.request_context
+    except LookupError: # called outside of a request
+        return None, None
+    token = context.meta.progressToken if context.meta else None
+    if token is None:
+        return None, None
+    sent = 0
+
+    async def send(message: Optional[str]) -> None:
+        nonlocal sent
+        sent += 1 # progress must increase with every notification
+        await context.session.send_progress_notification(token, sent, message=message, related_request_id=str(context.request_id))
+
+    async def on_token(chunk: str) -> None:
+        await send(chunk)
+
+    async def beat() -> None:
+        try:
+            await send(None)
+        except Exception: # the client went away, the call itself goes on
+            pass
+    return on_token, beat
+
+def _succeeded(name: str, text: str) -> bool:
+    # an answer worth timing as the first one: not an error payload, nor a failed or partial agent pipeline
+    from tools import tool_error # already loaded with the components
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return False
+    if name == "agent":
+        return isinstance(value, dict) and value.get("status") == "success"
+    return tool_error(value) is None
+
+@contextlib.asynccontextmanager
+async def _heartbeat(beat):
+    # sends a beat every HEARTBEAT_SECONDS while the block runs (startup wait, queue wait, model loading, generation)
+    if beat is None:
+        yield
+        return
+
+    async def loop():
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            await beat()
+
+    task = asyncio.create_task(loop())
+    try:
+        yield
+    finally:
+        task.cancel()
+
+async def _admitted(beat, call):
+    # the call got its slot from the scheduler: the client hears about it before the (possibly long) wait for the first token
+    if beat is not None:
+        await beat()
+    return await call()
+
+def initialize_system(model_name: str = "llama3.2:latest", k: int = 5, backend: str = "chroma", retrieval_mode: str = "hybrid",
+                      keyword_mode: str = "llm", synonyms_path: str = "synonyms.json", semantic_threshold: float = 0.92, sync: bool = False) -> bool:
     """Initialize all components needed for the MCP server
         - Ollama LLM, a ReviewVectorStore, a RAG retriever, AgentTools instance and an Agent instance
+        With sync the changes made to the CSV since the last start are applied to the collection first (see ReviewsVectorStore.sync_database)
     """
     
     global llm, vector_store, retriever, tools, agent # they are global because they are used in the @server.list_tools and @server.call_tool decorators
 
     try:
+        # imported here: loading langchain and chromadb takes seconds, the server answers the handshake meanwhile
+        from langchain_ollama import OllamaLLM
+        from agent import Agent
+        from caches import SemanticCache
+        from keywords import load_synonyms
+        from llm_cache import LLMResponseCache
+        from tools import AgentTools
+        from vector import ReviewsVectorStore
+
         print(f"Loading model: {model_name}", file=sys.stderr)
-        llm = OllamaLLM(model=model_name)
+        new_llm = OllamaLLM(model=model_name)
 
         print("Initializing vector database...", file=sys.stderr)
-        vector_store = ReviewsVectorStore()
-        vector_store.init_database(auto_recreate=False)
+        new_vector_store = ReviewsVectorStore(backend=backend)
+        new_vector_store.init_database(auto_recreate=False, sync=sync)
+        stats = new_vector_store.get_stats()
+        print(f"Collection '{stats['collection']}': {stats['count']} vectors, dimension {stats['embedding_dimension']}", file=sys.stderr)
 
         print("Create a RAG retriever...", file=sys.stderr)
-        retriever = vector_store.get_retriever(k=k)
+        new_retriever = new_vector_store.get_retriever(k=k)
+
+        # one cache shared by the tools and the agent, stored next to the vector database
+        response_cache = LLMResponseCache(model_name, os.path.join(new_vector_store.db_location, "llm_cache.sqlite3"))
+
+        synonyms = load_synonyms(synonyms_path) # optional table, used by the fast keyword extraction
 
         print("Initializing tools...", file=sys.stderr)
-        tools = AgentTools(llm, retriever)
+        new_tools = AgentTools(new_llm, new_retriever, new_vector_store, retrieval_mode, response_cache, keyword_mode, synonyms, llm_limiter=llm_limiter)
 
         print("Initializing agent...", file=sys.stderr)
-        agent = Agent(llm, retriever)
+        # paraphrases of an answered query ("is the mouse heavy?", "how heavy does the mouse feel") get the stored answer
+        new_agent = Agent(new_llm, new_retriever, new_vector_store, retrieval_mode, response_cache=response_cache, keyword_mode=keyword_mode,
+                          synonyms=synonyms, semantic_cache=SemanticCache(threshold=semantic_threshold), llm_limiter=llm_limiter)
 
+        # published once everything is built, tools last: calls are let through as soon as tools is set (see ensure_ready),
+        # so the agent and the other components must already be there
+        llm, vector_store, retriever, agent = new_llm, new_vector_store, new_retriever, new_agent
+        tools = new_tools
         print("System initialized successfully", file=sys.stderr)
         return True
 
@@ -59,12 +189,67 @@ def initialize_system(model_name: str = "llama3.2:latest", k: int = 5) -> bool:
         traceback.print_exc(file=sys.stderr)
         return False
 
+def warm_up() -> None:
+    """Loads the LLM into Ollama memory (an empty prompt only loads the model) and the embedding model (one embedding,
+        past the embedding cache), so the first real query does not pay for loading them
+    """
+    llm.invoke("")
+    embeddings = vector_store.embeddings
+    getattr(embeddings, "embeddings", embeddings).embed_query("warm-up") # CachedEmbeddings wraps the model
+
+async def _initialize(warmup: bool, sync: bool = False) -> None:
+    if not await asyncio.to_thread(initialize_system, sync=sync):
+        startup["error"] = "Failed to initialize the server components, see the server log"
+        startup["warmup"] = "skipped"
+        return
+    startup["ready"] = True
+    startup["initialized_seconds"] = round(time.perf_counter() - STARTED, 3)
+    print(f"Server ready in {startup['initialized_seconds']}s", file=sys.stderr, flush=True)
+    if not warmup:
+        startup["warmup"] = "skipped"
+        return
+    try:
+        # runs after ready: calls made meanwhile are served, at worst they wait for the model load they would have paid anyway
+        startup["warmup"] = "running"
+        await asyncio.to_thread(warm_up)
+        startup["warmup"] = "done"
+    except Exception as e:
+        startup["warmup"] = f"failed: {e}"
+    startup["warmup_seconds"] = round(time.perf_counter() - STARTED, 3)
+    print(f"Warm-up {startup['warmup']} at {startup['warmup_seconds']}s", file=sys.stderr, flush=True)
+
+def start_initialization(warmup: bool = True, sync: bool = False) -> asyncio.Task:
+    global _initialization
+    if _initialization is None:
+        _initialization = asyncio.create_task(_initialize(warmup, sync))
+    return _initialization
+
+async def ensure_ready(timeout: Optional[float] = None) -> None:
+    # tool calls received during startup wait for the components instead of failing
+    if tools is not None:
+        return
+    initialization = start_initialization()
+    if not startup["ready"] and startup["error"] is None:
+        await asyncio.wait([initialization], timeout=timeout)
+    if startup["error"]:
+        raise RuntimeError(startup["error"])
+    if tools is None:
+        raise TimeoutError("Server still initializing, retry later")
+
+async def server_status(wait: float = 0) -> Dict[str, Any]:
+    """Startup progress; with wait > 0 it first waits up to wait seconds for the server to be ready (readiness handshake)"""
+    if wait > 0:
+        try:
+            await ensure_ready(wait)
+        except Exception:
+            pass # the status tells why
+    return {**startup, "ready": tools is not None, "uptime_seconds": round(time.perf_counter() - STARTED, 3)}
+
 # the following decorated methods are part of the MCP framework - the name of the method is dynamic (list tools and call tool are chosen by the dev)
 
 @server.list_tools() # tool provider (communicate to server the list of available tools)
 async def handle_list_tools() -> List[types.Tool]:  # here async is needed because the decorator expects an async function
-    if not tools:
-        return []
+    # the tool list does not depend on the components, so it is available while they are initialized
     return [
         types.Tool(
             name="agent",
@@ -94,6 +279,11 @@ async def handle_list_tools() -> List[types.Tool]:  # here async is needed becau
                     "user_query": {
                         "type": "string",
                         "description": "The user's question or query"
+                    },
+                    "mode": {
+                        "type": "string",
+                        "enum": ["llm", "fast", "auto"],
+                        "description": "llm: extracted by the LLM; fast: corpus TF-IDF, no LLM call; auto: fast, with the LLM for long or ambiguous queries. Defaults to the server setting"
                     }
                 },
                 "required": ["user_query"]
@@ -101,7 +291,7 @@ async def handle_list_tools() -> List[types.Tool]:  # here async is needed becau
         ),
         types.Tool(
             name="retrieve_useful_reviews",
-            description="Retrieve k reviews related to the given list of keywords.",
+            description="Retrieve k reviews related to the given list of keywords, optionally restricted to a rating and/or date range.",
             inputSchema={
                 "type": "object",
                 "properties": {
@@ -114,11 +304,144 @@ async def handle_list_tools() -> List[types.Tool]:  # here async is needed becau
                         "type": "integer",
                         "default": 5,
                         "description": "Number of reviews to retrieve"
+                    },
+                    "mode": {
+                        "type": "string",
+                        "enum": ["dense", "hybrid"],
+                        "description": "dense: vector search only; hybrid: vector search fused with exact keyword matches (BM25). Defaults to the server setting"
+                    },
+                    "min_rating": {
+                        "type": "number",
+                        "description": "Only reviews rated at least this value"
+                    },
+                    "max_rating": {
+                        "type": "number",
+                        "description": "Only reviews rated at most this value"
+                    },
+                    "date_from": {
+                        "type": "string",
+                        "description": "Only reviews written on or after this date (YYYY, YYYY-MM or YYYY-MM-DD)"
+                    },
+                    "date_to": {
+                        "type": "string",
+                        "description": "Only reviews written on or before this date (YYYY, YYYY-MM or YYYY-MM-DD)"
                     }
                 },
                 "required": ["keywords"]
             }
         ),
+        types.Tool(
+            name="retrieve_useful_reviews_batch",
+            description="Retrieve k reviews for each of several keyword lists in a single call (one result list per keyword list, in the same order). Same options as retrieve_useful_reviews.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "keyword_sets": {
+                        "type": "array",
+                        "items": {"type": "array", "items": {"type": "string"}},
+                        "description": "List of keyword lists, each one searched independently"
+                    },
+                    "k": {
+                        "type": "integer",
+                        "default": 5,
+                        "description": "Number of reviews to retrieve for each keyword list"
+                    },
+                    "mode": {
+                        "type": "string",
+                        "enum": ["dense", "hybrid"],
+                        "description": "dense: vector search only; hybrid: vector search fused with exact keyword matches (BM25). Defaults to the server setting"
+                    },
+                    "min_rating": {
+                        "type": "number",
+                        "description": "Only reviews rated at least this value"
+                    },
+                    "max_rating": {
+                        "type": "number",
+                        "description": "Only reviews rated at most this value"
+                    },
+                    "date_from": {
+                        "type": "string",
+                        "description": "Only reviews written on or after this date (YYYY, YYYY-MM or YYYY-MM-DD)"
+                    },
+                    "date_to": {
+                        "type": "string",
+                        "description": "Only reviews written on or before this date (YYYY, YYYY-MM or YYYY-MM-DD)"
+                    }
+                },
+                "required": ["keyword_sets"]
+            }
+        ),
+        types.Tool(
+            name="get_reviews_aggregates",
+            description="Rating statistics over ALL the reviews (not a retrieved sample), precomputed at ingestion time: review count, "
+                        "average rating and rating histogram by month or year, optionally for one title keyword, or per title keyword. "
+                        "Use it for questions about trends over time or overall ratings.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "group_by": {
+                        "type": "string",
+                        "enum": ["month", "year", "keyword"],
+                        "default": "year",
+                        "description": "month/year: one row per period; keyword: one row per title keyword, the most reviewed first"
+                    },
+                    "keyword": {
+                        "type": "string",
+                        "description": "Single title keyword (e.g. mouse) to restrict the month/year rows to"
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "default": 20,
+                        "description": "Number of keywords returned when grouping by keyword"
+                    }
+                }
+            }
+        ),
+        types.Tool(
+            name="get_cluster_summaries",
+            description="Precomputed summaries and rating statistics of the groups of similar reviews closest to the query, "
+                        "built offline over the whole collection. Use it for broad questions (e.g. what do people think of headsets) "
+                        "that do not need specific reviews: no summary is generated, so it answers immediately.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "user_query": {
+                        "type": "string",
+                        "description": "The user's question or query"
+                    },
+                    "n": {
+                        "type": "integer",
+                        "default": 3,
+                        "description": "Number of clusters returned, the closest first"
+                    }
+                },
+                "required": ["user_query"]
+            }
+        ),
+        types.Tool(
+            name="get_server_status",
+            description="Startup status: whether the server is ready, the initialization error if any, and the cold start times "
+                        "(initialization, model warm-up, first answer) in seconds since the server process started.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "wait": {
+                        "type": "number",
+                        "default": 0,
+                        "description": "Seconds to wait for the server to be ready before answering"
+                    }
+                }
+            }
+        ),
+        types.Tool(
+            name="get_server_metrics",
+            description="Server load and cache metrics: running and queued calls per tool, their concurrency limits, "
+                        "rejected calls, wait and run time percentiles, the LLM generations running and waiting, and the hit rates of the caches.",
+            inputSchema={
+                "type": "object",
+                "properties": {}
+            }
+        ),
         types.Tool(
             name="summarize_reviews",
             description="Generate a comprehensive summary of the given reviews, highlighting pros, cons, and key themes.",
@@ -135,13 +458,19 @@ async def handle_list_tools() -> List[types.Tool]:  # here async is needed becau
         ),
         types.Tool(
             name="get_reviews_statistics",
-            description="Compute statistics on the given reviews (average rating, sentiment distribution, etc.).",
+            description="Compute statistics on the given reviews as JSON: average, median, percentiles and histogram of the ratings, "
+                        "positive/neutral/negative counts, similarity-weighted average rating and date span.",
             inputSchema={
                 "type": "object",
                 "properties": {
                     "reviews": {
                         "type": "array",
                         "description": "List of reviews to analyze"
+                    },
+                    "narrative": {
+                        "type": "boolean",
+                        "default": False,
+                        "description": "Also ask the LLM for a short prose description of the statistics (slower)"
                     }
                 },
                 "required": ["reviews"]
@@ -153,23 +482,33 @@ async def handle_list_tools() -> List[types.Tool]:  # here async is needed becau
                     # this method receives the tool name and arguments, executes the tool, and returns the result
 async def handle_call_tool(name: str, arguments: Dict[str, Any]) -> List[types.TextContent]:
     try:
-        if not tools:
-            return [types.TextContent(type="text", text=json.dumps({"error": "Agent tools not initialized"}))]
-        if name in tool_handlers:
-            result = tool_handlers[name](arguments)
-            return [types.TextContent(type="text", text=json.dumps(result, ensure_ascii=False))]
-        elif name == "agent":
-            return [types.TextContent(type="text",text=agent.process_query(arguments["user_query"]))]
-        else:
+        if name == "get_server_status":
+            return [types.TextContent(type="text", text=json.dumps(await server_status(arguments.get("wait", 0))))]
+        if name == "get_server_metrics":
+            return [types.TextContent(type="text", text=json.dumps(server_metrics(), ensure_ascii=False))]
+        if name not in tool_handlers and name != "agent":
             return [types.TextContent(type="text", text=json.dumps({"error": f"Unknown tool: {name}"}))]
+        on_token, beat = _request_progress()
+        async with _heartbeat(beat):
+            await ensure_ready(STARTUP_TIMEOUT)
+            if name == "agent":
+                text = await scheduler.run(name, lambda: _admitted(beat, lambda: agent.aprocess_query(arguments["user_query"], on_token, beat)))
+            else:
+                result = await scheduler.run(name, lambda: _admitted(beat, lambda: tool_handlers[name](arguments, (on_token, beat))))
+                text = json.dumps(result, ensure_ascii=False)
+        if startup["first_answer_seconds"] is None and _succeeded(name, text):
+            startup["first_answer_seconds"] = round(time.perf_counter() - STARTED, 3)
+        return [types.TextContent(type="text", text=text)]
+    except SchedulerFull as e:
+        return [types.TextContent(type="text", text=json.dumps({"error": str(e), "busy": True}))]
     except Exception as e:
         return [types.TextContent(type="text", text=json.dumps({"error": str(e)}))]
 
 
-async def main():
-    if not initialize_system():
-        print("Failed to initialize the server components", file=sys.stderr, flush=True)
-        return
+async def main(warmup: bool = True, sync: bool = False):
+    # the components are built in the background: the MCP handshake is answered right away and
+    # clients wait for readiness with get_server_status (or their first tool call simply waits)
+    start_initialization(warmup, sync)
 
     async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
         await server.run(
@@ -185,6 +524,41 @@ async def main():
             )
         )
 
+async def main_http(host: str = "127.0.0.1", port: int = 8000, warmup: bool = True, sync: bool = False):
+    """Serves the same tools over streamable HTTP at http://host:port/mcp/: one warm process (models, vector store, caches)
+        shared by all the clients that connect, each in its own MCP session
+    """
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+    from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+
+    session_manager = StreamableHTTPSessionManager(app=server) # responses are streamed as SSE, so progress notifications reach the client
+
+    async def handle_mcp(scope, receive, send):
+        await session_manager.handle_request(scope, receive, send)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        start_initialization(warmup, sync)
+        async with session_manager.run():
+            print(f"Serving MCP over HTTP at http://{host}:{port}/mcp/", file=sys.stderr, flush=True)
+            yield
+
+    app = Starlette(routes=[Mount("/mcp", app=handle_mcp)], lifespan=lifespan)
+    await uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning")).serve()
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Reviews agent MCP server")
+    parser.add_argument("--transport", default="stdio", choices=["stdio", "http"],
+                        help="stdio: one server per client (started by the client); http: one shared server for many clients")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--no-warmup", action="store_true", help="Do not preload the models after the initialization")
+    parser.add_argument("--sync", action="store_true", help="Apply the changes made to reviews.csv since the last start before serving")
+    args = parser.parse_args()
+    if args.transport == "http":
+        asyncio.run(main_http(args.host, args.port, not args.no_warmup, args.sync))
+    else:
+        asyncio.run(main(not args.no_warmup, args.sync))
\ No newline at end of file
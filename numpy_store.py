@@ -0,0 +1,337 @@
+"""
+In-process vector store backed by a memory-mapped float32 matrix, for corpora that fit on a single machine.
+"""
+import json
+import operator
+import os
+import threading
+import numpy as np
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+WHERE_OPERATORS = {"$eq": operator.eq, "$ne": operator.ne, "$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le}
+
+class NumpyVectorStore(VectorStore):
+    """Stores L2-normalized embeddings as rows of a float32 matrix on disk and answers queries with a
+        single matrix-vector product plus an argpartition top-k, so scores are cosine similarities.
+        Files are append-only: deleted or replaced rows are masked out and dropped by compact().
+        Filters use the chroma "where" syntax restricted to numeric comparisons, evaluated on cached metadata columns.
+    """
+
+    def __init__(self, path: str, embedding_function: Embeddings):
+        self.path = path
+        self._embedding_function = embedding_function
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    # --- persistence ---------------------------------------------------------------------------
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, "vectors.f32")
+
+    @property
+    def _records_path(self) -> str:
+        return os.path.join(self.path, "records.jsonl")
+
+    def _load(self, repair: bool = True) -> None:
+        # records.jsonl has one line per matrix row, plus {"id": ..., "deleted": true} lines for deletions
+        self._ids: List[str] = []
+        self._contents: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._index: Dict[str, int] = {}
+        self._columns: Dict[str, np.ndarray] = {} # numeric metadata field -> values per row, built on first use by a filter
+        deleted_rows = []
+        for record in self._read_records(repair):
+            if record.get("deleted"):
+                if record["id"] in self._index:
+                    deleted_rows.append(self._index.pop(record["id"]))
+                continue
+            if record["id"] in self._index: # an upsert replaces the previous row
+                deleted_rows.append(self._index[record["id"]])
+            self._index[record["id"]] = len(self._ids)
+            self._ids.append(record["id"])
+            self._contents.append(record["content"])
+            self._metadatas.append(record.get("metadata") or {})
+        self._dimension = self._read_dimension()
+        if repair:
+            self._truncate_vectors()
+        self._alive = np.ones(len(self._ids), dtype=bool)
+        self._alive[deleted_rows] = False
+        self._open_matrix()
+
+    def _read_records(self, repair: bool = True) -> List[Dict[str, Any]]:
+        # a crash in the middle of an append can leave a half-written last line: it is skipped and, with repair, cut off
+        # so the next append starts on a fresh line
+        if not os.path.exists(self._records_path):
+            return []
+        records, good_bytes = [], 0
+        with open(self._records_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                if line.strip():
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+                good_bytes += len(line)
+        if repair and good_bytes < os.path.getsize(self._records_path):
+            with open(self._records_path, "r+b") as f:
+                f.truncate(good_bytes)
+        return records
+
+    def _truncate_vectors(self) -> None:
+        # vectors are written before their records, so a crash between the two leaves rows that no record points to:
+        # they are dropped, otherwise the next append would land after them and shift every later row
+        if self._dimension is None or not os.path.exists(self._vectors_path):
+            return
+        expected = len(self._ids) * self._dimension * np.dtype(np.float32).itemsize
+        if os.path.getsize(self._vectors_path) > expected:
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(expected)
+
+    def _read_dimension(self) -> Optional[int]:
+        meta_path = os.path.join(self.path, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)["dimension"]
+
+    def _open_matrix(self) -> None:
+        rows = len(self._ids)
+        if rows == 0 or self._dimension is None:
+            self._matrix = np.zeros((0, self._dimension or 0), dtype=np.float32)
+            return
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self._dimension))
+
+    def _append(self, ids: List[str], vectors: np.ndarray, contents: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            if self._dimension is None:
+                self._dimension = int(vectors.shape[1])
+                with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as f:
+                    json.dump({"dimension": self._dimension}, f)
+            if vectors.shape[1] != self._dimension:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the store dimension {self._dimension}")
+
+            last = {doc_id: i for i, doc_id in enumerate(ids)}
+            if len(last) < len(ids): # the same id twice in one batch: the last one wins, like two upserts in a row
+                keep = sorted(last.values())
+                ids, vectors = [ids[i] for i in keep], vectors[keep]
+                contents, metadatas = [contents[i] for i in keep], [metadatas[i] for i in keep]
+            replaced = [self._index[i] for i in ids if i in self._index]
+            with open(self._vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            with open(self._records_path, "a", encoding="utf-8") as f:
+                for doc_id, content, metadata in zip(ids, contents, metadatas):
+                    f.write(json.dumps({"id": doc_id, "content": content, "metadata": metadata}, ensure_ascii=False) + "\n")
+
+            start = len(self._ids)
+            for offset, (doc_id, content, metadata) in enumerate(zip(ids, contents, metadatas)):
+                self._index[doc_id] = start + offset
+                self._ids.append(doc_id)
+                self._contents.append(content)
+                self._metadatas.append(metadata)
+            self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+            self._alive[replaced] = False
+            for field, column in self._columns.items():
+                self._columns[field] = np.concatenate([column, self._numeric_values(metadatas, field)])
+            self._open_matrix()
+
+    def compact(self) -> None:
+        """Rewrite the files keeping only live rows"""
+        with self._lock:
+            rows = np.flatnonzero(self._alive)
+            vectors = np.array(self._matrix[rows]) if len(rows) else np.zeros((0, self._dimension or 0), dtype=np.float32)
+            with open(self._vectors_path + ".tmp", "wb") as f:
+                f.write(vectors.tobytes())
+            with open(self._records_path + ".tmp", "w", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps({"id": self._ids[row], "content": self._contents[row], "metadata": self._metadatas[row]}, ensure_ascii=False) + "\n")
+            self._matrix = None # release the memory map before replacing the file
+            os.replace(self._vectors_path + ".tmp", self._vectors_path)
+            os.replace(self._records_path + ".tmp", self._records_path)
+            self._load()
+
+    def reload(self) -> None:
+        """Read the files again, to see the writes of another process. Nothing is repaired: the other process
+            may be in the middle of an append, its partial rows are simply not loaded yet.
+        """
+        with self._lock:
+            self._matrix = None
+            self._load(repair=False)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._matrix = None
+            for name in ("vectors.f32", "records.jsonl", "meta.json"):
+                if os.path.exists(os.path.join(self.path, name)):
+                    os.remove(os.path.join(self.path, name))
+            self._load()
+
+    # --- writes --------------------------------------------------------------------------------
+
+    def upsert_embeddings(self, ids: List[str], embeddings: List[List[float]], documents: List[Document]) -> None:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms) # normalized once, so queries are a plain dot product
+        self._append(ids, vectors, [d.page_content for d in documents], [dict(d.metadata) for d in documents])
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(len(self._ids) + i) for i in range(len(texts))]
+        documents = [Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)]
+        self.upsert_embeddings(ids, self._embedding_function.embed_documents(texts), documents)
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        with self._lock:
+            rows = [self._index.pop(i) for i in ids if i in self._index]
+            with open(self._records_path, "a", encoding="utf-8") as f:
+                for doc_id in ids:
+                    f.write(json.dumps({"id": doc_id, "deleted": True}) + "\n")
+            self._alive[rows] = False
+            if (~self._alive).sum() > len(self._alive) // 4: # more than a quarter of the matrix is dead rows
+                self.compact()
+        return True
+
+    # --- reads ---------------------------------------------------------------------------------
+
+    def count(self) -> int:
+        return len(self._index)
+
+    def ids(self) -> List[str]:
+        return list(self._index)
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return self._dimension
+
+    def _snapshot(self) -> Tuple[np.ndarray, np.ndarray, List[str], List[str], List[Dict[str, Any]]]:
+        # matrix, live rows, ids, contents and metadatas taken together under the lock: compact() renumbers the rows,
+        # so a read that started before it keeps using the old row numbers on the old arrays
+        with self._lock:
+            return self._matrix, self._alive.copy(), self._ids, self._contents, self._metadatas
+
+    def sample_metadatas(self, limit: int) -> List[Dict[str, Any]]:
+        _, alive, _, _, metadatas = self._snapshot()
+        return [metadatas[r] for r in np.flatnonzero(alive)[:limit]]
+
+    def get_by_ids(self, ids: List[str]) -> List[Document]:
+        with self._lock:
+            return [Document(id=self._ids[r], page_content=self._contents[r], metadata=self._metadatas[r])
+                    for r in (self._index[i] for i in ids if i in self._index)]
+
+    @staticmethod
+    def _numeric_values(metadatas: List[Dict[str, Any]], field: str) -> np.ndarray:
+        return np.array([m[field] if isinstance(m.get(field), (int, float)) else np.nan for m in metadatas], dtype=np.float64)
+
+    def _where_mask(self, where: Optional[Dict[str, Any]]) -> np.ndarray:
+        # rows matching a chroma-style where clause, e.g. {"$and": [{"rating": {"$lte": 2}}, {"date_ts": {"$gte": 20230101}}]}
+        if not where:
+            return np.ones(len(self._ids), dtype=bool)
+        if "$and" in where:
+            mask = np.ones(len(self._ids), dtype=bool)
+            for clause in where["$and"]:
+                mask &= self._where_mask(clause)
+            return mask
+        if "$or" in where:
+            mask = np.zeros(len(self._ids), dtype=bool)
+            for clause in where["$or"]:
+                mask |= self._where_mask(clause)
+            return mask
+        (field, condition), = where.items()
+        if field not in self._columns:
+            self._columns[field] = self._numeric_values(self._metadatas, field)
+        column = self._columns[field]
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        mask = np.ones(len(self._ids), dtype=bool)
+        with np.errstate(invalid="ignore"): # missing values are NaN and never match
+            for op, value in condition.items():
+                mask &= WHERE_OPERATORS[op](column, value)
+        return mask
+
+    def iter_records(self, batch_size: int = 1000, include_embeddings: bool = False) -> Iterator[Tuple[List[str], List[Document], Optional[np.ndarray]]]:
+        matrix, alive, ids, contents, metadatas = self._snapshot()
+        rows = np.flatnonzero(alive)
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            documents = [Document(id=ids[r], page_content=contents[r], metadata=metadatas[r]) for r in batch]
+            yield [ids[r] for r in batch], documents, (np.array(matrix[batch]) if include_embeddings else None)
+
+    def score_ids(self, embedding: List[float], ids: List[str], where: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """Cosine distance between the query and the given documents (those matching where), in the order of ids"""
+        with self._lock:
+            matrix, row_ids, contents, metadatas = self._matrix, self._ids, self._contents, self._metadatas
+            rows = [self._index[i] for i in ids if i in self._index]
+            if where:
+                mask = self._where_mask(where)
+                rows = [r for r in rows if mask[r]]
+        if not rows:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        scores = matrix[rows] @ query
+        return [
+            (Document(id=row_ids[r], page_content=contents[r], metadata=metadatas[r]), float(1 - score))
+            for r, score in zip(rows, scores)
+        ]
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4, filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """Returns (document, cosine distance) pairs, the closest first. The filter is applied before the top-k,
+            so k results are returned whenever at least k documents match.
+        """
+        return self.similarity_search_by_vectors_with_score([embedding], k, filter)[0]
+
+    def similarity_search_by_vectors_with_score(self, embeddings: List[List[float]], k: int = 4, filter: Optional[Dict[str, Any]] = None) -> List[List[Tuple[Document, float]]]:
+        """Batched version of similarity_search_by_vector_with_score: all the queries are scored with a single matrix product"""
+        with self._lock:
+            matrix, alive, ids, contents, metadatas = self._matrix, self._alive.copy(), self._ids, self._contents, self._metadatas
+            if filter:
+                alive &= self._where_mask(filter)
+        k = min(k, int(alive.sum()))
+        if len(matrix) == 0 or k <= 0:
+            return [[] for _ in embeddings]
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        scores = queries @ matrix.T # (queries, rows)
+        scores[:, ~alive] = -np.inf
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k] # O(n) selection per query, only the k winners are sorted
+        results = []
+        for query_scores, query_top in zip(scores, top):
+            query_top = query_top[np.argsort(-query_scores[query_top])]
+            results.append([
+                (Document(id=ids[r], page_content=contents[r], metadata=metadatas[r]), float(1 - query_scores[r]))
+                for r in query_top
+            ])
+        return results
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding_function.embed_query(query), k, filter)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        return lambda distance: 1.0 - distance
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None,
+                   path: str = "./numpy_store", **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(path, embedding)
+        store.add_texts(texts, metadatas, ids)
+        return store
@@ -0,0 +1,117 @@
+"""
+Minimal dependency-graph runner: every stage starts as soon as the stages it depends on are done.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+class Stage:
+    """A named step of a pipeline. func receives {dependency name: dependency result} and returns the stage result
+        (a coroutine with arun_dag). timeout (seconds, counted from the start of the stage) is optional.
+    """
+
+    def __init__(self, name: str, func: Callable[[Dict[str, Any]], Any], depends_on: Sequence[str] = (), timeout: Optional[float] = None):
+        self.name = name
+        self.func = func
+        self.depends_on = list(depends_on)
+        self.timeout = timeout
+
+def _check_dependencies(stages: List[Stage]) -> None:
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        unknown = [d for d in stage.depends_on if d not in names]
+        if unknown:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages: {unknown}")
+
+def run_dag(stages: List[Stage], max_workers: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+    """Runs the stages on a thread pool, independent stages concurrently. Returns {name: outcome}, where outcome has
+        "status" (ok, error, timeout or skipped when a dependency did not succeed), "seconds" and either "result" or "error".
+        A stage that times out is reported right away; its thread cannot be interrupted and finishes in the background.
+    """
+    _check_dependencies(stages)
+    pending = {stage.name: stage for stage in stages}
+    running = {} # future -> (stage, start time)
+    outcomes: Dict[str, Dict[str, Any]] = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(stages) or 1)
+    try:
+        while pending or running:
+            progress = True
+            while progress: # start every ready stage, skip the ones that can no longer run
+                progress = False
+                for name, stage in list(pending.items()):
+                    failed = [d for d in stage.depends_on if d in outcomes and outcomes[d]["status"] != "ok"]
+                    if failed:
+                        outcomes[name] = {"status": "skipped", "seconds": 0.0, "error": f"{failed[0]} did not succeed ({outcomes[failed[0]]['status']})"}
+                    elif all(d in outcomes for d in stage.depends_on):
+                        inputs = {d: outcomes[d]["result"] for d in stage.depends_on}
+                        running[executor.submit(stage.func, inputs)] = (stage, time.perf_counter())
+                    else:
+                        continue
+                    del pending[name]
+                    progress = True
+            if not running:
+                for name in pending: # only reachable with a dependency cycle
+                    outcomes[name] = {"status": "skipped", "seconds": 0.0, "error": "dependency cycle"}
+                break
+
+            now = time.perf_counter()
+            deadlines = [start + stage.timeout - now for stage, start in running.values() if stage.timeout is not None]
+            done, _ = wait(running, timeout=max(0.0, min(deadlines)) if deadlines else None, return_when=FIRST_COMPLETED)
+
+            now = time.perf_counter()
+            for future, (stage, start) in list(running.items()):
+                if future in done:
+                    try:
+                        outcomes[stage.name] = {"status": "ok", "seconds": round(now - start, 3), "result": future.result()}
+                    except Exception as e:
+                        outcomes[stage.name] = {"status": "error", "seconds": round(now - start, 3), "error": str(e)}
+                elif stage.timeout is not None and now - start >= stage.timeout:
+                    outcomes[stage.name] = {"status": "timeout", "seconds": round(now - start, 3), "error": f"no result after {stage.timeout}s"}
+                else:
+                    continue
+                del running[future]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True) # do not wait for stages that timed out
+    return outcomes
+
+async def arun_dag(stages: List[Stage]) -> Dict[str, Dict[str, Any]]:
+    """Same as run_dag for stages whose func is a coroutine function, run as tasks of the current event loop.
+        A stage that times out is cancelled.
+    """
+    _check_dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    tasks: Dict[str, asyncio.Task] = {}
+    outcomes: Dict[str, Dict[str, Any]] = {}
+
+    async def run(stage: Stage) -> Dict[str, Any]:
+        for dependency in stage.depends_on:
+            outcome = await tasks[dependency]
+            if outcome["status"] != "ok":
+                return {"status": "skipped", "seconds": 0.0, "error": f"{dependency} did not succeed ({outcome['status']})"}
+        inputs = {d: tasks[d].result()["result"] for d in stage.depends_on}
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(stage.func(inputs), stage.timeout)
+            return {"status": "ok", "seconds": round(time.perf_counter() - start, 3), "result": result}
+        except asyncio.TimeoutError:
+            return {"status": "timeout", "seconds": round(time.perf_counter() - start, 3), "error": f"no result after {stage.timeout}s"}
+        except Exception as e:
+            return {"status": "error", "seconds": round(time.perf_counter() - start, 3), "error": str(e)}
+
+    def schedule(name: str, visiting: set) -> None:
+        # dependencies are scheduled first, so every stage can await the tasks it depends on
+        if name in tasks:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle through stage {name}")
+        visiting.add(name)
+        for dependency in by_name[name].depends_on:
+            schedule(dependency, visiting)
+        tasks[name] = asyncio.ensure_future(run(by_name[name]))
+
+    for stage in stages:
+        schedule(stage.name, set())
+    for name, task in tasks.items():
+        outcomes[name] = await task
+    return {stage.name: outcomes[stage.name] for stage in stages}
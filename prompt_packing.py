@@ -0,0 +1,50 @@
+"""
+Compact serialization of the reviews sent to the LLM and packing into batches that fit a token budget.
+"""
+import math
+from typing import Any, List
+
+CHARS_PER_TOKEN = 4 # rough average for English text with the llama tokenizers, good enough to stay inside the context
+TRUNCATION_MARK = " [...]"
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def format_review(review: Any) -> str:
+    """One line per review: "[5/5 2024-01-01] Title: content", without the dict keys and the similarity scores of repr()"""
+    if not isinstance(review, dict):
+        return " ".join(str(review).split())
+    header = " ".join(str(review[field]) + ("/5" if field == "rating" else "") for field in ("rating", "date") if review.get(field) is not None)
+    title = review.get("title")
+    text = " ".join(str(review.get("content", review.get("error", ""))).split())
+    if title and title != "No Title":
+        text = f"{' '.join(str(title).split())}: {text}"
+    return f"[{header}] {text}" if header else text
+
+def truncate_to_budget(text: str, budget_tokens: int) -> str:
+    max_chars = budget_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max(0, max_chars - len(TRUNCATION_MARK))].rstrip() + TRUNCATION_MARK
+
+def pack_lines(lines: List[str], budget_tokens: int) -> List[str]:
+    """Groups the lines, in order, into as few blocks as possible of at most budget_tokens each.
+        A line that is longer than the whole budget is cut (with a visible [...] mark) and gets a block of its own.
+    """
+    blocks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in lines:
+        line = truncate_to_budget(line, budget_tokens)
+        tokens = estimate_tokens(line + "\n")
+        if current and size + tokens > budget_tokens:
+            blocks.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += tokens
+    if current:
+        blocks.append("\n".join(current))
+    return blocks
+
+def pack_reviews(reviews: list, budget_tokens: int) -> List[str]:
+    return pack_lines([format_review(review) for review in reviews], budget_tokens) or [""]
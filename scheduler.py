@@ -0,0 +1,174 @@
+"""
+Admission control for the MCP tool calls: per-tool concurrency limits, a bounded number of waiting calls and wait/run time metrics,
+plus one process-wide cap on the LLM generations running at the same time.
+"""
+import asyncio
+import contextlib
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import numpy as np
+
+# calls of the same tool running at the same time; the tools that generate text share one Ollama instance, so they get few slots
+DEFAULT_TOOL_LIMITS = {
+    "agent": 2,
+    "summarize_reviews": 2,
+    "extract_important_keywords": 4,
+    "get_reviews_statistics": 4,
+    "retrieve_useful_reviews": 16,
+    "retrieve_useful_reviews_batch": 8,
+    "get_reviews_aggregates": 16,
+    "get_cluster_summaries": 16
+}
+
+# generations sent to Ollama at the same time, whatever tool, agent stage or summary batch they come from
+# (Ollama serves up to OLLAMA_NUM_PARALLEL requests per model at once, 4 by default, and queues the others)
+DEFAULT_LLM_LIMIT = 4
+
+class SchedulerFull(Exception):
+    """Raised when a call arrives while max_queue calls are already waiting for a slot"""
+
+class _ToolMetrics:
+    def __init__(self, window: int):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.running = 0
+        self.queued = 0
+        self.wait_seconds = deque(maxlen=window) # most recent calls only
+        self.run_seconds = deque(maxlen=window)
+
+    def snapshot(self, limit: int) -> Dict[str, Any]:
+        def percentiles(values) -> Dict[str, float]:
+            if not values:
+                return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+            p50, p95 = np.percentile(values, [50, 95])
+            return {"p50": round(float(p50), 4), "p95": round(float(p95), 4), "max": round(max(values), 4)}
+        return {
+            "limit": limit,
+            "running": self.running,
+            "queued": self.queued,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_seconds": percentiles(self.wait_seconds),
+            "run_seconds": percentiles(self.run_seconds)
+        }
+
+class ToolScheduler:
+    """Runs tool calls with at most limits[tool] of them at the same time (default_limit for the other tools).
+        Calls over the limit wait for a slot in arrival order; when max_queue calls are already waiting a new one is
+        rejected with SchedulerFull right away, so a flood of slow calls turns into fast errors instead of an ever growing backlog.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None, default_limit: int = 8, max_queue: int = 64, window: int = 1000):
+        self.limits = {**DEFAULT_TOOL_LIMITS, **(limits or {})}
+        self.default_limit = default_limit
+        self.max_queue = max_queue
+        self.window = window
+        self.queued = 0 # calls waiting for a slot, all tools together
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._metrics: Dict[str, _ToolMetrics] = {}
+
+    def _limit(self, tool: str) -> int:
+        return max(1, self.limits.get(tool, self.default_limit))
+
+    async def run(self, tool: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Awaits call() once tool has a free slot and returns its result"""
+        semaphore = self._semaphores.setdefault(tool, asyncio.Semaphore(self._limit(tool)))
+        metrics = self._metrics.setdefault(tool, _ToolMetrics(self.window))
+        metrics.submitted += 1
+        if semaphore.locked():
+            if self.queued >= self.max_queue:
+                metrics.rejected += 1
+                raise SchedulerFull(f"Server busy: {self.queued} calls already waiting, retry later")
+        self.queued += 1
+        metrics.queued += 1
+        start = time.perf_counter()
+        try:
+            await semaphore.acquire()
+        finally:
+            self.queued -= 1
+            metrics.queued -= 1
+        started = time.perf_counter()
+        metrics.wait_seconds.append(started - start)
+        metrics.running += 1
+        try:
+            result = await call()
+            metrics.completed += 1
+            return result
+        except BaseException:
+            metrics.failed += 1
+            raise
+        finally:
+            metrics.running -= 1
+            metrics.run_seconds.append(time.perf_counter() - started)
+            semaphore.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "tools": {tool: metrics.snapshot(self._limit(tool)) for tool, metrics in sorted(self._metrics.items())}
+        }
+
+class LLMLimiter:
+    """Caps the LLM calls running at the same time. The per-tool limits of ToolScheduler do not, since every tool call
+        can fan out (the agent runs several stages, a long summary runs summary_concurrency batches): one limiter is
+        shared by all the AgentTools of the process and wraps every single generation. Async callers (the MCP server) use slot(),
+        threads (the synchronous pipeline) sync_slot(); the two have separate slots, a process uses one or the other.
+    """
+
+    def __init__(self, limit: int = DEFAULT_LLM_LIMIT):
+        self.limit = max(1, limit)
+        self.running = 0
+        self.waiting = 0
+        self.peak = 0 # most calls ever running at the same time
+        self._threads = threading.BoundedSemaphore(self.limit)
+        self._counters = threading.Lock()
+        self._loop = None
+        self._semaphore = None
+
+    def _count(self, waiting: int, running: int) -> None:
+        with self._counters: # updated by the event loop and by worker threads
+            self.waiting += waiting
+            self.running += running
+            self.peak = max(self.peak, self.running)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop: # an asyncio semaphore belongs to one event loop (the server has one, tests run several)
+            self._loop, self._semaphore = loop, asyncio.Semaphore(self.limit)
+        self._count(1, 0)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._count(-1, 0)
+        self._count(0, 1)
+        try:
+            yield
+        finally:
+            self._count(0, -1)
+            self._semaphore.release()
+
+    @contextlib.contextmanager
+    def sync_slot(self):
+        self._count(1, 0)
+        try:
+            self._threads.acquire()
+        finally:
+            self._count(-1, 0)
+        self._count(0, 1)
+        try:
+            yield
+        finally:
+            self._count(0, -1)
+            self._threads.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"limit": self.limit, "running": self.running, "waiting": self.waiting, "peak": self.peak}
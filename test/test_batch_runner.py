@@ -0,0 +1,111 @@
+import asyncio
+import json
+import pytest
+import sys
+import os
+
+# Add the parent directory to the path to import modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_runner import completed_ids, latency_report, load_requests, run_batch
+
+
+class FakeClient:
+    def __init__(self, busy_times=0):
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.busy_times = busy_times
+
+    async def call_tool(self, name, arguments, timeout=None):
+        self.calls.append((name, arguments))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.02)
+        self.in_flight -= 1
+        if self.busy_times:
+            self.busy_times -= 1
+            return {"content": [{"type": "text", "text": json.dumps({"error": "Server busy: retry later", "busy": True})}]}
+        return {"content": [{"type": "text", "text": self.result(name, arguments)}]}
+
+    @staticmethod
+    def result(name, arguments):
+        # the shapes the server returns, see tools.tool_error and Agent._pipeline_result
+        if arguments.get("user_query") == "broken":
+            return json.dumps({"error": "boom"})
+        if arguments.get("keywords") == ["broken"]:
+            return json.dumps([{"error": "Error retrieving reviews: boom"}])
+        if name == "summarize_reviews":
+            return "Summarization failed: boom"
+        if name == "agent":
+            status = {"partial": "partial", "failed": "error"}.get(arguments["user_query"], "success")
+            stages = {"reviews": {"status": "error" if status == "error" else "ok", "seconds": 0.0, "error": "boom"},
+                      "summary": {"status": "ok" if status == "success" else "skipped", "seconds": 0.0, "error": "reviews did not succeed (error)"}}
+            return json.dumps({"query": arguments["user_query"], "status": status, "stages": stages})
+        return json.dumps({"tool": name})
+
+
+@pytest.fixture
+def input_path(tmp_path):
+    path = tmp_path / "questions.jsonl"
+    lines = [{"id": f"q{i}", "query": f"question {i}"} for i in range(6)]
+    lines.append({"id": "r1", "tool": "retrieve_useful_reviews", "arguments": {"keywords": ["mouse"]}})
+    lines.append({"query": "broken"})
+    path.write_text("\n".join(json.dumps(line) for line in lines) + "\nnot json\n")
+    return str(path)
+
+
+def test_batch_runs_concurrently_and_resumes(input_path, tmp_path):
+    output = str(tmp_path / "results.jsonl")
+    requests = load_requests(input_path)
+    assert len(requests) == 8 and requests[0]["tool"] == "agent" and requests[-1]["id"] == "line-8"
+
+    # an interrupted run: the first three requests are already in the output
+    client = FakeClient()
+    asyncio.run(run_batch(client, requests[:3], output))
+    remaining = [r for r in requests if r["id"] not in completed_ids(output)]
+    assert len(remaining) == 5
+
+    client = FakeClient()
+    records = asyncio.run(run_batch(client, remaining, output, concurrency=2))
+    report = latency_report(records, 1.0)
+    print("\n[TEST] batch report:", report)
+    assert client.max_in_flight == 2
+    assert len(client.calls) == 5
+    with open(output, encoding="utf-8") as f:
+        assert sorted(json.loads(line)["id"] for line in f) == sorted(r["id"] for r in requests)
+    assert report["requests"] == 5 and report["errors"] == 1
+    assert set(report["tools"]) == {"agent", "retrieve_useful_reviews"}
+    assert report["tools"]["agent"]["p50"] <= report["tools"]["agent"]["p99"]
+
+    assert "line-8" in completed_ids(output) and "line-8" not in completed_ids(output, retry_errors=True)
+
+
+def test_failed_tool_results_are_recorded_as_errors(tmp_path):
+    requests = [
+        {"id": "ok", "tool": "agent", "arguments": {"user_query": "question"}},
+        {"id": "partial", "tool": "agent", "arguments": {"user_query": "partial"}},
+        {"id": "failed", "tool": "agent", "arguments": {"user_query": "failed"}},
+        {"id": "retrieval", "tool": "retrieve_useful_reviews", "arguments": {"keywords": ["broken"]}},
+        {"id": "summary", "tool": "summarize_reviews", "arguments": {"reviews": []}},
+    ]
+    output = str(tmp_path / "results.jsonl")
+    records = {r["id"]: r for r in asyncio.run(run_batch(FakeClient(), requests, output))}
+    print("\n[TEST] errors:", {i: r.get("error") for i, r in records.items()})
+    assert records["ok"]["status"] == "ok"
+    assert all(records[i]["status"] == "error" for i in ["partial", "failed", "retrieval", "summary"])
+    assert "Summarization failed" in records["summary"]["error"] and "boom" in records["retrieval"]["error"]
+    assert latency_report(list(records.values()), 1.0)["errors"] == 4
+    assert completed_ids(output, retry_errors=True) == {"ok"}
+
+
+def test_busy_server_is_retried(input_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(asyncio, "sleep", _no_wait(asyncio.sleep))
+    records = asyncio.run(run_batch(FakeClient(busy_times=2), load_requests(input_path)[:1], str(tmp_path / "results.jsonl")))
+    assert records[0]["status"] == "ok"
+
+
+def _no_wait(sleep):
+    async def short_sleep(seconds):
+        await sleep(min(seconds, 0.02))
+    return short_sleep
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+import sys
+import os
+import zlib
+
+# Add the parent directory to the path to import modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.embeddings import Embeddings
+from clusters import ClusterSummaries, build_clusters, kmeans
+from tools import AgentTools
+from vector import ReviewsVectorStore
+
+TOPICS = {"mouse": 0, "keyboard": 1, "headset": 2}
+
+
+class TopicEmbeddings(Embeddings):
+    # texts about the same product land close to the same axis, with a little text-dependent noise
+    def _embed(self, text):
+        vector = np.random.default_rng(zlib.crc32(text.encode())).normal(0, 0.05, 8)
+        for topic, axis in TOPICS.items():
+            if topic in text.lower():
+                vector[axis] += 1.0
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def test_kmeans_separates_clear_groups():
+    rng = np.random.default_rng(0)
+    centers = np.eye(4)[:3] * 5
+    vectors = np.concatenate([center + rng.normal(0, 0.3, (50, 4)) for center in centers])
+    centroids, labels = kmeans(vectors, 3, seed=1)
+    print("\n[TEST] cluster sizes:", np.bincount(labels))
+    assert centroids.shape == (3, 4)
+    assert all(len(set(labels[i * 50:(i + 1) * 50])) == 1 for i in range(3)) # each group in a single cluster
+    assert len(set(labels)) == 3
+
+
+@pytest.fixture
+def store(tmp_path):
+    csv_path = tmp_path / "reviews.csv"
+    rows = [
+        f'"{topic.title()} review","2024-0{1 + i % 9}-01","{rating}","The {topic} {text}"\n'
+        for topic, text, rating in [("mouse", "tracks well", 5), ("keyboard", "keys are loud", 2), ("headset", "sounds clear", 4)]
+        for i in range(6)
+    ]
+    with open(csv_path, "w", encoding="utf-8") as f:
+        f.write('"Title","Date","Rating","Review"\n')
+        f.writelines(rows)
+    db_path = tmp_path / "chroma_db"
+    db_path.mkdir()
+    store = ReviewsVectorStore(csv_file_path=str(csv_path), db_location=str(db_path), collection_name="test_reviews",
+                               embeddings=TopicEmbeddings(), backend="numpy")
+    store.sync_database()
+    return store
+
+
+def test_cluster_summaries_are_built_offline_and_served_by_the_tool(store):
+    summarized = []
+
+    def summarize(reviews):
+        summarized.append(reviews)
+        return f"summary of {reviews[0]['title'].split()[0].lower()} reviews"
+
+    clusters = build_clusters(store, summarize, n_clusters=3)
+    assert len(clusters) == 3 and len(summarized) == 3
+    assert sorted(c["size"] for c in clusters.clusters) == [6, 6, 6]
+
+    tools = AgentTools(None, None, store)
+    result = tools.get_cluster_summaries("which headset sounds best", n=2)
+    print("\n[TEST] nearest clusters:", [(c["summary"], c["similarity"]) for c in result["clusters"]])
+    best = result["clusters"][0]
+    assert best["summary"] == "summary of headset reviews"
+    assert best["statistics"]["average_rating"] == 4.0
+    assert best["keywords"] == ["headset"] # "review" is in every title
+    assert len(result["clusters"]) == 2 and result["stale"] is False
+
+    # persisted: a new store on the same directory serves them without rebuilding
+    reopened = ReviewsVectorStore(csv_file_path=store.csv_file_path, db_location=store.db_location, collection_name="test_reviews",
+                                  embeddings=TopicEmbeddings(), backend="numpy")
+    assert [c["summary"] for c in reopened.clusters.nearest(TopicEmbeddings().embed_query("mouse"), 1)] == ["summary of mouse reviews"]
+
+
+def test_failed_summary_is_not_persisted(store):
+    build_clusters(store, lambda reviews: "summary", n_clusters=3)
+    with pytest.raises(RuntimeError):
+        build_clusters(store, lambda reviews: "Summarization failed: ollama is down", n_clusters=2)
+    assert len(store.clusters) == 3 # the clusters built before are still served
+    reopened = ClusterSummaries(store.clusters.path)
+    assert [c["summary"] for c in reopened.clusters] == ["summary"] * 3
+
+
+def test_cluster_summaries_tool_without_clusters(store):
+    assert "error" in AgentTools(None, None, store).get_cluster_summaries("headset")
+    assert len(ClusterSummaries()) == 0
+
+
+def test_clusters_built_by_another_process_are_served_without_restart(store):
+    # the server's store was opened before clusters.py ran against the same directory
+    server_store = ReviewsVectorStore(csv_file_path=store.csv_file_path, db_location=store.db_location, collection_name="test_reviews",
+                                      embeddings=TopicEmbeddings(), backend="numpy")
+    tools = AgentTools(None, None, server_store)
+    assert "error" in tools.get_cluster_summaries("headset")
+
+    build_clusters(store, lambda reviews: f"summary of {reviews[0]['title'].split()[0].lower()} reviews", n_clusters=3)
+    result = tools.get_cluster_summaries("which headset sounds best", n=1)
+    print("\n[TEST] clusters after an offline build:", result)
+    assert result["clusters"][0]["summary"] == "summary of headset reviews"
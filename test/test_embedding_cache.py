@@ -0,0 +1,64 @@
+import pytest
+import sys
+import os
+
+# Add the parent directory to the path to import modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_cache import CachedEmbeddings
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(t)), 1.0, 0.5] for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "embedding_cache.sqlite3")
+
+
+def test_cache_skips_model_for_known_texts(cache_path):
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, "test-model", cache_path)
+
+    first = cache.embed_documents(["fast mouse", "loud fans", "fast mouse"])
+    second = cache.embed_documents(["loud fans", "new keyboard"])
+    query = cache.embed_query("fast mouse")
+
+    print("\n[TEST] cache stats:", cache.stats())
+    assert model.embedded == ["fast mouse", "loud fans", "new keyboard"]
+    assert first[0] == first[2] == query == [10.0, 1.0, 0.5]
+    assert second[0] == first[1]
+    assert cache.stats()["hits"] == 3 # the repeated "fast mouse" in the first batch counts as a hit
+    assert cache.stats()["misses"] == 3
+
+
+def test_cache_survives_restart_and_is_keyed_by_model(cache_path):
+    CachedEmbeddings(CountingEmbeddings(), "test-model", cache_path).embed_documents(["fast mouse"])
+
+    model = CountingEmbeddings()
+    CachedEmbeddings(model, "test-model", cache_path).embed_query("fast mouse")
+    assert model.embedded == []
+
+    CachedEmbeddings(model, "other-model", cache_path).embed_query("fast mouse")
+    assert model.embedded == ["fast mouse"]
+
+
+def test_cache_evicts_least_recently_used(cache_path):
+    cache = CachedEmbeddings(CountingEmbeddings(), "test-model", cache_path, max_size_mb=30 / (1024 * 1024)) # room for two vectors
+    cache.embed_documents(["a"])
+    cache.embed_documents(["b"])
+    cache.embed_query("a") # "b" is now the least recently used
+    cache.embed_documents(["c"])
+
+    assert cache.stats()["entries"] <= 2
+    cache.embed_query("a")
+    assert cache.stats()["hits"] == 2
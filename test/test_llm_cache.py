@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+import sys
+import os
+import time
+
+# Add the parent directory to the path to import modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_cache import LLMResponseCache
+from tools import AgentTools
+
+
+class CountingLLM:
+    def __init__(self):
+        self.prompts = []
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        if "Extract" in prompt:
+            return "mouse,battery"
+        return f"answer {len(self.prompts)}"
+
+    async def ainvoke(self, prompt):
+        return self.invoke(prompt)
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "llm_cache.sqlite3")
+
+
+def test_repeated_prompts_skip_the_llm(cache_path):
+    llm = CountingLLM()
+    tools = AgentTools(llm, None, response_cache=LLMResponseCache("test-model", cache_path))
+    reviews = [{"content": "Great mouse", "rating": 5}]
+
+    assert tools.extract_important_keywords("Wireless  mouse battery") == ["mouse", "battery"]
+    assert tools.extract_important_keywords("wireless mouse battery ") == ["mouse", "battery"] # same normalized query
+    first = tools.summarize_reviews(reviews)
+    assert asyncio.run(tools.asummarize_reviews(reviews)) == first
+    print("\n[TEST] llm cache stats:", tools.response_cache.stats())
+    assert len(llm.prompts) == 2
+
+    tools.summarize_reviews([{"content": "Loud fans", "rating": 2}])
+    assert len(llm.prompts) == 3
+
+
+def test_cache_survives_restart_and_is_keyed_by_model_and_template(cache_path):
+    LLMResponseCache("test-model", cache_path).put(LLMResponseCache("test-model").key("template {x}", "input"), "cached")
+
+    cache = LLMResponseCache("test-model", cache_path)
+    assert cache.get(cache.key("template {x}", "input")) == "cached"
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.get(cache.key("edited template {x}", "input")) is None
+    other = LLMResponseCache("other-model", cache_path)
+    assert other.get(other.key("template {x}", "input")) is None
+
+
+def test_entries_expire_and_are_bounded(cache_path):
+    cache = LLMResponseCache("test-model", cache_path, max_entries=2, ttl=0.2, max_disk_entries=2)
+    for i in range(3):
+        cache.put(cache.key("t", str(i)), f"answer {i}")
+    assert cache.stats()["memory"]["entries"] == 2
+    assert cache.stats()["disk_entries"] == 2
+    assert cache.get(cache.key("t", "0")) is None # least recently used, evicted from both
+    assert cache.get(cache.key("t", "2")) == "answer 2"
+
+    time.sleep(0.25)
+    assert cache.get(cache.key("t", "2")) is None
@@ -254,6 +254,128 @@ def test_error_handling():
     # Test that client can be created without errors
     assert isinstance(client.last_keywords, list)
 
+FAKE_SERVER = """
+import json, sys
+requests = [json.loads(sys.stdin.readline()) for _ in range(3)]
+print(json.dumps({"jsonrpc": "2.0", "method": "notifications/message", "params": {"level": "info", "data": "log"}}), flush=True)
+print(json.dumps({"jsonrpc": "2.0", "id": 999, "result": {"late": True}}), flush=True)
+for request in reversed(requests):
+    meta = request["params"].get("_meta")
+    if meta:
+        print(json.dumps({"jsonrpc": "2.0", "method": "notifications/progress",
+                          "params": {"progressToken": meta["progressToken"], "progress": 1, "message": "chunk"}}), flush=True)
+    text = json.dumps(request["params"]["arguments"]["user_query"])
+    print(json.dumps({"jsonrpc": "2.0", "id": request["id"], "result": {"content": [{"type": "text", "text": text}]}}), flush=True)
+sys.stdin.readline()
+"""
+
+
+def test_concurrent_requests_are_routed_by_id(tmp_path):
+    script = tmp_path / "fake_server.py"
+    script.write_text(FAKE_SERVER)
+
+    async def run():
+        client = SimpleMCPClient()
+        client.process = await asyncio.create_subprocess_exec(
+            sys.executable, str(script), stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE
+        )
+        client._reader_task = asyncio.create_task(client._read_messages())
+        chunks = []
+        results = await asyncio.gather(*[
+            client.call_tool("extract_important_keywords", {"user_query": query}, on_progress=chunks.append if query == "b" else None)
+            for query in ["a", "b", "c"]
+        ])
+        await client.stop_server()
+        return results, chunks
+
+    results, chunks = asyncio.run(run())
+    print("\n[TEST] concurrent results:", results)
+    # the server answered in reverse order, every caller still gets its own response
+    assert [json.loads(r["content"][0]["text"]) for r in results] == ["a", "b", "c"]
+    assert chunks == ["chunk"]
+
+
+def test_http_transport_serves_many_clients_from_one_server(monkeypatch):
+    import socket
+    import mcp_server
+    from tools import AgentTools
+
+    class StreamingLLM:
+        async def astream(self, prompt):
+            for chunk in ["Light ", "and fast."]:
+                await asyncio.sleep(0.05)
+                yield chunk
+
+    monkeypatch.setattr(mcp_server, "tools", AgentTools(StreamingLLM(), None))
+    monkeypatch.setattr(mcp_server, "initialize_system", lambda **kwargs: True)
+    monkeypatch.setattr(mcp_server, "_initialization", None)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    async def run():
+        server_task = asyncio.create_task(mcp_server.main_http("127.0.0.1", port, warmup=False))
+        await asyncio.sleep(0.5)
+        clients = [SimpleMCPClient(f"http://127.0.0.1:{port}/mcp/") for _ in range(3)]
+        try:
+            assert all(await asyncio.gather(*[c.start_server(ready_timeout=5) for c in clients]))
+            chunks = [[] for _ in clients]
+            results = await asyncio.gather(*[
+                c.call_tool("summarize_reviews", {"reviews": [{"content": "Great mouse"}]}, on_progress=chunks[i].append)
+                for i, c in enumerate(clients)
+            ])
+            return [json.loads(r["content"][0]["text"]) for r in results], chunks, {c.session_id for c in clients}
+        finally:
+            for c in clients:
+                await c.stop_server()
+            server_task.cancel()
+            await asyncio.gather(server_task, return_exceptions=True)
+
+    summaries, chunks, sessions = asyncio.run(run())
+    print("\n[TEST] http summaries:", summaries, chunks)
+    assert summaries == ["Light and fast."] * 3
+    assert chunks == [["Light ", "and fast."]] * 3 # progress streamed to each session
+    assert len(sessions) == 3
+
+
+def test_heartbeats_keep_slow_calls_alive(monkeypatch):
+    import socket
+    import mcp_server
+    from scheduler import ToolScheduler
+    from tools import AgentTools
+
+    class SlowLLM:
+        async def astream(self, prompt):
+            await asyncio.sleep(1.0) # model loading and prompt processing, no token yet
+            yield "Heavy but precise."
+
+    monkeypatch.setattr(mcp_server, "tools", AgentTools(SlowLLM(), None))
+    monkeypatch.setattr(mcp_server, "scheduler", ToolScheduler({"summarize_reviews": 1})) # the second call waits in the queue
+    monkeypatch.setattr(mcp_server, "HEARTBEAT_SECONDS", 0.1)
+    monkeypatch.setattr(mcp_server, "initialize_system", lambda **kwargs: True)
+    monkeypatch.setattr(mcp_server, "_initialization", None)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    async def run():
+        server_task = asyncio.create_task(mcp_server.main_http("127.0.0.1", port, warmup=False))
+        await asyncio.sleep(0.5)
+        client = SimpleMCPClient(f"http://127.0.0.1:{port}/mcp/")
+        try:
+            assert await client.start_server(ready_timeout=5)
+            return await asyncio.gather(*[client.call_tool("summarize_reviews", {"reviews": [{"content": "Heavy mouse"}]}, timeout=0.5) for _ in range(2)])
+        finally:
+            await client.stop_server()
+            server_task.cancel()
+            await asyncio.gather(server_task, return_exceptions=True)
+
+    start = time.perf_counter()
+    results = asyncio.run(run())
+    print(f"\n[TEST] slow calls with a 0.5s idle timeout answered in {time.perf_counter() - start:.2f}s:", results)
+    assert [json.loads(r["content"][0]["text"]) for r in results] == ["Heavy but precise."] * 2
+
+
 if __name__ == "__main__":
     # Run tests with pytest
     print("Running MCP integration tests...")
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import sys
+import os
+import time
+
+# Add the parent directory to the path to import modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class SlowLLM:
+    async def ainvoke(self, prompt):
+        await asyncio.sleep(0.3)
+        return "Summary"
+
+
+def test_server_answers_during_startup_and_calls_wait_for_readiness(monkeypatch):
+    import mcp_server
+    from tools import AgentTools
+    monkeypatch.setattr(mcp_server, "tools", None)
+    monkeypatch.setattr(mcp_server, "_initialization", None)
+    monkeypatch.setattr(mcp_server, "startup", {**mcp_server.startup, "ready": False, "initialized_seconds": None, "first_answer_seconds": None})
+
+    def slow_initialize_system(**kwargs):
+        time.sleep(0.3) # loading the components
+        mcp_server.tools = AgentTools(SlowLLM(), None)
+        return True
+
+    monkeypatch.setattr(mcp_server, "initialize_system", slow_initialize_system)
+
+    async def status(wait=0):
+        return json.loads((await mcp_server.handle_call_tool("get_server_status", {"wait": wait}))[0].text)
+
+    async def run():
+        mcp_server.start_initialization(warmup=False)
+        before = await status()
+        tool_list = await mcp_server.handle_list_tools()
+        summary = await mcp_server.handle_call_tool("summarize_reviews", {"reviews": []}) # waits for the components
+        return before, len(tool_list), json.loads(summary[0].text), await status(wait=1)
+
+    start = time.perf_counter()
+    before, tool_count, summary, after = asyncio.run(run())
+    print("\n[TEST] startup status:", before, after)
+    assert before["ready"] is False and tool_count > 0
+    assert summary == "Summary"
+    assert after["ready"] is True and after["warmup"] == "skipped"
+    assert after["initialized_seconds"] <= after["first_answer_seconds"]
+    assert time.perf_counter() - start < 1.0
+
+
+class StreamingLLM:
+    async def ainvoke(self, prompt):
+        return "Great mouse, long battery."
+
+    async def astream(self, prompt):
+        for chunk in ["Great ", "mouse, ", "long battery."]:
+            await asyncio.sleep(0.01)
+            yield chunk
+
+
+def test_summary_is_streamed_as_progress_notifications(monkeypatch):
+    import mcp_server
+    from tools import AgentTools
+    monkeypatch.setattr(mcp_server, "tools", AgentTools(StreamingLLM(), None))
+    assert mcp_server._request_progress() == (None, None) # outside of a request there is nobody to notify
+    chunks = []
+
+    async def collect(chunk):
+        chunks.append(chunk)
+
+    monkeypatch.setattr(mcp_server, "_request_progress", lambda: (collect, None))
+    result = asyncio.run(mcp_server.handle_call_tool("summarize_reviews", {"reviews": [{"content": "Great mouse", "rating": 5}]}))
+    print("\n[TEST] streamed chunks:", chunks)
+    assert chunks == ["Great ", "mouse, ", "long battery."]
+    assert json.loads(result[0].text) == "Great mouse, long battery."
+
+
+def test_tokens_and_heartbeats_share_one_increasing_progress_counter(monkeypatch):
+    import mcp_server
+    from types import SimpleNamespace
+    from mcp.server.lowlevel.server import request_ctx
+    from tools import AgentTools
+    monkeypatch.setattr(mcp_server, "tools", AgentTools(StreamingLLM(), None))
+    monkeypatch.setattr(mcp_server, "HEARTBEAT_SECONDS", 0.004) # beats between the tokens
+    notifications = []
+
+    class Session:
+        async def send_progress_notification(self, token, progress, message=None, related_request_id=None):
+            notifications.append((progress, message))
+
+    async def call():
+        request_ctx.set(SimpleNamespace(meta=SimpleNamespace(progressToken="p1"), session=Session(), request_id=1))
+        return await mcp_server.handle_call_tool("summarize_reviews", {"reviews": [{"content": "Great mouse", "rating": 5}]})
+
+    asyncio.run(call())
+    print("\n[TEST] progress notifications:", notifications)
+    progress = [value for value, _ in notifications]
+    assert progress == sorted(set(progress)) # strictly increasing, heartbeats included
+    assert [message for _, message in notifications if message] == ["Great ", "mouse, ", "long battery."]
+    assert any(message is None for _, message in notifications)
+
+
+def test_components_are_published_together_and_errors_are_not_first_answers(monkeypatch, tmp_path):
+    import mcp_server
+    import agent as agent_module
+    import vector
+
+    class FakeStore:
+        db_location = str(tmp_path)
+
+        def __init__(self, **kwargs):
+            pass
+
+        def init_database(self, **kwargs):
+            pass
+
+        def get_stats(self):
+            return {"collection": "test", "count": 0, "embedding_dimension": None}
+
+        def get_retriever(self, k):
+            return None
+
+    class CheckedAgent(agent_module.Agent):
+        def __init__(self, *args, **kwargs):
+            # tools is what lets the calls through: it must not be visible before the agent exists
+            assert mcp_server.tools is None and mcp_server.agent is None
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(vector, "ReviewsVectorStore", FakeStore)
+    monkeypatch.setattr(agent_module, "Agent", CheckedAgent)
+    for name in ["llm", "vector_store", "retriever", "tools", "agent"]:
+        monkeypatch.setattr(mcp_server, name, None)
+    assert mcp_server.initialize_system(synonyms_path=None)
+    assert mcp_server.agent is not None and mcp_server.tools is not None
+
+    monkeypatch.setattr(mcp_server, "startup", {**mcp_server.startup, "first_answer_seconds": None})
+    failed = asyncio.run(mcp_server.handle_call_tool("get_reviews_aggregates", {"group_by": "year"})) # FakeStore has no tables
+    assert "error" in json.loads(failed[0].text)
+    assert mcp_server.startup["first_answer_seconds"] is None
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import pytest
+import sys
+import os
+import time
+
+# Add the parent directory to the path to import modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline import Stage, arun_dag, run_dag
+from agent import Agent
+
+
+def sleeping(seconds, value):
+    def run(inputs):
+        time.sleep(seconds)
+        return value
+    return run
+
+
+def test_independent_stages_run_concurrently():
+    start = time.perf_counter()
+    outcomes = run_dag([
+        Stage("a", sleeping(0.05, 1)),
+        Stage("b", lambda inputs: sleeping(0.3, inputs["a"] + 1)(inputs), ["a"]),
+        Stage("c", lambda inputs: sleeping(0.3, inputs["a"] + 2)(inputs), ["a"]),
+    ])
+    elapsed = time.perf_counter() - start
+    print("\n[TEST] dag outcomes:", outcomes, f"in {elapsed:.2f}s")
+    assert [outcomes[n]["result"] for n in "abc"] == [1, 2, 3]
+    assert elapsed < 0.55 # critical path is 0.35s, the sum of the stages 0.65s
+
+
+def test_timeouts_and_failures_give_partial_results():
+    def broken(inputs):
+        raise RuntimeError("boom")
+
+    start = time.perf_counter()
+    outcomes = run_dag([
+        Stage("a", sleeping(0.0, "ok")),
+        Stage("slow", sleeping(2.0, "late"), ["a"], timeout=0.1),
+        Stage("fast", sleeping(0.0, "stats"), ["a"], timeout=1.0),
+        Stage("broken", broken, ["a"]),
+        Stage("after_broken", sleeping(0.0, "never"), ["broken"]),
+    ])
+    print("\n[TEST] partial outcomes:", outcomes)
+    assert time.perf_counter() - start < 1.0 # the slow stage is not waited for
+    assert outcomes["slow"]["status"] == "timeout"
+    assert outcomes["fast"] == {"status": "ok", "seconds": outcomes["fast"]["seconds"], "result": "stats"}
+    assert outcomes["broken"]["status"] == "error" and outcomes["broken"]["error"] == "boom"
+    assert outcomes["after_broken"]["status"] == "skipped"
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(ValueError):
+        run_dag([Stage("a", sleeping(0.0, 1), ["missing"])])
+
+
+def test_async_dag_cancels_stages_that_time_out():
+    async def value(seconds, result):
+        await asyncio.sleep(seconds)
+        return result
+
+    start = time.perf_counter()
+    outcomes = asyncio.run(arun_dag([
+        Stage("a", lambda inputs: value(0.05, 1)),
+        Stage("slow", lambda inputs: value(5.0, "late"), ["a"], timeout=0.1),
+        Stage("b", lambda inputs: value(0.2, inputs["a"] + 1), ["a"]),
+        Stage("c", lambda inputs: value(0.2, inputs["a"] + 2), ["a"]),
+        Stage("after_slow", lambda inputs: value(0.0, "never"), ["slow"]),
+    ]))
+    print("\n[TEST] async dag outcomes:", outcomes)
+    assert time.perf_counter() - start < 0.5
+    assert [outcomes[n].get("result") for n in "abc"] == [1, 2, 3]
+    assert outcomes["slow"]["status"] == "timeout"
+    assert outcomes["after_slow"]["status"] == "skipped"
+
+
+class SlowTools:
+    def extract_important_keywords(self, user_query):
+        return ["mouse", "battery"]
+
+    def retrieve_useful_reviews(self, keywords):
+        return [{"content": "Great mouse", "rating": 5, "date": "2024-01-01", "similarity": 0.9}]
+
+    def summarize_reviews(self, reviews):
+        time.sleep(1.0)
+        return "Summary"
+
+    def get_reviews_statistics(self, reviews):
+        return {"total_reviews": len(reviews)}
+
+
+def test_agent_returns_statistics_when_the_summary_times_out():
+    agent = Agent(llm=None, retriever=None, stage_timeouts={"summary": 0.1})
+    agent.agent_tools = SlowTools()
+    result = json.loads(agent.process_query("Is the battery good?"))
+    print("\n[TEST] parallel agent result:", result)
+    assert result["status"] == "partial"
+    assert result["summary"] is None
+    assert result["statistics"] == {"total_reviews": 1}
+    assert result["stages"]["summary"]["status"] == "timeout"
+    assert result["keywords"] == ["mouse", "battery"]
+
+
+class DownLLM:
+    def invoke(self, prompt):
+        raise ConnectionError("ollama is down")
+
+    async def ainvoke(self, prompt):
+        raise ConnectionError("ollama is down")
+
+
+def llm_down_agent(store=None, semantic_cache=None):
+    # keywords and retrieval work without the LLM, the summary needs it
+    from tools import AgentTools
+
+    class Tools(AgentTools):
+        def extract_important_keywords(self, user_query, mode=None):
+            return ["mouse", "heavy"]
+
+        async def aextract_important_keywords(self, user_query, mode=None):
+            return ["mouse", "heavy"]
+
+        def retrieve_useful_reviews(self, keywords, k=5, min_similarity=0.15, **kwargs):
+            return [{"content": "Great mouse", "rating": 5, "date": "2024-01-01", "similarity": 0.9}]
+
+    agent = Agent(llm=None, retriever=None, store=store, semantic_cache=semantic_cache)
+    agent.agent_tools = Tools(DownLLM(), None)
+    return agent
+
+
+def test_agent_reports_llm_stage_failures():
+    agent = llm_down_agent()
+    for result in [json.loads(agent.process_query("Is the mouse heavy?")), json.loads(asyncio.run(agent.aprocess_query("Is the mouse heavy?")))]:
+        print("\n[TEST] agent result with the LLM down:", result["status"], result["stages"])
+        assert result["status"] == "partial"
+        assert result["stages"]["summary"]["status"] == "error" and "ollama is down" in result["stages"]["summary"]["error"]
+        assert result["summary"] is None
+        assert result["stages"]["statistics"]["status"] == "ok" and result["statistics"]["total_reviews"] == 1
+
+    agent.agent_tools.extract_important_keywords = lambda user_query: [{"error": "Extraction failed: ollama is down"}]
+    result = json.loads(agent.process_query("Is the mouse heavy?"))
+    assert result["status"] == "error"
+    assert result["stages"]["keywords"]["status"] == "error" and result["stages"]["reviews"]["status"] == "skipped"
+
+
+class CountingTools(SlowTools):
+    def __init__(self):
+        self.calls = 0
+
+    def extract_important_keywords(self, user_query):
+        self.calls += 1
+        return ["mouse", "heavy"]
+
+    def summarize_reviews(self, reviews):
+        return "Summary"
+
+
+class EmbeddingStore:
+    generation = 0
+    vectors = {
+        "is the mouse heavy?": [1.0, 0.1, 0.0],
+        "how heavy does the mouse feel": [0.98, 0.15, 0.0],
+        "is the keyboard loud?": [0.0, 0.2, 1.0],
+    }
+
+    def embed_query(self, query):
+        return self.vectors[query]
+
+
+def test_agent_semantic_cache_answers_paraphrases():
+    from caches import SemanticCache
+    store = EmbeddingStore()
+    agent = Agent(llm=None, retriever=None, store=store, semantic_cache=SemanticCache(threshold=0.95, max_entries=2))
+    agent.agent_tools = tools = CountingTools()
+
+    first = json.loads(agent.process_query("is the mouse heavy?"))
+    paraphrase = json.loads(agent.process_query("how heavy does the mouse feel"))
+    print("\n[TEST] semantic cache hit:", paraphrase["cache"])
+    assert tools.calls == 1 and "cache" not in first
+    assert paraphrase["cache"]["query"] == "is the mouse heavy?" and paraphrase["cache"]["similarity"] >= 0.95
+    assert paraphrase["query"] == "how heavy does the mouse feel"
+    assert paraphrase["summary"] == first["summary"]
+
+    agent.process_query("is the keyboard loud?") # too far from the cached query
+    assert tools.calls == 2
+
+    store.generation += 1 # the collection was re-ingested
+    assert "cache" not in json.loads(agent.process_query("how heavy does the mouse feel"))
+    assert tools.calls == 3
+
+
+def test_failed_answers_are_not_cached():
+    from caches import SemanticCache
+    cache = SemanticCache(threshold=0.95)
+    agent = llm_down_agent(EmbeddingStore(), cache)
+    first = json.loads(agent.process_query("is the mouse heavy?"))
+    paraphrase = json.loads(asyncio.run(agent.aprocess_query("how heavy does the mouse feel")))
+    print("\n[TEST] semantic cache with the LLM down:", cache.stats())
+    assert first["status"] == paraphrase["status"] == "partial"
+    assert "cache" not in paraphrase and len(cache) == 0
+
+    # an error value that slipped into a "success" result is refused too
+    result = {"status": "success", "summary": "Summarization failed: ollama is down", "stages": {}}
+    agent._cache_store("is the mouse heavy?", [1.0, 0.1, 0.0], 0, json.dumps(result))
+    assert len(cache) == 0
+
+
+def test_semantic_cache_entries_expire_and_are_bounded():
+    from caches import SemanticCache
+    cache = SemanticCache(threshold=0.9, max_entries=2, ttl=0.1)
+    for i, vector in enumerate([[1, 0, 0], [0, 1, 0], [0, 0, 1]]):
+        cache.put(f"q{i}", vector, f"answer {i}")
+    assert len(cache) == 2
+    assert cache.get([1, 0, 0]) is None # least recently used, evicted
+    assert cache.get([0, 0, 2])["value"] == "answer 2" # cosine similarity, the length does not matter
+    time.sleep(0.15)
+    assert cache.get([0, 0, 1]) is None
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import sys
+import os
+import threading
+import time
+
+# Add the parent directory to the path to import modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import LLMLimiter
+from tools import AgentTools
+
+
+class InFlightLLM:
+    # counts the generations running at the same time
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def _enter(self):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+
+    def _exit(self):
+        with self.lock:
+            self.running -= 1
+
+    def invoke(self, prompt):
+        self._enter()
+        try:
+            time.sleep(0.02)
+            return "partial: battery praised"
+        finally:
+            self._exit()
+
+    async def ainvoke(self, prompt):
+        self._enter()
+        try:
+            await asyncio.sleep(0.02)
+            return "partial: battery praised"
+        finally:
+            self._exit()
+
+
+def test_llm_limiter_caps_generations_across_tools():
+    reviews = [{"content": f"review-{i} " + "the battery lasts long " * 10, "rating": 4} for i in range(40)]
+    llm = InFlightLLM()
+    limiter = LLMLimiter(2)
+    # two tools sharing the limiter, each summary fans out into summary_concurrency batches
+    tools = [AgentTools(llm, None, summary_budget=200, summary_concurrency=4, llm_limiter=limiter) for _ in range(2)]
+
+    async def run():
+        return await asyncio.gather(*[t.asummarize_reviews(reviews) for t in tools for _ in range(2)])
+
+    summaries = asyncio.run(run())
+    print(f"\n[TEST] peak in-flight LLM calls: {llm.peak}, limiter:", limiter.metrics())
+    assert all(s.startswith("partial") for s in summaries)
+    assert llm.peak == limiter.peak == 2
+    assert (limiter.running, limiter.waiting) == (0, 0)
+
+    # the synchronous pipeline (threads) is capped the same way
+    llm = InFlightLLM()
+    tools = AgentTools(llm, None, summary_budget=200, llm_limiter=LLMLimiter(2))
+    threads = [threading.Thread(target=tools.summarize_reviews, args=(reviews,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert llm.peak == 2
+
+
+class SlowLLM:
+    async def ainvoke(self, prompt):
+        await asyncio.sleep(0.3)
+        return "Summary"
+
+
+def test_server_tool_calls_overlap(monkeypatch):
+    import mcp_server
+    from tools import AgentTools
+    from scheduler import ToolScheduler
+    monkeypatch.setattr(mcp_server, "tools", AgentTools(SlowLLM(), None))
+    monkeypatch.setattr(mcp_server, "scheduler", ToolScheduler({"summarize_reviews": 3}))
+
+    async def run():
+        return await asyncio.gather(*[mcp_server.handle_call_tool("summarize_reviews", {"reviews": []}) for _ in range(3)])
+
+    start = time.perf_counter()
+    results = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    print(f"\n[TEST] 3 concurrent summaries in {elapsed:.2f}s")
+    assert all(json.loads(r[0].text) == "Summary" for r in results)
+    assert elapsed < 0.6 # queued one after the other they would take 0.9s
+
+
+def test_scheduler_limits_queues_and_rejects_tool_calls(monkeypatch):
+    import mcp_server
+    from scheduler import ToolScheduler
+    from tools import AgentTools
+    monkeypatch.setattr(mcp_server, "tools", AgentTools(SlowLLM(), None))
+    monkeypatch.setattr(mcp_server, "scheduler", ToolScheduler({"summarize_reviews": 1}, max_queue=1))
+
+    async def run():
+        return await asyncio.gather(*[mcp_server.handle_call_tool("summarize_reviews", {"reviews": []}) for _ in range(3)])
+
+    start = time.perf_counter()
+    results = [json.loads(r[0].text) for r in asyncio.run(run())]
+    elapsed = time.perf_counter() - start
+    metrics = json.loads(asyncio.run(mcp_server.handle_call_tool("get_server_metrics", {}))[0].text)["scheduler"]
+    print(f"\n[TEST] scheduled results in {elapsed:.2f}s:", results, metrics["tools"]["summarize_reviews"])
+    assert results[:2] == ["Summary", "Summary"] # one running, one waiting for the slot
+    assert results[2]["busy"] is True # the queue was full
+    assert 0.55 < elapsed < 0.9 # the two accepted calls ran one after the other
+    summaries = metrics["tools"]["summarize_reviews"]
+    assert (summaries["completed"], summaries["rejected"], summaries["running"], summaries["queued"]) == (2, 1, 0, 0)
+    assert summaries["wait_seconds"]["max"] >= 0.25
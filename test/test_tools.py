@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 import sys
 import os
@@ -27,6 +28,9 @@ class DummyLLM:
             )
         return "test"
 
+    async def ainvoke(self, prompt):
+        return self.invoke(prompt)
+
 
 class DummyDoc:
     def __init__(self, content, rating, date, title):
@@ -57,7 +61,35 @@ class DummyRetriever:
         self.vectorstore = DummyVectorStore()
 
 
-from tools import AgentTools
+class DummyStore:
+    def __init__(self):
+        self.last_keywords = None
+        self.last_filters = None
+
+    def similarity_search(self, query, k=5, filters=None):
+        self.last_filters = filters
+        return DummyVectorStore().similarity_search_with_score(query, k)
+
+    def hybrid_search(self, query, k=5, keywords=None, filters=None):
+        self.last_keywords = keywords
+        self.last_filters = filters
+        docs = [
+            (DummyDoc("The DeathAdder is lighter than it looks.", 5, "2024-02-01", "DeathAdder"), 0.2, 0.032),
+            (DummyDoc("Great mouse, very responsive and ergonomic.", 5, "2024-01-01", "Awesome Mouse"), 0.1, 0.016),
+        ]
+        return docs[:k]
+
+    def similarity_search_batch(self, queries, k=5, filters=None):
+        self.last_queries = queries
+        self.last_filters = filters
+        return [self.similarity_search(query, k, filters) for query in queries]
+
+    def hybrid_search_batch(self, queries, k=5, keywords=None, filters=None):
+        self.last_queries = queries
+        return [self.hybrid_search(query, k, query_keywords, filters) for query, query_keywords in zip(queries, keywords)]
+
+
+from tools import AgentTools, tool_error
 
 
 @pytest.fixture
@@ -95,6 +127,62 @@ def test_similarity_calculation(agent_tools):
     assert reviews[0]["similarity"] == 0.9
 
 
+def test_retrieve_useful_reviews_hybrid():
+    store = DummyStore()
+    tools = AgentTools(DummyLLM(), DummyRetriever(), store, retrieval_mode="hybrid")
+    reviews = tools.retrieve_useful_reviews(["DeathAdder", "weight"], k=2)
+    print("\n[TEST] hybrid retrieval result:", reviews)
+    assert store.last_keywords == ["deathadder", "weight"]
+    assert [r["title"] for r in reviews] == ["DeathAdder", "Awesome Mouse"] # fused order, not distance order
+    assert reviews[0]["similarity"] == 0.8
+
+
+def test_retrieve_useful_reviews_filters_are_pushed_down():
+    store = DummyStore()
+    tools = AgentTools(DummyLLM(), DummyRetriever(), store)
+    reviews = tools.retrieve_useful_reviews(["battery"], k=3, max_rating=2, date_from="2023")
+    assert store.last_filters == {"max_rating": 2, "date_from": "2023"}
+    assert len(reviews) == 3
+
+
+def test_retrieve_useful_reviews_batch():
+    store = DummyStore()
+    tools = AgentTools(DummyLLM(), DummyRetriever(), store)
+    batch = tools.retrieve_useful_reviews_batch([["mouse", "wireless"], ["battery"]], k=3, min_similarity=0.75)
+    print("\n[TEST] retrieve_useful_reviews_batch result:", batch)
+    assert store.last_queries == ["mouse wireless", "battery"]
+    assert len(batch) == 2
+    assert batch[0] == tools.retrieve_useful_reviews(["mouse", "wireless"], k=3, min_similarity=0.75)
+    assert all(r["similarity"] >= 0.75 for results in batch for r in results)
+
+    # the same keyword set in another order or case is the same query, so it hits the store query caches
+    tools.retrieve_useful_reviews_batch([["Wireless", "mouse"], ["BATTERY"]], k=3)
+    assert store.last_queries == ["mouse wireless", "battery"]
+
+    batch = tools.retrieve_useful_reviews_batch([["DeathAdder"], ["mouse"]], k=1, mode="hybrid")
+    assert store.last_keywords == ["mouse"]
+    assert [results[0]["title"] for results in batch] == ["DeathAdder", "DeathAdder"]
+
+
+def test_retrieve_useful_reviews_batch_failure_keeps_one_list_per_set():
+    tools = AgentTools(DummyLLM(), DummyRetriever(), DummyStore())
+    batch = tools.retrieve_useful_reviews_batch([["mouse"], ["battery"]], mode="sparse")
+    print("\n[TEST] failed batch:", batch)
+    assert len(batch) == 2
+    assert all("error" in results[0] for results in batch)
+    assert "Unknown retrieval mode" in tool_error(batch)
+
+
+def test_retrieve_useful_reviews_unknown_mode(agent_tools):
+    reviews = agent_tools.retrieve_useful_reviews(["mouse"], mode="sparse")
+    assert "error" in reviews[0]
+
+
+def test_get_reviews_aggregates_needs_the_store(agent_tools):
+    result = agent_tools.get_reviews_aggregates("year")
+    assert "error" in result
+
+
 def test_summarize_reviews(agent_tools):
     reviews = [
         {"title": "Awesome Mouse", "rating": 5, "date": "2024-01-01",
@@ -109,6 +197,61 @@ def test_summarize_reviews(agent_tools):
     assert len(summary) > 50
 
 
+class RecordingLLM:
+    def __init__(self):
+        self.prompts = []
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        return f"partial {len(self.prompts)}: battery praised, some sensor complaints"
+
+    async def ainvoke(self, prompt):
+        return self.invoke(prompt)
+
+
+def test_summarize_many_reviews_with_map_reduce():
+    from prompt_packing import estimate_tokens, format_review
+    reviews = [
+        {"title": "Mouse", "rating": 4, "date": "2024-01-01", "similarity": 0.8123456,
+         "content": f"review-{i} " + "the battery lasts long and the sensor is precise " * 5}
+        for i in range(50)
+    ]
+    assert format_review(reviews[0]).startswith("[4/5 2024-01-01] Mouse: review-0 ")
+    assert "similarity" not in format_review(reviews[0])
+
+    llm = RecordingLLM()
+    tools = AgentTools(llm, DummyRetriever(), summary_budget=300)
+    summary = tools.summarize_reviews(reviews)
+    map_prompts = [p for p in llm.prompts if "one batch of a larger set" in p]
+    print(f"\n[TEST] {len(reviews)} reviews summarized with {len(map_prompts)} batches and {len(llm.prompts) - len(map_prompts)} merges")
+    assert summary.startswith("partial")
+    assert len(map_prompts) > 1 and "Partial summaries" in llm.prompts[-1]
+    # every review is in exactly one batch, every prompt stays inside the budget (plus the fixed template)
+    assert all(sum(f"review-{i} " in p for p in map_prompts) == 1 for i in range(len(reviews)))
+    assert all(estimate_tokens(p) <= 300 + estimate_tokens(tools.prompt_merge_summaries) for p in llm.prompts)
+
+    llm_async = RecordingLLM()
+    tools_async = AgentTools(llm_async, DummyRetriever(), summary_budget=300)
+    steps = []
+
+    async def on_step():
+        steps.append(len(llm_async.prompts))
+
+    assert asyncio.run(tools_async.asummarize_reviews(reviews, on_step=on_step)).startswith("partial")
+    assert sorted(llm_async.prompts[:len(map_prompts)]) == sorted(map_prompts)
+    assert len(steps) == len(llm_async.prompts) - 1 # one step per batch, the final merge is the answer itself
+
+
+def test_summary_budget_too_small_is_rejected():
+    from tools import MIN_SUMMARY_BUDGET
+    with pytest.raises(ValueError):
+        AgentTools(DummyLLM(), DummyRetriever(), summary_budget=5)
+    # at the minimum the reduce rounds still converge
+    reviews = [{"content": f"review-{i} " + "the sensor is precise " * 10} for i in range(20)]
+    summary = AgentTools(RecordingLLM(), DummyRetriever(), summary_budget=MIN_SUMMARY_BUDGET).summarize_reviews(reviews)
+    assert summary.startswith("partial")
+
+
 def test_get_reviews_statistics(agent_tools):
     reviews = [
         {"content": "Great mouse", "rating": 5, "date": "2024-01-01", "title": "Awesome Mouse"},
@@ -117,8 +260,29 @@ def test_get_reviews_statistics(agent_tools):
     ]
     stats = agent_tools.get_reviews_statistics(reviews)
     print("\n[TEST] get_reviews_statistics result:", stats)
-    assert isinstance(stats, str)
-    assert "Average rating" in stats or "average" in stats.lower()
+    assert isinstance(stats, dict)
+    assert agent_tools.llm.last_prompt is None # no LLM call for the numbers
+    assert stats["total_reviews"] == 3
+    assert stats["average_rating"] == pytest.approx(4.333, abs=1e-3)
+    assert stats["median_rating"] == 5
+    assert stats["histogram"] == {"1": 0, "2": 0, "3": 1, "4": 0, "5": 2}
+    assert (stats["positive"], stats["neutral"], stats["negative"]) == (2, 1, 0)
+    assert stats["date_span"] == {"first": "2024-01-01", "last": "2024-01-03", "days": 2}
+
+
+def test_get_reviews_statistics_weights_and_narrative(agent_tools):
+    reviews = [
+        {"content": "Great mouse", "rating": 5, "date": "2024-01-01", "similarity": 0.9},
+        {"content": "Stopped working", "rating": 1, "date": "not a date", "similarity": 0.1},
+        {"content": "No rating", "rating": None, "date": None, "similarity": 0.5},
+    ]
+    stats = agent_tools.get_reviews_statistics(reviews, narrative=True)
+    print("\n[TEST] get_reviews_statistics with narrative:", stats)
+    assert (stats["total_reviews"], stats["rated_reviews"]) == (3, 2)
+    assert stats["similarity_weighted_average_rating"] == pytest.approx(4.6)
+    assert stats["date_span"]["days"] == 0
+    assert "Average rating" in stats["narrative"]
+    assert '"average_rating": 3.0' in agent_tools.llm.last_prompt
 
 
 def test_integration_workflow(agent_tools):
@@ -139,7 +303,78 @@ def test_integration_workflow(agent_tools):
     assert len(summary) > 50
 
     stats = agent_tools.get_reviews_statistics(reviews)
-    print(f"Step 4 - Stats: {stats[:100]}...")
-    assert "Average" in stats or "average" in stats.lower()
+    print(f"Step 4 - Stats: {stats}")
+    assert stats["total_reviews"] == len(reviews)
+    assert 1 <= stats["average_rating"] <= 5
 
     print("[TEST] Complete workflow successful!")
+
+
+def test_async_tools_match_sync_tools(agent_tools):
+    async def run():
+        return await asyncio.gather(
+            agent_tools.aextract_important_keywords("wireless mouse"),
+            agent_tools.aretrieve_useful_reviews(["mouse"], k=3, min_similarity=0.0),
+            agent_tools.asummarize_reviews([{"content": "Great mouse"}]),
+            agent_tools.aget_reviews_statistics([{"rating": 5}, {"rating": 3}], narrative=True)
+        )
+
+    keywords, reviews, summary, stats = asyncio.run(run())
+    print("\n[TEST] async tools:", keywords, len(reviews), stats)
+    assert keywords == agent_tools.extract_important_keywords("wireless mouse")
+    assert reviews == agent_tools.retrieve_useful_reviews(["mouse"], k=3, min_similarity=0.0)
+    assert "Summary" in summary
+    assert stats["average_rating"] == 4.0 and "narrative" in stats
+
+
+class IndexedStore:
+    def __init__(self):
+        from lexical import BM25Index
+        self.lexical_index = BM25Index()
+        self.lexical_index.add([str(i) for i in range(6)], [
+            "Great mouse, the sensor never skips",
+            "Mouse battery died after a week",
+            "Battery life of this mouse is great",
+            "Keyboard keys are loud",
+            "The mouse wheel squeaks",
+            "Headset latency is low",
+        ])
+
+
+def test_extract_important_keywords_fast_mode():
+    llm = DummyLLM()
+    tools = AgentTools(llm, DummyRetriever(), IndexedStore(), keyword_mode="fast", synonyms={"latency": ["lag", "stutter", "sensor"]})
+    keywords = tools.extract_important_keywords("Does the battery of this wireless mouse have latency issues?")
+    print("\n[TEST] fast keywords:", keywords)
+    assert llm.last_prompt is None
+    # "mouse" is in 4 of 6 reviews (over max_df), "wireless" and "issues" are unknown to the corpus
+    assert keywords == ["latency", "battery", "sensor"]
+
+
+def test_extract_important_keywords_auto_falls_back_to_llm():
+    llm = DummyLLM()
+    tools = AgentTools(llm, DummyRetriever(), IndexedStore(), keyword_mode="auto")
+    assert tools.extract_important_keywords("quiet keyboard") == ["keyboard"]
+    assert llm.last_prompt is None
+    keywords = tools.extract_important_keywords("something ergonomic for long sessions")
+    assert keywords == ["mouse", "wireless", "rgb", "battery", "dpi"] # nothing known to the corpus, the LLM answered
+
+
+def test_extract_important_keywords_auto_needs_confidence():
+    llm = DummyLLM()
+    tools = AgentTools(llm, DummyRetriever(), IndexedStore(), keyword_mode="auto")
+    assert tools.extract_important_keywords("what do people think about the keyboard keys") == ["keyboard", "keys"]
+    assert llm.last_prompt is None # request words such as "people" and "think" are not keywords
+    assert tools.extract_important_keywords("Show me reviews about something") == ["mouse", "wireless", "rgb", "battery", "dpi"]
+    llm.last_prompt = None
+    tools.extract_important_keywords("ergonomic quiet comfortable mouse") # one term in four known to the corpus
+    assert llm.last_prompt is not None
+
+
+def test_extract_important_keywords_fast_mode_without_store_is_an_error():
+    llm = DummyLLM()
+    tools = AgentTools(llm, DummyRetriever())
+    keywords = tools.extract_important_keywords("quiet keyboard", mode="fast")
+    print("\n[TEST] fast keywords without a store:", keywords)
+    assert "error" in keywords[0]
+    assert llm.last_prompt is None
@@ -0,0 +1,353 @@
+import pytest
+import sys
+import os
+
+# Add the parent directory to the path to import modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+import pandas as pd
+from vector import ReviewsVectorStore, _df_to_documents, _fingerprints, build_where
+
+CSV_HEADER = '"Title","Date","Rating","Review"\n'
+CSV_ROWS = [
+    '"Great mouse","2024-01-01","5","Very responsive and light."\n',
+    '"No Title","2024-01-02","3","Battery life is short."\n',
+    '"Loud fans","2024-01-03","2","The graphics card gets too hot."\n',
+]
+
+
+def write_csv(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(CSV_HEADER)
+        f.writelines(rows)
+
+
+@pytest.fixture(params=["chroma", "numpy"])
+def store(request, tmp_path):
+    csv_path = tmp_path / "reviews.csv"
+    db_path = tmp_path / "chroma_db"
+    db_path.mkdir()
+    write_csv(csv_path, CSV_ROWS)
+    return ReviewsVectorStore(
+        csv_file_path=str(csv_path),
+        db_location=str(db_path),
+        collection_name="test_reviews",
+        embeddings=DeterministicFakeEmbedding(size=16),
+        backend=request.param
+    )
+
+
+def test_fingerprints_are_stable():
+    df = pd.DataFrame({
+        "Title": ["Title", "Title", "Title"],
+        "Date": ["2024-01-01"] * 3,
+        "Rating": [4, 4.0, 5],
+        "Review": ["Text"] * 3
+    })
+    ids = _fingerprints(df).tolist()
+    assert ids[0] == ids[1]
+    assert ids[0] != ids[2]
+
+
+def test_df_to_documents_builds_content_and_metadata():
+    df = pd.DataFrame({
+        "Title": ["Great mouse", None, "Great mouse"],
+        "Date": ["2024-01-01", "2024-01-02", "2024-01-01"],
+        "Rating": [5, None, 5],
+        "Review": ["Very light.", "Battery is short.", "Very light."]
+    })
+    documents, ids = _df_to_documents(df)
+    assert len(documents) == len(ids) == 2 # the duplicated row is kept once
+    assert documents[0].page_content == "Great mouse - Very light."
+    assert documents[1].page_content == "Battery is short."
+    assert documents[1].metadata == {"rating": None, "date": "2024-01-02", "date_ts": 20240102, "title": "No Title"}
+
+
+def test_sync_database_initial_load(store):
+    report = store.sync_database()
+    print("\n[TEST] initial sync report:", report)
+    assert report == {"added": 3, "deleted": 0, "unchanged": 0, "total": 3}
+    assert store.get_number_of_vectors() == 3
+
+
+def test_sync_database_applies_only_the_delta(store):
+    store.sync_database()
+
+    # row 0 removed, row 1 edited, one new row appended
+    write_csv(store.csv_file_path, [
+        '"No Title","2024-01-02","3","Battery life is short, but it charges fast."\n',
+        CSV_ROWS[2],
+        '"Solid keyboard","2024-02-01","4","Tactile switches and bright RGB."\n',
+    ])
+    report = store.sync_database()
+    print("\n[TEST] delta sync report:", report)
+    assert report == {"added": 2, "deleted": 2, "unchanged": 1, "total": 3}
+    assert store.get_number_of_vectors() == 3
+
+    assert store.sync_database()["added"] == 0
+
+
+def test_rebuild_with_duplicates_in_different_csv_chunks(store):
+    # the duplicated row is in another csv chunk but in the same embedding batch
+    write_csv(store.csv_file_path, CSV_ROWS + [CSV_ROWS[0]])
+    store.csv_chunk_size = 2
+    store.init_database(auto_recreate=True)
+    assert store.get_number_of_vectors() == 3
+    assert store.aggregates.documents == 3
+
+
+def test_rebuild_with_duplicates_in_different_batches(store):
+    # only the current batch is de-duplicated: the row repeated in a later batch is upserted again
+    write_csv(store.csv_file_path, CSV_ROWS + [CSV_ROWS[0]])
+    store.batch_size = 2
+    store.init_database(auto_recreate=True)
+    assert store.get_number_of_vectors() == 3
+    assert store.aggregates.documents == 3
+    assert store.lexical_index.size == 3
+
+
+class FlakyEmbeddings(DeterministicFakeEmbedding):
+    fail_after: int = -1
+    calls: int = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if 0 <= self.fail_after < self.calls:
+            raise RuntimeError("embedding server went away")
+        return super().embed_documents(texts)
+
+
+def test_ingestion_resumes_from_last_batch(store):
+    store.batch_size = 1
+    store.max_in_flight = 1
+    store.embeddings = FlakyEmbeddings(size=16, fail_after=2)
+    with pytest.raises(RuntimeError):
+        store.init_database(auto_recreate=True)
+    assert store.get_number_of_vectors() == 2
+
+    store.embeddings = FlakyEmbeddings(size=16)
+    store.init_database(auto_recreate=True)
+    print("\n[TEST] embedding calls after resume:", store.embeddings.calls)
+    assert store.embeddings.calls == 1
+    assert store.get_number_of_vectors() == 3
+    assert not os.path.exists(store._checkpoint_path())
+
+
+def test_get_stats(store):
+    empty = store.get_stats()
+    assert empty["count"] == 0
+    assert empty["embedding_dimension"] is None
+
+    store.sync_database()
+    stats = store.get_stats()
+    print("\n[TEST] collection stats:", stats)
+    assert stats["count"] == 3
+    assert stats["embedding_dimension"] == 16
+    assert stats["metadata_summary"]["rating"] == {"min": 2.0, "max": 5.0, "mean": 3.333}
+    assert stats["metadata_summary"]["date"] == {"min": "2024-01-01", "max": "2024-01-03"}
+
+
+def test_search_by_vector_returns_closest_first(store):
+    store.sync_database()
+    query = store.embeddings.embed_query("Loud fans - The graphics card gets too hot.")
+    results = store.backend.search_by_vector(query, k=2)
+    print("\n[TEST] search results:", [(doc.metadata["title"], score) for doc, score in results])
+    assert len(results) == 2
+    assert results[0][0].metadata["title"] == "Loud fans"
+    assert results[0][1] == pytest.approx(0.0, abs=1e-5)
+    assert results[0][1] <= results[1][1]
+
+
+def test_backends_report_the_same_cosine_distances(tmp_path):
+    write_csv(tmp_path / "reviews.csv", CSV_ROWS)
+    distances = {}
+    for backend in ["chroma", "numpy"]:
+        (tmp_path / backend).mkdir()
+        store = ReviewsVectorStore(csv_file_path=str(tmp_path / "reviews.csv"), db_location=str(tmp_path / backend), collection_name="test_reviews",
+                                   embeddings=DeterministicFakeEmbedding(size=16), backend=backend)
+        store.sync_database()
+        assert store.get_stats()["distance"] == "cosine"
+        query = store.embeddings.embed_query("Great mouse - Very responsive and light.")
+        hits = store.backend.search_by_vector(query, k=3)
+        distances[backend] = {doc.metadata["title"]: distance for doc, distance in hits}
+        assert store.backend.score_ids(query, [hits[-1][0].id])[0][1] == pytest.approx(hits[-1][1], abs=1e-5)
+    print("\n[TEST] distances per backend:", distances)
+    assert distances["chroma"].keys() == distances["numpy"].keys()
+    for title, distance in distances["numpy"].items():
+        assert distances["chroma"][title] == pytest.approx(distance, abs=1e-4)
+
+
+def test_hybrid_search_promotes_exact_terms(store):
+    store.sync_database()
+    results = store.hybrid_search("gpu temperature", k=1, keywords=["graphics"])
+    print("\n[TEST] hybrid results:", [(doc.metadata["title"], distance, score) for doc, distance, score in results])
+    assert results[0][0].metadata["title"] == "Loud fans"
+
+
+def test_lexical_index_follows_sync(store):
+    store.sync_database()
+    assert store.lexical_index.size == 3
+    write_csv(store.csv_file_path, CSV_ROWS[:1])
+    store.sync_database()
+    assert store.lexical_index.size == 1
+    assert store.lexical_index.search(["graphics"]) == []
+
+
+def test_build_where():
+    assert build_where({}) is None
+    assert build_where({"max_rating": 2}) == {"rating": {"$lte": 2.0}}
+    assert build_where({"min_rating": 1, "date_from": "2023", "date_to": "2023-06"}) == {"$and": [
+        {"rating": {"$gte": 1.0}},
+        {"date_ts": {"$gte": 20230101}},
+        {"date_ts": {"$lte": 20230631}}
+    ]}
+    for date in ["2023-13", "2023-02-40", "2023-00-10", "May 2023", "2023-05-17-1"]:
+        with pytest.raises(ValueError, match="Invalid date"):
+            build_where({"date_from": date})
+
+
+def test_filtered_search_returns_only_matching_reviews(store):
+    store.sync_database()
+    results = store.similarity_search("mouse", k=2, filters={"max_rating": 3, "date_from": "2024-01-02"})
+    print("\n[TEST] filtered results:", [doc.metadata for doc, _ in results])
+    assert sorted(doc.metadata["title"] for doc, _ in results) == ["Loud fans", "No Title"]
+
+    results = store.hybrid_search("mouse", k=2, keywords=["mouse"], filters={"min_rating": 5})
+    assert [doc.metadata["title"] for doc, _, _ in results] == ["Great mouse"]
+
+
+def test_batch_search_matches_single_queries(store):
+    store.sync_database()
+    queries = ["battery", "graphics card", "mouse"]
+    batch = store.similarity_search_batch(queries, k=2)
+    print("\n[TEST] batch results:", [[doc.metadata["title"] for doc, _ in results] for results in batch])
+    for query, results in zip(queries, batch):
+        single = store.backend.search_by_vector(store.embeddings.embed_query(query), 2)
+        assert [doc.id for doc, _ in results] == [doc.id for doc, _ in single]
+        assert [d for _, d in results] == pytest.approx([d for _, d in single], abs=1e-4)
+
+    hybrid = store.hybrid_search_batch(queries, k=2, keywords=[["battery"], None, ["mouse"]], filters={"min_rating": 3})
+    assert [doc.id for doc, _, _ in hybrid[0]] == [doc.id for doc, _, _ in store.hybrid_search("battery", k=2, keywords=["battery"], filters={"min_rating": 3})]
+    assert all(doc.metadata["rating"] >= 3 for results in hybrid for doc, _, _ in results)
+
+
+def test_query_cache_skips_embedding_and_is_invalidated_on_writes(store):
+    store.sync_database()
+    calls = []
+    embed_documents = store.embeddings.embed_documents
+    store.embeddings.embed_documents = lambda texts: calls.append(list(texts)) or embed_documents(texts)
+
+    first = store.hybrid_search("battery", k=2, keywords=["battery"])
+    second = store.hybrid_search("battery", k=2, keywords=["battery"])
+    store.similarity_search("battery", k=2)
+    print("\n[TEST] query cache stats:", store.get_query_cache_stats())
+    assert calls == [["battery"]] # embedded once, the other searches reuse the vector
+    assert [doc.id for doc, _, _ in first] == [doc.id for doc, _, _ in second]
+    assert store.get_query_cache_stats()["results"]["hits"] == 1
+
+    write_csv(store.csv_file_path, CSV_ROWS[:1] + ['"Battery pack","2024-02-01","4","Battery lasts a week."\n'])
+    store.sync_database()
+    titles = [doc.metadata["title"] for doc, _, _ in store.hybrid_search("battery", k=2, keywords=["battery"])]
+    assert "Battery pack" in titles and "No Title" not in titles
+
+
+def test_aggregates_follow_ingestion_and_sync(store):
+    store.sync_database()
+    monthly = store.get_aggregates("month")
+    print("\n[TEST] monthly aggregates:", monthly)
+    assert monthly["groups"] == [{"month": "2024-01", "count": 3, "rated": 3, "average_rating": 3.333,
+                                  "histogram": {"1": 0, "2": 1, "3": 1, "4": 0, "5": 1}}]
+    assert [g["keyword"] for g in store.get_aggregates("keyword")["groups"]] == ["fans", "great", "loud", "mouse"]
+
+    write_csv(store.csv_file_path, CSV_ROWS[1:] + ['"Wireless mouse","2023-05-10","4","Good battery."\n'])
+    store.sync_database()
+    yearly = store.get_aggregates("year", keyword="mouse")
+    assert [(g["year"], g["count"], g["average_rating"]) for g in yearly["groups"]] == [("2023", 1, 4.0)]
+    assert store.get_aggregates("year")["overall"]["count"] == 3
+
+    reopened = ReviewsVectorStore(csv_file_path=store.csv_file_path, db_location=store.db_location, collection_name="test_reviews",
+                                  embeddings=DeterministicFakeEmbedding(size=16), backend=store.backend.name)
+    assert reopened.get_aggregates("year") == store.get_aggregates("year")
+    reopened.aggregates.clear()
+    reopened.init_database() # out of date tables are rebuilt from the collection at startup
+    assert reopened.get_aggregates("year") == store.get_aggregates("year")
+
+
+def test_numpy_store_upsert_with_duplicate_ids(tmp_path):
+    from langchain_core.documents import Document
+    from numpy_store import NumpyVectorStore
+
+    embeddings = DeterministicFakeEmbedding(size=16)
+    numpy_store = NumpyVectorStore(str(tmp_path / "numpy"), embeddings)
+    documents = [Document(page_content=text) for text in ["old text", "other text", "new text"]]
+    numpy_store.upsert_embeddings(["a", "b", "a"], embeddings.embed_documents([d.page_content for d in documents]), documents)
+    assert numpy_store.count() == 2
+    results = numpy_store.similarity_search_by_vector_with_score(embeddings.embed_query("new text"), k=5)
+    print("\n[TEST] results after a batch with a duplicate id:", [(doc.id, doc.page_content) for doc, _ in results])
+    assert sorted(doc.id for doc, _ in results) == ["a", "b"]
+    assert numpy_store.get_by_ids(["a"])[0].page_content == "new text" # the last one wins
+    assert NumpyVectorStore(str(tmp_path / "numpy"), embeddings).count() == 2
+
+
+def test_numpy_store_recovers_from_a_crash_between_vector_and_record_writes(tmp_path):
+    from langchain_core.documents import Document
+    from numpy_store import NumpyVectorStore
+
+    embeddings = DeterministicFakeEmbedding(size=16)
+    path = str(tmp_path / "numpy")
+    numpy_store = NumpyVectorStore(path, embeddings)
+    documents = [Document(page_content=text) for text in ["first text", "second text"]]
+    numpy_store.upsert_embeddings(["a", "b"], embeddings.embed_documents([d.page_content for d in documents]), documents)
+    numpy_store._matrix = None # release the memory map, as a dead process would
+    with open(os.path.join(path, "vectors.f32"), "ab") as f: # vectors of a batch whose records were never written
+        f.write(bytes(16 * 4 * 3))
+    with open(os.path.join(path, "records.jsonl"), "a", encoding="utf-8") as f:
+        f.write('{"id": "c", "content": "half writ')
+
+    reopened = NumpyVectorStore(path, embeddings)
+    assert reopened.count() == 2
+    assert os.path.getsize(os.path.join(path, "vectors.f32")) == 2 * 16 * 4
+    document = Document(page_content="third text")
+    reopened.upsert_embeddings(["c"], embeddings.embed_documents([document.page_content]), [document])
+    reopened = NumpyVectorStore(path, embeddings)
+    for doc_id, text in [("a", "first text"), ("b", "second text"), ("c", "third text")]:
+        results = reopened.similarity_search_by_vector_with_score(embeddings.embed_query(text), k=1)
+        assert results[0][0].id == doc_id # every id still points to its own vector
+        assert results[0][1] == pytest.approx(0, abs=1e-5)
+
+
+def test_sync_from_another_process_is_picked_up(store):
+    import subprocess
+    store.sync_database()
+    before = store.hybrid_search("battery", k=3, keywords=["battery"]) # cached
+    assert "No Title" in [doc.metadata["title"] for doc, _, _ in before]
+    generation = store.generation
+    retriever = store.get_retriever(k=3)
+    import chromadb
+    unrelated = chromadb.PersistentClient(path=store.db_location + "_other").get_or_create_collection("other_reviews")
+    unrelated.upsert(ids=["x"], embeddings=[[1.0] * 16], documents=["another client of the process"])
+
+    # e.g. `python vector.py --sync` from cron while the server keeps running
+    write_csv(store.csv_file_path, CSV_ROWS[:1] + ['"Battery pack","2024-02-01","4","Battery lasts a week."\n'])
+    script = (
+        "import sys; sys.path.insert(0, sys.argv[1])\n"
+        "from langchain_core.embeddings import DeterministicFakeEmbedding\n"
+        "from vector import ReviewsVectorStore\n"
+        "ReviewsVectorStore(csv_file_path=sys.argv[2], db_location=sys.argv[3], collection_name='test_reviews',\n"
+        "                   embeddings=DeterministicFakeEmbedding(size=16), backend=sys.argv[4]).sync_database()\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", script, root, store.csv_file_path, store.db_location, store.backend.name], check=True)
+
+    after = store.hybrid_search("battery", k=3, keywords=["battery"])
+    titles = [doc.metadata["title"] for doc, _, _ in after]
+    print("\n[TEST] titles after the external sync:", titles)
+    assert store.generation > generation
+    assert "Battery pack" in titles and "No Title" not in titles
+    assert "pack" in store.lexical_index.postings
+    assert store.get_aggregates("month")["overall"]["count"] == 2
+    assert store.get_number_of_vectors() == 2
+    assert not store.refresh() # nothing changed since
+    assert "Battery pack" in [doc.metadata["title"] for doc in retriever.invoke("battery")] # the retriever follows the reload
+    assert unrelated.query(query_embeddings=[[1.0] * 16], n_results=1)["ids"] == [["x"]] # other chroma clients are left alone
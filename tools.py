@@ -1,11 +1,96 @@
-from typing import List, Dict, Any
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+import numpy as np
+import pandas as pd
 from langchain_core.retrievers import BaseRetriever
 from langchain_ollama import OllamaLLM
+from keywords import KeywordExtractor
+from prompt_packing import pack_lines, pack_reviews, truncate_to_budget
+from scheduler import LLMLimiter
+
+RETRIEVAL_MODES = ["dense", "hybrid"]
+# llm: the LLM extracts the keywords; fast: corpus TF-IDF only; auto: fast, with the LLM for long or ambiguous queries
+KEYWORD_MODES = ["llm", "fast", "auto"]
+SUMMARY_ERROR = "Summarization failed: " # the summary tools return their error as text, starting with this
+# smallest summary_budget: two partial summaries cut to half of it must fit in one merge prompt, or the reduce rounds never end
+MIN_SUMMARY_BUDGET = 64
+
+def tool_error(result: Any) -> Optional[str]:
+    """The error carried by a tool result, None if the tool succeeded. The tools do not raise: they return
+        {"error": ...}, a list starting with {"error": ...} (one such list per keyword set for the batch retrieval)
+        or, for the summaries, a text starting with SUMMARY_ERROR.
+    """
+    if isinstance(result, dict):
+        return result.get("error")
+    if isinstance(result, list) and result and isinstance(result[0], dict):
+        return result[0].get("error")
+    if isinstance(result, list) and result and isinstance(result[0], list):
+        return tool_error(result[0])
+    if isinstance(result, str) and result.startswith(SUMMARY_ERROR):
+        return result
+    return None
+
+def compute_review_statistics(reviews: list) -> Dict[str, Any]:
+    """Rating and date statistics of a list of reviews (the dicts returned by retrieve_useful_reviews), computed without the LLM.
+        Positive reviews are rated 4-5, negative 1-2, neutral in between; reviews without a rating only count in total_reviews.
+    """
+    reviews = [r for r in reviews if isinstance(r, dict) and "error" not in r]
+    ratings = pd.to_numeric(pd.Series([r.get("rating") for r in reviews], dtype=object), errors="coerce")
+    similarities = pd.to_numeric(pd.Series([r.get("similarity") for r in reviews], dtype=object), errors="coerce")
+    dates = pd.to_datetime(pd.Series([r.get("date") for r in reviews], dtype=object), errors="coerce", format="%Y-%m-%d")
+
+    rated = ratings.notna().to_numpy()
+    values = ratings[rated].to_numpy(dtype=float)
+    stats: Dict[str, Any] = {"total_reviews": len(reviews), "rated_reviews": int(rated.sum())}
+    if len(values):
+        p25, median, p75, p90 = np.percentile(values, [25, 50, 75, 90])
+        bins = np.clip(np.floor(values + 0.5), 1, 5).astype(int) # half stars round up
+        stats.update({
+            "average_rating": round(float(values.mean()), 3),
+            "median_rating": float(median),
+            "min_rating": float(values.min()),
+            "max_rating": float(values.max()),
+            "std_rating": round(float(values.std()), 3),
+            "percentiles": {"p25": float(p25), "p75": float(p75), "p90": float(p90)},
+            "histogram": {str(star): int(count) for star, count in zip(range(1, 6), np.bincount(bins, minlength=6)[1:])},
+            "positive": int((values >= 4).sum()),
+            "neutral": int(((values > 2) & (values < 4)).sum()),
+            "negative": int((values <= 2).sum())
+        })
+        # the reviews closest to the query weigh more
+        weights = similarities[rated].clip(lower=0).to_numpy(dtype=float)
+        usable = ~np.isnan(weights)
+        if usable.any() and weights[usable].sum() > 0:
+            stats["similarity_weighted_average_rating"] = round(float(np.average(values[usable], weights=weights[usable])), 3)
+    valid_dates = dates.dropna()
+    if len(valid_dates):
+        first, last = valid_dates.min(), valid_dates.max()
+        stats["date_span"] = {"first": first.strftime("%Y-%m-%d"), "last": last.strftime("%Y-%m-%d"), "days": int((last - first).days)}
+    return stats
 
 class AgentTools:
-    def __init__(self, llm: OllamaLLM, retriever: BaseRetriever):
+    def __init__(self, llm: OllamaLLM, retriever: BaseRetriever, store=None, retrieval_mode: str = "dense", response_cache=None,
+                 keyword_mode: str = "llm", synonyms: Optional[Dict[str, List[str]]] = None, summary_budget: int = 1500,
+                 summary_concurrency: int = 4, llm_limiter: Optional[LLMLimiter] = None):
         self.llm = llm
         self.retriever = retriever
+        self.store = store # ReviewsVectorStore, needed by the retrieval modes that go beyond the langchain retriever
+        self.retrieval_mode = retrieval_mode
+        self.response_cache = response_cache # LLMResponseCache, repeated prompts are answered without calling the LLM
+        self.keyword_mode = keyword_mode
+        # the IDF weights come from the BM25 index built at ingestion, so the fast modes need the store
+        index = getattr(store, "lexical_index", None)
+        self.keyword_extractor = KeywordExtractor(index, synonyms) if index is not None else None
+        # estimated tokens of reviews per summary prompt: more reviews are summarized in batches (map) and the partial summaries merged (reduce),
+        # so the prompt stays inside the model context whatever k is
+        if summary_budget < MIN_SUMMARY_BUDGET:
+            raise ValueError(f"summary_budget must be at least {MIN_SUMMARY_BUDGET} tokens, got {summary_budget}")
+        self.summary_budget = summary_budget
+        self.summary_concurrency = summary_concurrency # batches summarized at the same time
+        # cap on the generations running at the same time, shared with the other AgentTools of the process (cache hits do not take a slot)
+        self.llm_limiter = llm_limiter if llm_limiter is not None else LLMLimiter()
 
         self.prompt_keywords = (
             "The text below is a user query. Extract only the key terms needed to retrieve related reviews via RAG. "
@@ -22,71 +107,320 @@ class AgentTools:
             "- Recurring themes\n"
             "- Overall sentiment\n"
             "- Key recommendations\n\n"
-            "Reviews: {reviews}\n\n"
+            "Reviews (one per line, [rating date] title: text):\n{reviews}\n\n"
+            "Provide a concise summary in 2-3 paragraphs."
+        )
+        self.prompt_partial_summary = (
+            "The following reviews are one batch of a larger set. Summarize them in one short paragraph, keeping:\n"
+            "- Main pros and cons\n"
+            "- Recurring themes and how often they come up\n"
+            "- Overall sentiment\n\n"
+            "Reviews (one per line, [rating date] title: text):\n{reviews}\n\n"
+            "Reply concisely, without introduction."
+        )
+        self.prompt_merge_summaries = (
+            "Each line below summarizes a different batch of reviews of the same products. Merge them into a single summary. Focus on:\n"
+            "- Main pros and cons\n"
+            "- Recurring themes (across batches)\n"
+            "- Overall sentiment\n"
+            "- Key recommendations\n\n"
+            "Partial summaries:\n{summaries}\n\n"
             "Provide a concise summary in 2-3 paragraphs."
         )
         self.prompt_stats = (
-            "Analyze the following reviews and compute:\n"
-            "- Average rating\n"
-            "- Rating range\n"
-            "- Total number of reviews\n"
-            "- How many are positive (4-5) and how many are negative (1-2)\n\n"
-            "Reviews: {reviews}\n\n"
+            "Analyze the following statistics of a set of product reviews (ratings from 1 to 5, "
+            "positive is 4-5, negative is 1-2) and describe them in 2-3 sentences.\n"
+            "Do not recompute or change any number.\n\n"
+            "Statistics: {statistics}\n\n"
             "Reply concisely."
         )
 
-    def extract_important_keywords(self, user_query: str) -> List[str]:
-        prompt = self.prompt_keywords.format(user_query=user_query)
+    def extract_important_keywords(self, user_query: str, mode: Optional[str] = None) -> List[str]:
         try:
-            response = self.llm.invoke(prompt)
-            keywords = [k.strip() for k in response.split(',') if k.strip()]
-            return keywords[:5]
+            keywords = self._fast_keywords(user_query, mode or self.keyword_mode)
+            if keywords is not None:
+                return keywords
+            prompt = self.prompt_keywords.format(user_query=user_query)
+            response = self._invoke(self.prompt_keywords, self._normalize_query(user_query), prompt)
+            return self._parse_keywords(response)
         except Exception as e:
             return [{"error": f"Extraction failed: {str(e)}"}]
 
-    def retrieve_useful_reviews(self, keywords: List[str], k: int = 5, min_similarity: float = 0.15) -> List[Dict[str, Any]]:
+    def _fast_keywords(self, user_query: str, mode: str) -> Optional[List[str]]:
+        # None means the LLM has to extract the keywords
+        if mode not in KEYWORD_MODES:
+            raise ValueError(f"Unknown keyword mode: {mode} (available: {KEYWORD_MODES})")
+        if mode == "llm":
+            return None
+        if self.keyword_extractor is None:
+            if mode == "fast": # asked not to use the LLM, so it is not silently used instead
+                raise ValueError("Fast keyword extraction needs the vector store (its BM25 index)")
+            return None
+        keywords = self.keyword_extractor.extract(user_query)
+        if keywords is None and mode == "fast": # no LLM at all: the query terms themselves, without stopwords
+            keywords = list(dict.fromkeys(self.keyword_extractor.query_terms(user_query)))[:self.keyword_extractor.max_keywords]
+        return keywords
+
+    def _generate(self, prompt: str) -> str:
+        with self.llm_limiter.sync_slot():
+            return self.llm.invoke(prompt)
+
+    async def _agenerate(self, prompt: str) -> str:
+        async with self.llm_limiter.slot():
+            return await self.llm.ainvoke(prompt)
+
+    def _invoke(self, template: str, normalized_input: str, prompt: str) -> str:
+        if self.response_cache is None:
+            return self._generate(prompt)
+        key = self.response_cache.key(template, normalized_input)
+        response = self.response_cache.get(key)
+        if response is None:
+            response = self._generate(prompt)
+            self.response_cache.put(key, response) # only reached when the call succeeded, failures are never cached
+        return response
+
+    async def _ainvoke(self, template: str, normalized_input: str, prompt: str) -> str:
+        if self.response_cache is None:
+            return await self._agenerate(prompt)
+        key = self.response_cache.key(template, normalized_input)
+        response = await asyncio.to_thread(self.response_cache.get, key) # may read the sqlite store
+        if response is None:
+            response = await self._agenerate(prompt)
+            await asyncio.to_thread(self.response_cache.put, key, response)
+        return response
+
+    async def _astream(self, template: str, normalized_input: str, prompt: str, on_token) -> str:
+        # same as _ainvoke, but every generated chunk is passed to on_token as soon as it arrives (a cached answer in one go)
+        key = self.response_cache.key(template, normalized_input) if self.response_cache is not None else None
+        response = await asyncio.to_thread(self.response_cache.get, key) if key else None
+        if response is not None:
+            await on_token(response)
+            return response
+        chunks = []
+        async with self.llm_limiter.slot():
+            async for chunk in self.llm.astream(prompt):
+                chunks.append(chunk)
+                await on_token(chunk)
+        response = "".join(chunks)
+        if key:
+            await asyncio.to_thread(self.response_cache.put, key, response)
+        return response
+
+    @staticmethod
+    def _normalize_query(user_query: str) -> str:
+        return " ".join(str(user_query).split()).lower()
+
+    @staticmethod
+    def _parse_keywords(response: str) -> List[str]:
+        keywords = [k.strip() for k in response.split(',') if k.strip()]
+        return keywords[:5]
+
+    def retrieve_useful_reviews(self, keywords: List[str], k: int = 5, min_similarity: float = 0.15, mode: Optional[str] = None,
+                                min_rating: Optional[float] = None, max_rating: Optional[float] = None,
+                                date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict[str, Any]]:
+        # rating and date filters are applied by the vector store during the search: k matching reviews are returned
+        # whenever at least k reviews match, with no over-fetching and client-side filtering
         try:
-            search_query = " ".join(keywords) if isinstance(keywords, list) else str(keywords)
-            docs_with_scores = self.retriever.vectorstore.similarity_search_with_score(search_query, k=k)
-            results = []
-            for doc, score in docs_with_scores:
-                similarity = 1 - score  # distance is converted (score is - cosine_similarity = (A · B) / (||A|| * ||B||)
-
-                # only the most similar documents are returned
-                if similarity >= min_similarity:
-                    results.append({
-                        "content": doc.page_content,
-                        "rating": doc.metadata.get("rating"),
-                        "date": doc.metadata.get("date"),
-                        "title": doc.metadata.get("title"),
-                        "similarity": similarity
-                    })
-            return results
+            filters = self._filters(min_rating, max_rating, date_from, date_to)
+            docs_with_scores = self._search(keywords, k, mode or self.retrieval_mode, filters)
+            return self._to_reviews(docs_with_scores, min_similarity)
         except Exception as e:
             return [{"error": f"Retrieval failed: {str(e)}"}]
 
+    def retrieve_useful_reviews_batch(self, keyword_sets: List[List[str]], k: int = 5, min_similarity: float = 0.15, mode: Optional[str] = None,
+                                      min_rating: Optional[float] = None, max_rating: Optional[float] = None,
+                                      date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[List[Dict[str, Any]]]:
+        # same as retrieve_useful_reviews for N keyword sets, but the N queries are embedded with one call
+        # and searched with one batched query; results[i] belongs to keyword_sets[i], also on failure: then every
+        # results[i] is [{"error": ...}], the error of a single retrieval
+        try:
+            filters = self._filters(min_rating, max_rating, date_from, date_to)
+            mode = mode or self.retrieval_mode
+            if self.store is None: # the langchain retriever has no batched search, queries run one by one
+                return [self._to_reviews(self._search(keywords, k, mode, filters), min_similarity) for keywords in keyword_sets]
+            return [self._to_reviews(docs_with_scores, min_similarity) for docs_with_scores in self._search_batch(keyword_sets, k, mode, filters)]
+        except Exception as e:
+            return [[{"error": f"Retrieval failed: {str(e)}"}] for _ in keyword_sets]
+
+    @staticmethod
+    def _filters(min_rating, max_rating, date_from, date_to) -> Dict[str, Any]:
+        filters = {"min_rating": min_rating, "max_rating": max_rating, "date_from": date_from, "date_to": date_to}
+        return {key: value for key, value in filters.items() if value is not None}
+
+    @staticmethod
+    def _query_and_keywords(keywords):
+        # the same keyword set, in any order and case, always gives the same query text, so repeated searches hit the store query caches
+        keyword_list = keywords if isinstance(keywords, list) else str(keywords).split(",")
+        keyword_list = sorted({" ".join(str(k).split()).lower() for k in keyword_list if str(k).strip()})
+        return " ".join(keyword_list), keyword_list
+
+    def _search(self, keywords, k: int, mode: str, filters: Dict[str, Any]) -> list:
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode} (available: {RETRIEVAL_MODES})")
+        search_query, keyword_list = self._query_and_keywords(keywords)
+        if (mode == "hybrid" or filters) and self.store is None:
+            raise ValueError("Hybrid and filtered retrieval need the vector store")
+        if mode == "hybrid":
+            # exact keyword matches (BM25) fused with the dense ranking, see ReviewsVectorStore.hybrid_search
+            return [(doc, score) for doc, score, _ in self.store.hybrid_search(search_query, k=k, keywords=keyword_list, filters=filters)]
+        if self.store is not None: # cached query vectors and results, see ReviewsVectorStore.similarity_search
+            return self.store.similarity_search(search_query, k=k, filters=filters)
+        return self.retriever.vectorstore.similarity_search_with_score(search_query, k=k)
+
+    def _search_batch(self, keyword_sets: List[List[str]], k: int, mode: str, filters: Dict[str, Any]) -> List[list]:
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode} (available: {RETRIEVAL_MODES})")
+        queries, keyword_lists = [], []
+        for keywords in keyword_sets:
+            search_query, keyword_list = self._query_and_keywords(keywords)
+            queries.append(search_query)
+            keyword_lists.append(keyword_list)
+        if mode == "hybrid":
+            batch = self.store.hybrid_search_batch(queries, k=k, keywords=keyword_lists, filters=filters)
+            return [[(doc, score) for doc, score, _ in results] for results in batch]
+        return self.store.similarity_search_batch(queries, k=k, filters=filters)
+
+    @staticmethod
+    def _to_reviews(docs_with_scores: list, min_similarity: float) -> List[Dict[str, Any]]:
+        results = []
+        for doc, score in docs_with_scores:
+            similarity = 1 - score  # distance is converted (score is - cosine_similarity = (A · B) / (||A|| * ||B||)
+
+            # only the most similar documents are returned
+            if similarity >= min_similarity:
+                results.append({
+                    "content": doc.page_content,
+                    "rating": doc.metadata.get("rating"),
+                    "date": doc.metadata.get("date"),
+                    "title": doc.metadata.get("title"),
+                    "similarity": similarity
+                })
+        return results
+
+    def get_reviews_aggregates(self, group_by: str = "year", keyword: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+        # corpus-wide numbers from the tables precomputed at ingestion time: no keyword extraction, retrieval or LLM call
+        try:
+            if self.store is None:
+                raise ValueError("Aggregates need the vector store")
+            return self.store.get_aggregates(group_by, keyword, limit)
+        except Exception as e:
+            return {"error": f"Aggregates failed: {str(e)}"}
+
+    def get_cluster_summaries(self, user_query: str, n: int = 3) -> Dict[str, Any]:
+        # precomputed summaries of the clusters closest to the query: one embedding, no retrieval and no LLM call
+        try:
+            if self.store is not None:
+                self.store.refresh() # the summaries may have been rebuilt by clusters.py since
+            clusters = getattr(self.store, "clusters", None)
+            if clusters is None or not len(clusters):
+                raise ValueError("No cluster summaries, build them with: python clusters.py")
+            return {
+                "query": user_query,
+                "clusters": clusters.nearest(self.store.embed_query(user_query), n),
+                "built": clusters.built,
+                "stale": clusters.documents != self.store.backend.count() # the collection changed since they were built
+            }
+        except Exception as e:
+            return {"error": f"Cluster summaries failed: {str(e)}"}
+
     def summarize_reviews(self, reviews: list) -> str:
         try:
-            prompt = self.prompt_summary.format(reviews=reviews)
-            response = self.llm.invoke(prompt)
-            return response
+            blocks = pack_reviews(reviews, self.summary_budget)
+            if len(blocks) == 1:
+                return self._invoke(self.prompt_summary, blocks[0], self.prompt_summary.format(reviews=blocks[0]))
+            with ThreadPoolExecutor(max_workers=max(1, self.summary_concurrency)) as executor:
+                partials = list(executor.map(lambda block: self._invoke(self.prompt_partial_summary, block, self.prompt_partial_summary.format(reviews=block)), blocks))
+                while True:
+                    blocks = self._pack_summaries(partials)
+                    if len(blocks) == 1:
+                        return self._invoke(self.prompt_merge_summaries, blocks[0], self.prompt_merge_summaries.format(summaries=blocks[0]))
+                    partials = list(executor.map(lambda block: self._invoke(self.prompt_merge_summaries, block, self.prompt_merge_summaries.format(summaries=block)), blocks))
         except Exception as e:
-            return f"Summarization failed: {str(e)}"
+            return f"{SUMMARY_ERROR}{str(e)}"
+
+    def _pack_summaries(self, partials: List[str]) -> List[str]:
+        # at least two summaries fit in a block, so every reduce round at least halves them
+        lines = ["- " + truncate_to_budget(" ".join(str(p).split()), self.summary_budget // 2 - 2) for p in partials]
+        return pack_lines(lines, self.summary_budget)
 
-    def get_reviews_statistics(self, reviews: list) -> str:
+    def get_reviews_statistics(self, reviews: list, narrative: bool = False) -> Dict[str, Any]:
+        # the numbers are computed directly (see compute_review_statistics); the LLM is only called for the optional prose description
         try:
-            ratings = []
-            total_reviews = 0
-            for review in reviews:
-                total_reviews += 1
-                if isinstance(review, dict) and review.get("rating"):
-                    try:
-                        ratings.append(float(review["rating"]))
-                    except Exception:
-                        pass
-
-            prompt = self.prompt_stats.format(reviews=reviews)
-            response = self.llm.invoke(prompt)
-            return response
+            statistics = compute_review_statistics(reviews)
+            if narrative:
+                statistics_json = json.dumps(statistics)
+                statistics["narrative"] = self._invoke(self.prompt_stats, statistics_json, self.prompt_stats.format(statistics=statistics_json))
+            return statistics
+        except Exception as e:
+            return {"error": f"Statistics calculation failed: {str(e)}"}
+
+    # async counterparts, awaited by the MCP server so that a long LLM call or search never blocks its event loop:
+    # LLM calls use the native async invocation, vector searches run in the default thread pool
+
+    async def aextract_important_keywords(self, user_query: str, mode: Optional[str] = None) -> List[str]:
+        try:
+            keywords = self._fast_keywords(user_query, mode or self.keyword_mode) # microseconds, no need to leave the event loop
+            if keywords is not None:
+                return keywords
+            prompt = self.prompt_keywords.format(user_query=user_query)
+            response = await self._ainvoke(self.prompt_keywords, self._normalize_query(user_query), prompt)
+            return self._parse_keywords(response)
+        except Exception as e:
+            return [{"error": f"Extraction failed: {str(e)}"}]
+
+    async def aretrieve_useful_reviews(self, keywords: List[str], k: int = 5, min_similarity: float = 0.15, **kwargs) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.retrieve_useful_reviews, keywords, k, min_similarity, **kwargs)
+
+    async def aretrieve_useful_reviews_batch(self, keyword_sets: List[List[str]], k: int = 5, min_similarity: float = 0.15, **kwargs) -> List[List[Dict[str, Any]]]:
+        return await asyncio.to_thread(self.retrieve_useful_reviews_batch, keyword_sets, k, min_similarity, **kwargs)
+
+    async def aget_reviews_aggregates(self, group_by: str = "year", keyword: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.get_reviews_aggregates, group_by, keyword, limit)
+
+    async def aget_cluster_summaries(self, user_query: str, n: int = 3) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.get_cluster_summaries, user_query, n)
+
+    async def asummarize_reviews(self, reviews: list, on_token=None, on_step=None) -> str:
+        # on_token (async callable) receives the summary while it is generated, the full text is returned at the end
+        # (with many reviews only the final merge is streamed, the batches are summarized concurrently before it);
+        # on_step (async callable, no arguments) is awaited every time one of those batches is done
+        try:
+            semaphore = asyncio.Semaphore(max(1, self.summary_concurrency))
+
+            async def summarize(template: str, block: str, prompt: str) -> str:
+                async with semaphore:
+                    summary = await self._ainvoke(template, block, prompt)
+                if on_step is not None:
+                    await on_step()
+                return summary
+
+            async def final(template: str, block: str, prompt: str) -> str:
+                if on_token is not None:
+                    return await self._astream(template, block, prompt, on_token)
+                return await self._ainvoke(template, block, prompt)
+
+            blocks = pack_reviews(reviews, self.summary_budget)
+            if len(blocks) == 1:
+                return await final(self.prompt_summary, blocks[0], self.prompt_summary.format(reviews=blocks[0]))
+            partials = await asyncio.gather(*[
+                summarize(self.prompt_partial_summary, block, self.prompt_partial_summary.format(reviews=block)) for block in blocks
+            ])
+            while True:
+                blocks = self._pack_summaries(partials)
+                if len(blocks) == 1:
+                    return await final(self.prompt_merge_summaries, blocks[0], self.prompt_merge_summaries.format(summaries=blocks[0]))
+                partials = await asyncio.gather(*[
+                    summarize(self.prompt_merge_summaries, block, self.prompt_merge_summaries.format(summaries=block)) for block in blocks
+                ])
+        except Exception as e:
+            return f"{SUMMARY_ERROR}{str(e)}"
+
+    async def aget_reviews_statistics(self, reviews: list, narrative: bool = False) -> Dict[str, Any]:
+        try:
+            statistics = await asyncio.to_thread(compute_review_statistics, reviews)
+            if narrative:
+                statistics_json = json.dumps(statistics)
+                statistics["narrative"] = await self._ainvoke(self.prompt_stats, statistics_json, self.prompt_stats.format(statistics=statistics_json))
+            return statistics
         except Exception as e:
-            return f"Statistics calculation failed: {str(e)}"
+            return {"error": f"Statistics calculation failed: {str(e)}"}
@@ -1,86 +1,741 @@
 """
-Vector database management for product reviews using ChromaDB and Ollama embeddings.
+Vector database management for product reviews using ChromaDB (or an in-process NumPy index) and Ollama embeddings.
+
+    python vector.py --sync    # applies the CSV changes to the collection, e.g. from a nightly cron job
 """
+import argparse
+import hashlib
+import json
 import logging
 import os
+import threading
+import time
+import uuid
+import numpy as np
 import pandas as pd
 import chromadb
+from chromadb.api import ServerAPI
+from chromadb.api.client import Client
+from chromadb.config import Settings, System
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from langchain_chroma import Chroma
-from typing import List, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from langchain_ollama import OllamaEmbeddings
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from aggregates import ReviewAggregates
+from caches import LRUCache
+from cluster_summaries import ClusterSummaries
+from embedding_cache import cached_embeddings
+from lexical import BM25Index, reciprocal_rank_fusion
+from numpy_store import NumpyVectorStore
+
+REQUIRED_COLUMNS = ["Title","Date","Rating","Review"]
+TEXT_COLUMNS = {"Title": str, "Date": str, "Review": str} # read as text so values do not change type from one chunk to the next
+METADATA_VERSION = 2 # part of the document ids, bumped when the stored metadata changes so a sync re-adds every row (2: date_ts)
+
+def _fingerprints(df: pd.DataFrame) -> pd.Series:
+    # content hash of each csv row, used as a stable document id: the same review keeps the same id
+    # wherever it sits in the file, and any edit to the row produces a new id
+    ratings = pd.to_numeric(df["Rating"], errors="coerce")
+    rating_text = ratings.map("{:g}".format).where(ratings.notna(), "") # 4 and 4.0 must hash the same
+    raw = (f"v{METADATA_VERSION}\x1f" + df["Title"].fillna("").astype(str) + "\x1f" + df["Date"].fillna("").astype(str) + "\x1f"
+           + rating_text + "\x1f" + df["Review"].fillna("").astype(str))
+    return pd.Series([hashlib.sha256(r.encode("utf-8")).hexdigest() for r in raw], index=df.index)
 
 def _df_to_documents(df: pd.DataFrame) -> Tuple[List[Document], List[str]]:
-    #transforms a dataframe to a list of documents and ids
-    documents = []
-    ids = []
-    for i,row in df.iterrows():
-        content = f"{row['Title']} - {row['Review']}" if pd.notna(row['Title']) else row['Review']
-        doc = Document(
-            page_content=content,
-            metadata = {
-                "rating": float(row["Rating"]) if not pd.isna(row["Rating"]) else None,
-                "date": str(row["Date"]),
-                "title": row["Title"] if pd.notna(row["Title"]) else "No Title"
-            }
+    #transforms a dataframe to a list of documents and ids (duplicated rows are kept once)
+    #every field is computed column-wise, only the final Document objects are built row by row
+    df = df.assign(_id=_fingerprints(df)).drop_duplicates(subset="_id")
+    has_title = df["Title"].notna()
+    reviews = df["Review"].fillna("").astype(str)
+    contents = (df["Title"].astype(str) + " - " + reviews).where(has_title, reviews)
+    numeric_ratings = pd.to_numeric(df["Rating"], errors="coerce")
+    ratings = numeric_ratings.astype(object).where(numeric_ratings.notna(), None)
+    dates = df["Date"].astype(str)
+    parsed_dates = pd.to_datetime(df["Date"], errors="coerce")
+    # yyyymmdd as an integer: sortable, so date ranges are plain numeric comparisons in the vector store
+    date_ts = (parsed_dates.dt.year * 10000 + parsed_dates.dt.month * 100 + parsed_dates.dt.day)
+    date_ts = date_ts.astype(object).where(parsed_dates.notna(), None).map(lambda v: None if v is None else int(v))
+    titles = df["Title"].where(has_title, "No Title")
+
+    documents = [
+        Document(page_content=content, metadata={"rating": rating, "date": date, "date_ts": ts, "title": title})
+        for content, rating, date, ts, title in zip(contents, ratings, dates, date_ts, titles)
+    ]
+    return documents, df["_id"].tolist()
+
+def _date_bound(value: str, upper: bool) -> int:
+    # "2023", "2023-05" or "2023-05-17" -> yyyymmdd, a partial date covers the whole year or month
+    try:
+        parts = [int(p) for p in str(value).strip().split("-")]
+    except ValueError:
+        parts = []
+    if 1 <= len(parts) <= 3:
+        year, month, day = (parts + ([12, 31] if upper else [1, 1])[len(parts) - 1:])[:3]
+        if 1 <= month <= 12 and 1 <= day <= 31: # out of range parts would give a bound that silently matches nothing
+            return year * 10000 + month * 100 + day
+    raise ValueError(f"Invalid date: {value} (expected YYYY, YYYY-MM or YYYY-MM-DD)")
+
+def build_where(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Turns {"min_rating", "max_rating", "date_from", "date_to"} (all optional) into a chroma-style where clause"""
+    if not filters:
+        return None
+    conditions = []
+    if filters.get("min_rating") is not None:
+        conditions.append({"rating": {"$gte": float(filters["min_rating"])}})
+    if filters.get("max_rating") is not None:
+        conditions.append({"rating": {"$lte": float(filters["max_rating"])}})
+    if filters.get("date_from"):
+        conditions.append({"date_ts": {"$gte": _date_bound(filters["date_from"], upper=False)}})
+    if filters.get("date_to"):
+        conditions.append({"date_ts": {"$lte": _date_bound(filters["date_to"], upper=True)}})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions} # chroma rejects an $and with a single clause
+
+def _filters_key(filters: Optional[Dict[str, Any]]) -> tuple:
+    return tuple(sorted((key, value) for key, value in (filters or {}).items() if value is not None))
+
+def _rebatched(chunks: Iterable[Tuple[List[Document], List[str]]], batch_size: int) -> Iterator[Tuple[List[Document], List[str]]]:
+    # turns chunks of any size (a whole list, csv chunks, filtered csv chunks) into batches of exactly batch_size;
+    # an id repeated within a batch is dropped, since duplicate ids make the upsert fail. Only the current batch is tracked,
+    # so memory does not grow with the file: a row repeated in a later batch is upserted again, which changes nothing
+    pending: Dict[str, Document] = {} # id -> document, in order of first appearance
+    for documents, ids in chunks:
+        for document, doc_id in zip(documents, ids):
+            pending.setdefault(doc_id, document)
+            if len(pending) == batch_size:
+                yield list(pending.values()), list(pending)
+                pending = {}
+    if pending:
+        yield list(pending.values()), list(pending)
+
+class ChromaBackend:
+    """Vectors stored in a persistent ChromaDB collection (HNSW index)"""
+    name = "chroma"
+
+    def __init__(self, db_location: str, collection_name: str, embeddings: Embeddings):
+        self.db_location = db_location
+        self.collection_name = collection_name
+        self.embeddings = embeddings
+        self.store = self._open()
+
+    def _open(self) -> Chroma:
+        # a chroma system of our own: a PersistentClient reuses the one of the path, whose in-memory index never sees the writes
+        # of another process, so reload() could only refresh it by clearing the systems of every chroma client of the process
+        settings = Settings()
+        settings.persist_directory = self.db_location
+        settings.is_persistent = True
+        system = System(settings)
+        system.instance(ServerAPI)
+        system.start()
+        return Chroma(
+            client=Client.from_system(system),
+            collection_name=self.collection_name,
+            embedding_function=self.embeddings,
+            collection_metadata={"hnsw:space": "cosine"} # same metric as the numpy backend; only used when the collection is created
         )
-        documents.append(doc)
-        ids.append(str(i))
-    return documents, ids
+
+    def reload(self) -> None:
+        # searches already running finish on the previous store, the retriever follows the backend (see BackendRetriever)
+        self.store = self._open()
+
+    @property
+    def distance(self) -> str:
+        return (self.store._collection.metadata or {}).get("hnsw:space", "l2")
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[Document]) -> None:
+        # embeddings are already computed, so the batch goes straight to the chroma collection
+        self.store._collection.upsert(
+            ids=ids,
+            embeddings=embeddings,
+            documents=[d.page_content for d in documents],
+            metadatas=[{k: v for k, v in d.metadata.items() if v is not None} for d in documents] # chroma rejects None values
+        )
+
+    def delete(self, ids: List[str]) -> None:
+        self.store.delete(ids=ids)
+
+    def reset(self) -> None:
+        self.store.reset_collection()
+
+    def count(self) -> int:
+        return self.store._collection.count() # answered by chroma without fetching any record
+
+    def ids(self) -> List[str]:
+        return self.store.get(include=[]).get("ids", []) # ids only, no documents or embeddings
+
+    def dimension(self) -> Optional[int]:
+        first = self.store._collection.get(limit=1, include=["embeddings"])
+        if first.get("embeddings") is None or len(first["embeddings"]) == 0:
+            return None
+        return len(first["embeddings"][0])
+
+    def sample_metadatas(self, limit: int) -> List[Dict[str, Any]]:
+        return self.store._collection.get(limit=limit, include=["metadatas"]).get("metadatas") or []
+
+    def metadatas(self, ids: List[str]) -> List[Dict[str, Any]]:
+        return [m or {} for m in self.store._collection.get(ids=ids, include=["metadatas"]).get("metadatas") or []]
+
+    def iter_records(self, batch_size: int = 1000, include_embeddings: bool = False) -> Iterator[Tuple[List[str], List[Document], Optional[np.ndarray]]]:
+        include = ["documents", "metadatas"] + (["embeddings"] if include_embeddings else [])
+        for offset in range(0, self.count(), batch_size):
+            page = self.store._collection.get(limit=batch_size, offset=offset, include=include)
+            documents = [Document(id=i, page_content=c, metadata=m or {}) for i, c, m in zip(page["ids"], page["documents"], page["metadatas"])]
+            yield page["ids"], documents, (np.asarray(page["embeddings"], dtype=np.float32) if include_embeddings else None)
+
+    def _cosine_distances(self, distances: List[float]) -> np.ndarray:
+        # scores are cosine distances whatever the collection metric, so a similarity threshold means the same on every backend.
+        # Collections created before the metric was set use l2 (squared), which is twice the cosine distance for unit-length
+        # embeddings (those of the Ollama embedding models)
+        distances = np.asarray(distances, dtype=np.float64)
+        return distances / 2 if self.distance == "l2" else distances
+
+    def search_by_vector(self, embedding: List[float], k: int, where: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        # the where clause is evaluated by chroma during the search, so k matching documents come back without over-fetching
+        return self.search_by_vectors([embedding], k, where)[0]
+
+    def search_by_vectors(self, embeddings: List[List[float]], k: int, where: Optional[Dict[str, Any]] = None) -> List[List[Tuple[Document, float]]]:
+        # chroma answers several query embeddings with a single query call
+        if not embeddings:
+            return []
+        response = self.store._collection.query(query_embeddings=embeddings, n_results=k, where=where, include=["documents", "metadatas", "distances"])
+        return [
+            [(Document(id=i, page_content=c, metadata=m or {}), float(d)) for i, c, m, d in zip(ids, contents, metadatas, self._cosine_distances(distances))]
+            for ids, contents, metadatas, distances in zip(response["ids"], response["documents"], response["metadatas"], response["distances"])
+        ]
+
+    def score_ids(self, embedding: List[float], ids: List[str], where: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        # cosine distance between the query and documents that were not returned by the vector search
+        records = self.store._collection.get(ids=ids, where=where, include=["documents", "metadatas", "embeddings"])
+        if not records["ids"]:
+            return []
+        vectors = np.asarray(records["embeddings"], dtype=np.float32)
+        query = np.asarray(embedding, dtype=np.float32)
+        if self.distance == "cosine":
+            distances = 1 - (vectors @ query) / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query) + 1e-12)
+        else: # converted like the search results, so both sides of a hybrid search have the same scale
+            distances = self._cosine_distances(((vectors - query) ** 2).sum(axis=1) if self.distance == "l2" else 1 - vectors @ query)
+        order = {doc_id: position for position, doc_id in enumerate(ids)}
+        results = [
+            (Document(id=i, page_content=c, metadata=m or {}), float(d))
+            for i, c, m, d in zip(records["ids"], records["documents"], records["metadatas"], distances)
+        ]
+        return sorted(results, key=lambda item: order[item[0].id])
+
+class NumpyBackend:
+    """Vectors stored as a memory-mapped float32 matrix and searched in process with exact cosine top-k"""
+    name = "numpy"
+    distance = "cosine"
+
+    def __init__(self, db_location: str, collection_name: str, embeddings: Embeddings):
+        self.store = NumpyVectorStore(os.path.join(db_location, f"{collection_name}_numpy"), embeddings)
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[Document]) -> None:
+        self.store.upsert_embeddings(ids, embeddings, documents)
+
+    def delete(self, ids: List[str]) -> None:
+        self.store.delete(ids=ids)
+
+    def reset(self) -> None:
+        self.store.reset()
+
+    def reload(self) -> None:
+        self.store.reload()
+
+    def count(self) -> int:
+        return self.store.count()
+
+    def ids(self) -> List[str]:
+        return self.store.ids()
+
+    def dimension(self) -> Optional[int]:
+        return self.store.dimension
+
+    def sample_metadatas(self, limit: int) -> List[Dict[str, Any]]:
+        return self.store.sample_metadatas(limit)
+
+    def metadatas(self, ids: List[str]) -> List[Dict[str, Any]]:
+        return [d.metadata for d in self.store.get_by_ids(ids)]
+
+    def iter_records(self, batch_size: int = 1000, include_embeddings: bool = False) -> Iterator[Tuple[List[str], List[Document], Optional[np.ndarray]]]:
+        return self.store.iter_records(batch_size, include_embeddings)
+
+    def search_by_vector(self, embedding: List[float], k: int, where: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        return self.store.similarity_search_by_vector_with_score(embedding, k, filter=where)
+
+    def search_by_vectors(self, embeddings: List[List[float]], k: int, where: Optional[Dict[str, Any]] = None) -> List[List[Tuple[Document, float]]]:
+        return self.store.similarity_search_by_vectors_with_score(embeddings, k, filter=where)
+
+    def score_ids(self, embedding: List[float], ids: List[str], where: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        return self.store.score_ids(embedding, ids, where)
+
+BACKENDS = {"chroma": ChromaBackend, "numpy": NumpyBackend}
+
+class BackendRetriever(BaseRetriever):
+    """Langchain retriever over the current store of a backend: unlike store.as_retriever(), it keeps working
+        after the backend reopened its store to see the writes of another process
+    """
+    backend: Any
+    k: int = 10
+
+    @property
+    def vectorstore(self):
+        return self.backend.store
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return self.backend.store.similarity_search(query, k=self.k)
 
 class ReviewsVectorStore:
 
-    def __init__(self, csv_file_path: str = "reviews.csv", db_location: str = "./chroma_db", embedding_model: str = "mxbai-embed-large", collection_name: str = "gaming_reviews"):
+    def __init__(self, csv_file_path: str = "reviews.csv", db_location: str = "./chroma_db", embedding_model: str = "mxbai-embed-large", collection_name: str = "gaming_reviews", embeddings: Optional[Embeddings] = None,
+                 batch_size: int = 64, max_in_flight: int = 4, csv_chunk_size: int = 10000, embedding_cache_mb: Optional[float] = 512, backend: str = "chroma",
+                 query_cache_size: int = 1024, result_cache_size: int = 256):
         self.csv_file_path = csv_file_path
         self.db_location = db_location
         self.embedding_model = embedding_model
         self.collection_name = collection_name
-        self.embeddings = OllamaEmbeddings(model=embedding_model)
-
-        self.vector_store = Chroma(
-            client=chromadb.PersistentClient(path=db_location),
-            collection_name=collection_name,
-            embedding_function=self.embeddings
+        self.batch_size = batch_size # documents embedded per request to the embedding model
+        self.max_in_flight = max_in_flight # embedding requests running at the same time during ingestion
+        self.csv_chunk_size = csv_chunk_size # csv rows held in memory at once while streaming the file
+        # embeddings are cached on disk by (model, text), so rebuilds and repeated queries skip the embedding model
+        self.embeddings = cached_embeddings(
+            embeddings if embeddings is not None else OllamaEmbeddings(model=embedding_model),
+            embedding_model, db_location, embedding_cache_mb
         )
 
-    def load_csv(self) -> pd.DataFrame:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown vector backend: {backend} (available: {list(BACKENDS)})")
+        self.backend = BACKENDS[backend](db_location, collection_name, self.embeddings)
+        # BM25 index over the same documents, updated together with the vectors and used by hybrid_search
+        self.lexical_index = BM25Index(os.path.join(db_location, f"{collection_name}_bm25.pkl"))
+        # rating counters by month and title keyword, updated with every write and read by get_aggregates without any retrieval
+        self.aggregates = ReviewAggregates(os.path.join(db_location, f"{collection_name}_aggregates.json"))
+        # summaries of review clusters, built offline by clusters.py (empty until then)
+        self.clusters = ClusterSummaries(os.path.join(db_location, f"{collection_name}_clusters.json"))
+        # hot queries skip the embedding model (query text -> vector) and the search itself (query + options -> results);
+        # results are keyed by the collection generation, bumped on every write, so they are never served stale
+        self.query_vectors = LRUCache(query_cache_size)
+        self.query_results = LRUCache(result_cache_size)
+        self._generation = 0
+        # every write also stores a new random token in db_location: a different token on disk means that another process
+        # (e.g. `python vector.py --sync` from cron, next to a running server) changed the collection, see refresh()
+        self._generation_path = os.path.join(db_location, f"{collection_name}_generation")
+        self._generation_token = self._read_generation_token()
+        self._refresh_lock = threading.Lock()
+
+    def _validate_csv(self) -> None:
         if not os.path.exists(self.csv_file_path):
             raise FileNotFoundError(f"CSV file not found: {self.csv_file_path}")
-        else:
-            df = pd.read_csv(self.csv_file_path)
-            required_columns = ["Title","Date","Rating","Review"]
-            missing_columns = [c for c in required_columns if c not in df.columns]
-            if missing_columns:
-                raise ValueError(f"Missing required columns: {missing_columns}")
-            return df
-
-    def init_database(self, auto_recreate: bool = False) -> None:
+        header = pd.read_csv(self.csv_file_path, nrows=0) # header only
+        missing_columns = [c for c in REQUIRED_COLUMNS if c not in header.columns]
+        if missing_columns:
+            raise ValueError(f"Missing required columns: {missing_columns}")
+
+    def load_csv(self) -> pd.DataFrame:
+        self._validate_csv()
+        return pd.read_csv(self.csv_file_path, dtype=TEXT_COLUMNS)
+
+    def iter_csv_documents(self) -> Iterator[Tuple[List[Document], List[str]]]:
+        """Stream the CSV as (documents, ids) chunks of csv_chunk_size rows, so memory does not grow with the file size"""
+        self._validate_csv()
+        for chunk in pd.read_csv(self.csv_file_path, usecols=REQUIRED_COLUMNS, dtype=TEXT_COLUMNS, chunksize=self.csv_chunk_size):
+            yield _df_to_documents(chunk)
+
+    def init_database(self, auto_recreate: bool = False, sync: bool = False) -> None:
         if not os.path.exists(self.db_location):
             raise FileNotFoundError(f"Database directory not found: {self.db_location}")
         if auto_recreate:
             try:
-                self.vector_store.delete_collection()
-                documents, ids = _df_to_documents(self.load_csv())
-                self.vector_store.add_documents(documents=documents, ids=ids) # vector store is a ChromaDB object used to store documents and their embeddings
+                self._validate_csv()
+                source_key = self._csv_source_key()
+                if not self._load_checkpoint(source_key, self.batch_size): # an unfinished rebuild of the same CSV is resumed instead of restarted
+                    self.backend.reset()
+                    self.lexical_index.clear()
+                    self.aggregates.clear()
+                    self._collection_changed()
+                self.ingest_stream(self.iter_csv_documents(), source_key=source_key) # vector store is a ChromaDB object used to store documents and their embeddings
             except Exception as e:
                 logging.error(f"Error recreating database: {e}")
                 raise e
+        elif sync:
+            try:
+                self.sync_database()
+            except Exception as e:
+                logging.error(f"Error syncing database: {e}")
+                raise e
         else:
             try:
-                columns = self.vector_store.get()
-                size = len(columns.get("ids", []))
+                size = self.get_number_of_vectors()
                 logging.info(f"Database size: {size}")
-                if size == 0:
-                    logging.info("Database is empty. Loading data from CSV and adding to ChromaDB.")
-                    documents, ids = _df_to_documents(self.load_csv()) #_ before the name of the function means that it is private
-                    self.vector_store.add_documents(documents=documents, ids=ids)
+                source_key = self._csv_source_key() if os.path.exists(self.csv_file_path) else None
+                if size == 0 or (source_key and self._load_checkpoint(source_key, self.batch_size)):
+                    logging.info("Database is empty or partially loaded. Loading data from CSV and adding to ChromaDB.")
+                    self.ingest_stream(self.iter_csv_documents(), source_key=source_key)
+                else:
+                    if self.lexical_index.size != size:
+                        logging.info("Lexical index out of date. Rebuilding it from the stored documents.")
+                        self.rebuild_lexical_index()
+                    if self.aggregates.documents != size:
+                        logging.info("Aggregate tables out of date. Rebuilding them from the stored documents.")
+                        self.rebuild_aggregates()
+                if size > 0 and "date_ts" not in (self.backend.sample_metadatas(1) or [{}])[0]:
+                    logging.warning("Collection created by an older version: date filters will not match. Run init_database(sync=True) to update it.")
             except Exception as e:
                 logging.error(f"Error initializing database: {e}")
                 raise e
 
-    def get_number_of_vectors(self):
-        return len(self.vector_store.get().get("ids", []))
+    def sync_database(self) -> Dict[str, int]:
+        """Bring the collection in line with the CSV, embedding only the rows that are not stored yet.
+            Ids are content hashes, so an edited row shows up as one deletion plus one addition.
+        """
+        existing_ids = set(self.backend.ids())
+        csv_ids = set()
+        added_ids = set()
+
+        def new_rows() -> Iterator[Tuple[List[Document], List[str]]]:
+            # only the ids of the csv are kept in memory, the rows themselves are streamed to the embedding stage
+            for documents, ids in self.iter_csv_documents():
+                csv_ids.update(ids)
+                unindexed = [i for i, doc_id in enumerate(ids) if doc_id in existing_ids and doc_id not in self.lexical_index]
+                if unindexed: # stored by an interrupted run before the lexical index was saved
+                    self.lexical_index.add([ids[i] for i in unindexed], [documents[i].page_content for i in unindexed])
+                keep = [i for i, doc_id in enumerate(ids) if doc_id not in existing_ids and doc_id not in added_ids]
+                added_ids.update(ids[i] for i in keep)
+                yield [documents[i] for i in keep], [ids[i] for i in keep]
+
+        self.ingest_stream(new_rows())
+
+        stale_ids = list(existing_ids - csv_ids)
+        if stale_ids:
+            self.aggregates.remove(self.backend.metadatas(stale_ids)) # read before the delete, the counters need the old metadata
+            self.backend.delete(stale_ids)
+            self.lexical_index.remove(stale_ids)
+        self.lexical_index.save()
+        self.aggregates.save()
+        if stale_ids: # after the saves, so other processes reload the final index and tables
+            self._collection_changed()
+
+        report = {
+            "added": len(added_ids),
+            "deleted": len(stale_ids),
+            "unchanged": len(csv_ids & existing_ids),
+            "total": len(csv_ids)
+        }
+        logging.info(f"Sync report: {report}")
+        return report
+
+    def ingest_documents(self, documents: List[Document], ids: List[str], batch_size: Optional[int] = None,
+                         max_in_flight: Optional[int] = None, source_key: Optional[str] = None) -> Dict[str, Any]:
+        return self.ingest_stream([(documents, ids)], batch_size, max_in_flight, source_key)
+
+    def ingest_stream(self, chunks: Iterable[Tuple[List[Document], List[str]]], batch_size: Optional[int] = None,
+                      max_in_flight: Optional[int] = None, source_key: Optional[str] = None) -> Dict[str, Any]:
+        """Embed and store documents in batches, keeping up to max_in_flight embedding requests running at once.
+            Chunks are consumed lazily, so only the batches being embedded are held in memory.
+            Each batch is written to Chroma as soon as its embeddings are ready. When a source_key is given,
+            finished batches are checkpointed on disk and skipped if the same ingestion is started again after a failure.
+        """
+        batch_size = batch_size or self.batch_size
+        max_in_flight = max_in_flight or self.max_in_flight
+        completed = self._load_checkpoint(source_key, batch_size) if source_key else set()
+
+        start_time = time.perf_counter()
+        written = 0
+        skipped = 0
+
+        def embed(batch_docs: List[Document]) -> List[List[float]]:
+            return self.embeddings.embed_documents([d.page_content for d in batch_docs])
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            in_flight = {}
+
+            def collect(futures):
+                nonlocal written
+                for future in futures:
+                    index, batch_docs, batch_ids = in_flight.pop(future)
+                    # upsert keeps a batch that is written twice (e.g. after a crash before its checkpoint) idempotent
+                    self.backend.upsert(batch_ids, future.result(), batch_docs)
+                    self.aggregates.add(d.metadata for d in batch_docs)
+                    self._collection_changed(publish=False) # other processes are told once, when the files are saved
+                    written += len(batch_ids)
+                    if source_key:
+                        completed.add(index)
+                        self._save_checkpoint(source_key, batch_size, completed)
+                    elapsed = time.perf_counter() - start_time
+                    logging.info(f"Ingested batch {index}: {written + skipped} documents ({written / elapsed:.1f} docs/sec)")
+
+            for index, (batch_docs, batch_ids) in enumerate(_rebatched(chunks, batch_size)):
+                # tokenizing is cheap, so batches skipped on resume are indexed again instead of checkpointing the lexical index
+                self.lexical_index.add(batch_ids, [d.page_content for d in batch_docs])
+                if index in completed:
+                    skipped += len(batch_ids)
+                    continue
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                in_flight[executor.submit(embed, batch_docs)] = (index, batch_docs, batch_ids)
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        self.lexical_index.save()
+        if self.aggregates.documents != self.backend.count():
+            # counters are not idempotent: batches skipped on resume, or written twice, are recounted from the collection
+            self.rebuild_aggregates()
+        else:
+            self.aggregates.save()
+        self._collection_changed() # batches skipped on resume were added to the lexical index only
+        if source_key:
+            self._clear_checkpoint()
+
+        elapsed = time.perf_counter() - start_time
+        report = {
+            "documents": written,
+            "skipped": skipped,
+            "seconds": round(elapsed, 3),
+            "docs_per_sec": round(written / elapsed, 1) if elapsed > 0 else 0.0
+        }
+        logging.info(f"Ingestion report: {report}")
+        return report
+
+    def rebuild_lexical_index(self) -> None:
+        self.lexical_index.clear()
+        for ids, documents, _ in self.backend.iter_records():
+            self.lexical_index.add(ids, [d.page_content for d in documents])
+        self.lexical_index.save()
+        self._collection_changed()
+
+    def rebuild_aggregates(self) -> None:
+        self.aggregates.clear()
+        for _, documents, _ in self.backend.iter_records():
+            self.aggregates.add(d.metadata for d in documents)
+        self.aggregates.save()
+
+    def get_aggregates(self, group_by: str = "year", keyword: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+        """Rating counts, averages and histograms over the whole collection, see ReviewAggregates.query"""
+        self.refresh()
+        return self.aggregates.query(group_by, keyword, limit)
+
+    @property
+    def generation(self) -> int:
+        """Bumped on every change of the collection, made by this process or by another one (see refresh)"""
+        self.refresh()
+        return self._generation
+
+    def _read_generation_token(self) -> Optional[str]:
+        try:
+            with open(self._generation_path, "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError: # written by the first change
+            return None
 
-    def get_retriever(self, k: int = 10):
+    def _collection_changed(self, publish: bool = True) -> None:
+        self._generation += 1
+        self.query_results.clear() # entries of older generations can no longer be hit, free them right away
+        if not publish:
+            return
+        token = uuid.uuid4().hex
+        tmp_path = f"{self._generation_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(token)
+        os.replace(tmp_path, self._generation_path)
+        self._generation_token = token
+
+    def refresh(self) -> bool:
+        """Picks up the changes made to the collection by another process: when the token on disk is not the last one seen,
+            the backend, the lexical index, the aggregate tables and the cluster summaries are read again and the cached results dropped.
+            Called on every cached lookup; costs one small file read when nothing changed. Returns True after a reload.
+        """
+        if self._read_generation_token() == self._generation_token:
+            return False
+        with self._refresh_lock:
+            token = self._read_generation_token()
+            if token == self._generation_token: # reloaded by another thread meanwhile
+                return False
+            logging.info("Collection changed by another process. Reloading it.")
+            self.backend.reload()
+            if os.path.exists(self.lexical_index.path):
+                self.lexical_index.load()
+            if os.path.exists(self.aggregates.path):
+                self.aggregates.load()
+            if self.clusters.saved():
+                self.clusters.load()
+            self._generation_token = token
+            self._generation += 1
+            self.query_results.clear()
+        return True
+
+    def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        # query vectors only depend on the text, so they stay valid across collection changes
+        vectors = [self.query_vectors.get(query) for query in queries]
+        missing = list(dict.fromkeys(query for query, vector in zip(queries, vectors) if vector is None))
+        if missing:
+            computed = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            for query, vector in computed.items():
+                self.query_vectors.put(query, vector)
+            vectors = [computed[query] if vector is None else vector for query, vector in zip(queries, vectors)]
+        return vectors
+
+    def embed_query(self, query: str) -> List[float]:
+        # same (cached) vector used by the searches, also used by the agent to look up paraphrased queries
+        return self._embed_queries([query])[0]
+
+    def _cached_results(self, keys: List[tuple], search) -> list:
+        # search(positions) runs the queries at the given positions only, the others are answered from the result cache
+        generation = self.generation # read before searching, a write during the search makes these entries unreachable
+        keys = [key + (generation,) for key in keys]
+        results = [self.query_results.get(key) for key in keys]
+        missing = [i for i, cached in enumerate(results) if cached is None]
+        if missing:
+            for i, computed in zip(missing, search(missing)):
+                self.query_results.put(keys[i], tuple(computed))
+                results[i] = computed
+        return [list(r) for r in results]
+
+    def similarity_search(self, query: str, k: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """Dense search returning (document, cosine distance) pairs; filters (see build_where) are applied inside the search"""
+        return self.similarity_search_batch([query], k, filters)[0]
+
+    def similarity_search_batch(self, queries: List[str], k: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[List[Tuple[Document, float]]]:
+        """similarity_search for several queries: one embedding call and one batched backend query, results in query order"""
+        where = build_where(filters)
+        keys = [("dense", query, k, _filters_key(filters)) for query in queries]
+        return self._cached_results(keys, lambda positions: self.backend.search_by_vectors(
+            self._embed_queries([queries[i] for i in positions]), k, where
+        ))
+
+    def hybrid_search(self, query: str, k: int = 5, keywords: Optional[List[str]] = None, candidates: Optional[int] = None,
+                      rrf_k: int = 60, filters: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float, float]]:
+        """Fuses the dense ranking of the query with the BM25 ranking of the keywords (reciprocal rank fusion).
+            Returns (document, cosine distance, fused score) triples, the best first; the distance is also computed for documents
+            found by BM25 only, so callers can apply the same similarity threshold as a dense search.
+        """
+        return self.hybrid_search_batch([query], k, [keywords], candidates, rrf_k, filters)[0]
+
+    def hybrid_search_batch(self, queries: List[str], k: int = 5, keywords: Optional[List[Optional[List[str]]]] = None, candidates: Optional[int] = None,
+                            rrf_k: int = 60, filters: Optional[Dict[str, Any]] = None) -> List[List[Tuple[Document, float, float]]]:
+        """hybrid_search for several queries (keywords[i] belongs to queries[i]): the dense side is embedded and searched in one batch"""
+        candidates = candidates or max(4 * k, 20)
+        keyword_lists = [list(query_keywords or [query]) for query, query_keywords in zip(queries, keywords or [None] * len(queries))]
+        where = build_where(filters)
+
+        def search(positions: List[int]) -> List[List[Tuple[Document, float, float]]]:
+            embeddings = self._embed_queries([queries[i] for i in positions])
+            dense = self.backend.search_by_vectors(embeddings, candidates, where)
+            return [self._fuse(embedding, hits, keyword_lists[i], k, candidates, rrf_k, where) for i, embedding, hits in zip(positions, embeddings, dense)]
+
+        keys = [("hybrid", query, tuple(keyword_list), k, candidates, rrf_k, _filters_key(filters)) for query, keyword_list in zip(queries, keyword_lists)]
+        return self._cached_results(keys, search)
+
+    def _fuse(self, embedding: List[float], dense: List[Tuple[Document, float]], keywords: List[str], k: int, candidates: int,
+              rrf_k: int, where: Optional[Dict[str, Any]]) -> List[Tuple[Document, float, float]]:
+        lexical = self.lexical_index.search(keywords, candidates)
+        by_id = {doc.id: (doc, distance) for doc, distance in dense}
+        missing = [doc_id for doc_id, _ in lexical if doc_id not in by_id]
+        if missing: # one batched read, which also drops the lexical matches that do not pass the filters
+            by_id.update({doc.id: (doc, distance) for doc, distance in self.backend.score_ids(embedding, missing, where)})
+        lexical_ids = [doc_id for doc_id, _ in lexical if doc_id in by_id]
+        fused = reciprocal_rank_fusion([[doc.id for doc, _ in dense], lexical_ids], rrf_k)[:k]
+        return [(by_id[doc_id][0], by_id[doc_id][1], score) for doc_id, score in fused]
+
+    def _checkpoint_path(self) -> str:
+        return os.path.join(self.db_location, f"{self.collection_name}.ingest_checkpoint.json")
+
+    def _csv_source_key(self) -> str:
+        # identifies a given version of the csv file, so a checkpoint is never applied to a different file
+        stat = os.stat(self.csv_file_path)
+        return f"{os.path.abspath(self.csv_file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _load_checkpoint(self, source_key: str, batch_size: int) -> set:
+        path = self._checkpoint_path()
+        if not os.path.exists(path):
+            return set()
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        # batch indexes only mean something for the same source split with the same batch size
+        if checkpoint.get("source") != source_key or checkpoint.get("batch_size") != batch_size:
+            return set()
+        return set(checkpoint.get("completed_batches", []))
+
+    def _save_checkpoint(self, source_key: str, batch_size: int, completed: set) -> None:
+        path = self._checkpoint_path()
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"source": source_key, "batch_size": batch_size, "completed_batches": sorted(completed)}, f)
+        os.replace(path + ".tmp", path) # atomic, a crash while writing never leaves a broken checkpoint
+
+    def _clear_checkpoint(self) -> None:
+        if os.path.exists(self._checkpoint_path()):
+            os.remove(self._checkpoint_path())
+
+    def get_embedding_cache_stats(self) -> Dict[str, Any]:
+        return self.embeddings.stats() if hasattr(self.embeddings, "stats") else {}
+
+    def get_query_cache_stats(self) -> Dict[str, Any]:
+        return {"vectors": self.query_vectors.stats(), "results": self.query_results.stats(), "generation": self.generation}
+
+    def get_number_of_vectors(self) -> int:
+        return self.backend.count()
+
+    def get_stats(self, sample_size: int = 100) -> Dict[str, Any]:
+        """Collection size, a metadata summary and the embedding dimension, without loading the collection.
+            The metadata summary is computed on the first sample_size records only.
+        """
+        count = self.backend.count()
+        stats = {
+            "collection": self.collection_name,
+            "backend": self.backend.name,
+            "count": count,
+            "embedding_model": self.embedding_model,
+            "embedding_dimension": None,
+            "distance": self.backend.distance,
+            "metadata_summary": {},
+            "embedding_cache": self.get_embedding_cache_stats(),
+            "query_cache": self.get_query_cache_stats()
+        }
+        if count == 0:
+            return stats
+
+        stats["embedding_dimension"] = self.backend.dimension()
+        metadatas = self.backend.sample_metadatas(sample_size)
+        ratings = [m["rating"] for m in metadatas if isinstance(m.get("rating"), (int, float))]
+        dates = [m["date"] for m in metadatas if m.get("date") and m["date"] != "nan"]
+        stats["metadata_summary"] = {
+            "sampled": len(metadatas),
+            "fields": sorted({key for m in metadatas for key in m}),
+            "rating": {"min": min(ratings), "max": max(ratings), "mean": round(sum(ratings) / len(ratings), 3)} if ratings else None,
+            "date": {"min": min(dates), "max": max(dates)} if dates else None
+        }
+        return stats
+
+    @property
+    def vector_store(self):
+        # langchain vector store of the backend, replaced when the collection is reloaded (see refresh)
+        return self.backend.store
+
+    def get_retriever(self, k: int = 10) -> "BackendRetriever":
         k = max(1, min(50, int(k)))
-        return self.vector_store.as_retriever(search_kwargs={"k": k})
\ No newline at end of file
+        return BackendRetriever(backend=self.backend, k=k)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sync", action="store_true", help="Embed only the new or edited CSV rows and delete the removed ones")
+    parser.add_argument("--recreate", action="store_true", help="Rebuild the whole collection from the CSV")
+    parser.add_argument("--csv", default="reviews.csv")
+    parser.add_argument("--backend", default="chroma", choices=list(BACKENDS))
+    args = parser.parse_args()
+    if args.sync == args.recreate:
+        parser.error("choose one of --sync or --recreate")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    store = ReviewsVectorStore(csv_file_path=args.csv, backend=args.backend)
+    if args.sync:
+        print(json.dumps(store.sync_database()))
+    else:
+        store.init_database(auto_recreate=True)
+    print(json.dumps(store.get_stats(), default=str))
+
+if __name__ == "__main__":
+    main()